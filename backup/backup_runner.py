@@ -1,46 +1,603 @@
+"""
+Ledger backups.
+
+Each backup is a manifest (JSON) listing the ledger and every file it
+includes, each as a list of fixed-size chunks. Chunks are stored gzipped
+under `chunks/`, named by the SHA-256 of their content, so a chunk shared
+by several backups (the unchanged start of an append-mostly ledger) is
+stored and uploaded once. A run where no file changed writes nothing.
+
+Between full backups, the records of the brain's append journal
+(LEDGER_JOURNAL_DIR) are shipped as small segments under `journal/`: a
+watched run only ships what was appended since the last one, and takes a
+full backup only when the journal doesn't account for every change (e.g.
+the ledger was edited in Fava). Restoring `latest` or `--at` a time
+replays the records onto the last full backup before it.
+
+By default the ledger's directory is watched (inotify, or polling where
+inotify isn't available) and a backup is taken once writes have settled
+for BACKUP_DEBOUNCE_SECONDS, at most BACKUP_MAX_PER_HOUR times an hour,
+on top of the daily one. BACKUP_MODE=daily only keeps the daily backup.
+
+    python backup_runner.py                  # watched + daily backups (default)
+    python backup_runner.py once             # one backup now
+    python backup_runner.py list             # available backups
+    python backup_runner.py restore latest --output /tmp/restored
+    python backup_runner.py restore --at 2025-08-01T18:30 --output /tmp/restored
+    python backup_runner.py restore latest --from-remote --output /tmp/restored
+    python backup_runner.py prune            # apply retention now
+"""
+import argparse
+import fcntl
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-import subprocess
 
+from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from beancount.parser import parser
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
 # Config
 LEDGER_PATH = Path("/data/budget.beancount")
 BACKUP_DIR = Path("/data/backups")
-RCLONE_REMOTE = "gdrive"
-RCLONE_REMOTE_FOLDER = "beancount-backups"
+CHUNK_DIR = BACKUP_DIR / "chunks"
+MANIFEST_DIR = BACKUP_DIR / "manifests"
+SEGMENT_DIR = BACKUP_DIR / "journal"
+JOURNAL_DIR = Path(os.getenv("LEDGER_JOURNAL_DIR", "/data/.beanbrain-journal"))  # written by the brain
+# RCLONE_REMOTE=:local with RCLONE_REMOTE_FOLDER=/some/dir backs up to a local directory
+RCLONE_REMOTE = os.getenv("RCLONE_REMOTE", "gdrive")
+RCLONE_REMOTE_FOLDER = os.getenv("RCLONE_REMOTE_FOLDER", "beancount-backups")
+REMOTE_FOLDERS = ("chunks", "manifests", "journal")
 BACKUP_HOUR = 0  # Run every day at 00:00 AM
 MISSING_GRACE_TIME = 3600  # 1 hour window to still run missed jobs
+CHUNK_SIZE = 1024 * 1024  # Ledgers are append-mostly: all but the last chunks repeat
+# Retention: every backup of the last hour, then the newest of each of the last N hours / days / months
+KEEP_HOURLY = 24
+KEEP_DAILY = 30
+KEEP_MONTHLY = 24
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H%M%S"
+# Write-triggered backups
+BACKUP_MODE = os.getenv("BACKUP_MODE", "watch")  # "watch" or "daily"
+BACKUP_DEBOUNCE_SECONDS = float(os.getenv("BACKUP_DEBOUNCE_SECONDS", "30"))
+BACKUP_MAX_PER_HOUR = int(os.getenv("BACKUP_MAX_PER_HOUR", "6"))
+BACKUP_FORCE_POLLING = os.getenv("BACKUP_FORCE_POLLING", "0") == "1"
+POLL_INTERVAL_SECONDS = 5
+
+INCLUDE_RE = re.compile(r'^include\s+"([^"]+)"', re.MULTILINE)
+
+
+def ledger_files(ledger_path: Path) -> list:
+    """The ledger and every file it includes (recursively), ledger first."""
+    files, pending = [], [ledger_path.resolve()]
+    while pending:
+        path = pending.pop(0)
+        if path in files or not path.exists():
+            continue
+        files.append(path)
+        text = path.read_text(encoding="utf-8", errors="replace")
+        for pattern in INCLUDE_RE.findall(text):
+            pattern = pattern if os.path.isabs(pattern) else str(path.parent / pattern)
+            pending.extend(Path(p).resolve() for p in sorted(glob.glob(pattern, recursive=True)))
+    return files
+
+
+def _chunk_path(digest: str) -> Path:
+    return CHUNK_DIR / digest[:2] / f"{digest}.gz"
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=path.parent)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def store_bytes(content: bytes) -> tuple:
+    """Chunk file content into the chunk store; returns its chunk digests and how many were new."""
+    chunks, new_chunks = [], 0
+    for start in range(0, len(content), CHUNK_SIZE):
+        chunk = content[start:start + CHUNK_SIZE]
+        digest = hashlib.sha256(chunk).hexdigest()
+        chunks.append(digest)
+        target = _chunk_path(digest)
+        if not target.exists():
+            _write_atomic(target, gzip.compress(chunk, mtime=0))
+            new_chunks += 1
+    return chunks, new_chunks
+
+
+@contextmanager
+def ledger_lock():
+    """Shared lock on the ledger: the brain appends (and journals) under an exclusive one."""
+    with open(LEDGER_PATH, "rb") as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_ledger(previous: dict) -> dict:
+    """
+    Content of every ledger file that changed since the `previous` manifest
+    entries (None for unchanged ones). Call under `ledger_lock` so a
+    concurrent append is never half-captured.
+    """
+    root = LEDGER_PATH.resolve().parent
+    contents = {}
+    for path in ledger_files(LEDGER_PATH):
+        relative = os.path.relpath(path, root)
+        stat = path.stat()
+        entry = previous.get(relative)
+        if entry and (entry.get("size"), entry.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns):
+            contents[relative] = None
+        else:
+            contents[relative] = (path.read_bytes(), stat.st_mtime_ns)
+    return contents
+
+
+def ledger_sizes() -> dict:
+    root = LEDGER_PATH.resolve().parent
+    return {os.path.relpath(p, root): p.stat().st_size for p in ledger_files(LEDGER_PATH)}
+
+
+def parse_errors(relative: str, content: bytes) -> int:
+    _, errors, _ = parser.parse_string(content.decode("utf-8", errors="replace"), report_filename=relative)
+    return len(errors)
+
+
+# ---------- Append journal ----------
+
+def journal_dir() -> Path:
+    # Named like the brain's AppendJournal.path_for
+    tag = hashlib.sha1(str(LEDGER_PATH).encode("utf-8")).hexdigest()[:12]
+    return JOURNAL_DIR / f"{LEDGER_PATH.stem}-{tag}"
+
+
+def journal_id():
+    try:
+        return (journal_dir() / "journal-id").read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+
+
+def _records(lines) -> list:
+    # A line without its newline is still being written
+    return [json.loads(line) for line in lines if line.endswith(b"\n")]
+
+
+def read_journal(after: int) -> list:
+    """The brain's journal records after sequence number `after`."""
+    segments = sorted(journal_dir().glob("*.jsonl"))
+    records = []
+    for i, segment in enumerate(segments):
+        # Segments are named by their first record
+        if i + 1 < len(segments) and int(segments[i + 1].stem) <= after + 1:
+            continue
+        with open(segment, "rb") as f:
+            records.extend(r for r in _records(f) if r["seq"] > after)
+    return records
+
+
+def journal_position():
+    """Id and last sequence number of the brain's journal, if there is one."""
+    jid = journal_id()
+    segments = sorted(journal_dir().glob("*.jsonl"))
+    if jid is None or not segments:
+        return None
+    with open(segments[-1], "rb") as f:
+        records = _records(f)
+    return {"id": jid, "seq": records[-1]["seq"] if records else int(segments[-1].stem) - 1}
+
+
+def shipped_segments(jid: str) -> list:
+    """Shipped segments of a journal (`<first>-<last>.jsonl.gz`), oldest first."""
+    return sorted((SEGMENT_DIR / jid).glob("*.jsonl.gz"))
+
+
+def _segment_range(path: Path) -> tuple:
+    first, last = path.name[:-len(".jsonl.gz")].split("-")
+    return int(first), int(last)
+
+
+def read_shipped(jid: str, after: int) -> list:
+    records = []
+    for segment in shipped_segments(jid):
+        if _segment_range(segment)[1] > after:
+            lines = gzip.decompress(segment.read_bytes()).splitlines(keepends=True)
+            records.extend(r for r in _records(lines) if r["seq"] > after)
+    return records
+
+
+def ship_journal() -> int:
+    """
+    Copy the journal records not shipped yet into a new segment (call under
+    `ledger_lock`), then drop the brain's segments that are fully shipped.
+    Returns how many records were shipped.
+    """
+    jid = journal_id()
+    if jid is None:
+        return 0
+    segments = shipped_segments(jid)
+    shipped = _segment_range(segments[-1])[1] if segments else 0
+    records = read_journal(shipped)
+    if records:
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        name = f"{records[0]['seq']:012d}-{records[-1]['seq']:012d}.jsonl.gz"
+        _write_atomic(SEGMENT_DIR / jid / name, gzip.compress(lines, mtime=0))
+        shipped = records[-1]["seq"]
+
+    # The newest segment is still being appended to
+    brain_segments = sorted(journal_dir().glob("*.jsonl"))
+    for segment, following in zip(brain_segments, brain_segments[1:]):
+        if int(following.stem) - 1 <= shipped:
+            segment.unlink()
+    return len(records)
+
+
+def journal_covers(manifest: dict) -> bool:
+    """
+    Whether a backup plus the journal records shipped after it add up to the
+    ledger files as they are now (call under `ledger_lock`). Sizes only:
+    anything else is caught by the next full backup.
+    """
+    position = manifest.get("journal")
+    if not position or position["id"] != journal_id():
+        return False
+    sizes = {relative: entry["size"] for relative, entry in manifest["files"].items()}
+    seq = position["seq"]
+    for record in read_shipped(position["id"], seq):
+        if record["seq"] != seq + 1 or sizes.get(record["file"], 0) != record["offset"]:
+            return False
+        sizes[record["file"]] = record["offset"] + record["length"]
+        seq = record["seq"]
+    return sizes == ledger_sizes()
+
+
+def replay_journal(manifest: dict, output: Path, until: datetime = None) -> int:
+    """
+    Append the shipped journal records after a restored backup (up to
+    `until`) to the files under `output`; stops at the first record that
+    doesn't continue them. Returns how many were applied.
+    """
+    position = manifest.get("journal")
+    if not position:
+        return 0
+    seq = position["seq"]
+    applied = 0
+    for record in read_shipped(position["id"], seq):
+        if until is not None and record["ts"] > until.timestamp():
+            break
+        target = output / record["file"]
+        size = target.stat().st_size if target.exists() else 0
+        data = record["data"].encode("utf-8")
+        if (record["seq"] != seq + 1 or size != record["offset"]
+                or hashlib.sha256(data).hexdigest() != record["sha256"]):
+            print(f"The journal doesn't continue the ledger at record {seq + 1}; stopping there.")
+            break
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "ab") as f:
+            f.write(data)
+        seq = record["seq"]
+        applied += 1
+    return applied
+
+
+# ---------- Full backups ----------
+
+def list_manifests() -> list:
+    """Manifest paths, oldest first."""
+    return sorted(MANIFEST_DIR.glob("*.json"))
+
+
+def load_manifest(path: Path) -> dict:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+_backup_lock = threading.Lock()
+
 
 def run_backup_once():
+    """Take a full backup if any ledger file changed; returns the new manifest's path, if any."""
+    with _backup_lock:
+        return _backup(full=True)[0]
+
+
+def backup_changes() -> bool:
+    """
+    Ship the journal records appended since the last run, and take a full
+    backup only if they don't account for every change to the ledger.
+    Returns whether anything was backed up.
+    """
+    with _backup_lock:
+        manifest_path, shipped = _backup(full=False)
+        return manifest_path is not None or shipped > 0
+
+
+def _backup(full: bool) -> tuple:
     if not LEDGER_PATH.exists():
         print("Ledger file not found. Skipping backup.")
-        return
+        return None, 0
+
+    manifests = list_manifests()
+    latest = load_manifest(manifests[-1]) if manifests else None
+    previous = latest["files"] if latest else {}
+    with ledger_lock():
+        shipped = ship_journal()
+        if not full and latest is not None and journal_covers(latest):
+            if shipped:
+                print(f"Shipped {shipped} journal record(s)")
+                upload()
+            return None, shipped
+        contents = read_ledger(previous)
+        position = journal_position()
+
+    files = {}
+    new_chunks = 0
+    for relative, read in contents.items():
+        if read is None:
+            files[relative] = previous[relative]
+            continue
+        content, mtime_ns = read
+        digest = hashlib.sha256(content).hexdigest()
+        old = previous.get(relative)
+        if old and old["sha256"] == digest:
+            files[relative] = dict(old, mtime_ns=mtime_ns)
+            continue
+        # Existing errors don't block backups, new ones (e.g. a half-written entry) do
+        errors = parse_errors(relative, content)
+        if errors > (old or {}).get("parse_errors", 0):
+            print(f"{relative} has {errors} parse error(s). Skipping backup until it parses.")
+            return None, shipped
+        chunks, new = store_bytes(content)
+        new_chunks += new
+        files[relative] = {"size": len(content), "mtime_ns": mtime_ns, "sha256": digest,
+                           "parse_errors": errors, "chunks": chunks}
+
+    if {k: v["sha256"] for k, v in previous.items()} == {k: v["sha256"] for k, v in files.items()}:
+        print("Ledger unchanged since the last backup. Skipping.")
+        if shipped:
+            upload()
+        return None, shipped
 
-    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H%M")
-    backup_path = BACKUP_DIR / f"{LEDGER_PATH.stem}_{timestamp}{LEDGER_PATH.suffix}"
-    shutil.copy2(LEDGER_PATH, backup_path)
-    print(f"Created backup: {backup_path}")
+    created = datetime.now()
+    manifest = {
+        "created": created.isoformat(timespec="seconds"),
+        "ledger": os.path.relpath(LEDGER_PATH.resolve(), LEDGER_PATH.resolve().parent),
+        "chunk_size": CHUNK_SIZE,
+        # Journal records after this one are replayed on top of this backup
+        "journal": position,
+        "files": files,
+    }
+    manifest_path = MANIFEST_DIR / f"{LEDGER_PATH.stem}_{created.strftime(TIMESTAMP_FORMAT)}.json"
+    if manifests and manifest_path == manifests[-1]:
+        print("A backup was already taken this second. Skipping.")
+        return None, shipped
+    _write_atomic(manifest_path, json.dumps(manifest, indent=1).encode("utf-8"))
+    total = sum(len(f["chunks"]) for f in files.values())
+    print(f"Created backup: {manifest_path} ({len(files)} file(s), {new_chunks}/{total} new chunk(s))")
 
+    prune()
+    upload()
+    return manifest_path, shipped
+
+
+def upload():
+    # Chunks and segments never change once written, so only new ones are transferred
     try:
+        for folder in REMOTE_FOLDERS:
+            (BACKUP_DIR / folder).mkdir(parents=True, exist_ok=True)
+            subprocess.run([
+                "rclone", "copy", str(BACKUP_DIR / folder),
+                f"{RCLONE_REMOTE}:{RCLONE_REMOTE_FOLDER}/{folder}",
+                "--ignore-existing",
+            ], check=True)
+        print("Uploaded new chunks, manifests and journal segments")
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"Upload failed:\n{e}")
+
+
+def download():
+    """Fetch whatever the local store is missing from the remote (e.g. after losing the server)."""
+    for folder in REMOTE_FOLDERS:
         subprocess.run([
-            "rclone", "copy", str(backup_path),
-            f"{RCLONE_REMOTE}:{RCLONE_REMOTE_FOLDER}",
-            "--progress"
+            "rclone", "copy", f"{RCLONE_REMOTE}:{RCLONE_REMOTE_FOLDER}/{folder}",
+            str(BACKUP_DIR / folder), "--ignore-existing",
         ], check=True)
-        print(f"Uploaded to Google Drive: {backup_path.name}")
-    except subprocess.CalledProcessError as e:
-        print(f"Upload failed:\n{e}")
+    print(f"Downloaded backups from {RCLONE_REMOTE}:{RCLONE_REMOTE_FOLDER}")
 
-if __name__ == "__main__":
-    print("Starting backup service. Running initial backup...")
-    run_backup_once()
 
-    scheduler = BlockingScheduler()
+def _created(path: Path) -> datetime:
+    # <ledger stem>_<TIMESTAMP_FORMAT>
+    return datetime.strptime("_".join(path.stem.rsplit("_", 2)[-2:]), TIMESTAMP_FORMAT)
+
+
+def select_kept(manifests: list, now: datetime) -> set:
+    """Manifests kept by the hourly/daily/monthly retention policy (the latest is always kept)."""
+    kept = set(manifests[-1:])
+    newest_per_bucket = {}
+    for path in manifests:  # oldest first, so later ones win their bucket
+        created = _created(path)
+        age = now - created
+        if age.total_seconds() < 3600:
+            kept.add(path)
+        if age.total_seconds() <= KEEP_HOURLY * 3600:
+            newest_per_bucket[("hour", created.strftime("%Y-%m-%d %H"))] = path
+        if age.days < KEEP_DAILY:
+            newest_per_bucket[("day", created.strftime("%Y-%m-%d"))] = path
+        if (now.year - created.year) * 12 + now.month - created.month < KEEP_MONTHLY:
+            newest_per_bucket[("month", created.strftime("%Y-%m"))] = path
+    return kept | set(newest_per_bucket.values())
+
+
+def prune(now: datetime = None):
+    """Delete backups outside the retention policy, then chunks no backup uses."""
+    manifests = list_manifests()
+    kept = select_kept(manifests, now or datetime.now())
+    for path in manifests:
+        if path not in kept:
+            path.unlink()
+            print(f"Pruned backup: {path.name}")
+
+    used = set()
+    for path in kept:
+        for entry in load_manifest(path)["files"].values():
+            used.update(entry["chunks"])
+    removed = 0
+    for chunk in CHUNK_DIR.glob("*/*.gz"):
+        if chunk.name[:-len(".gz")] not in used:
+            chunk.unlink()
+            removed += 1
+    if removed:
+        print(f"Removed {removed} unused chunk(s)")
+
+    # Journal records from before the oldest kept backup have nothing to be replayed onto
+    oldest = {}
+    for path in kept:
+        position = load_manifest(path).get("journal")
+        if position:
+            oldest[position["id"]] = min(oldest.get(position["id"], position["seq"]), position["seq"])
+    current = journal_id()
+    for directory in SEGMENT_DIR.glob("*"):
+        if directory.name not in oldest and directory.name != current:
+            shutil.rmtree(directory)
+            continue
+        for segment in shipped_segments(directory.name):
+            if _segment_range(segment)[1] <= oldest.get(directory.name, 0):
+                segment.unlink()
 
 
+def find_manifest(name: str) -> Path:
+    manifests = list_manifests()
+    if not manifests:
+        raise SystemExit("No backups found.")
+    if name == "latest":
+        return manifests[-1]
+    matches = [m for m in manifests if name in m.stem]
+    if len(matches) != 1:
+        raise SystemExit(f"'{name}' matches {len(matches)} backups; use `list` to see them.")
+    return matches[0]
+
+
+def restore(name: str, output: Path, at: datetime = None):
+    """
+    Rebuild the files of a backup under `output`, checking every chunk and
+    file hash. For `latest` or a point in time `at`, the journal records
+    after the last backup before it are replayed on top.
+    """
+    replay = name == "latest" or at is not None
+    if at is not None:
+        candidates = [m for m in list_manifests() if _created(m) <= at]
+        if not candidates:
+            raise SystemExit(f"No backup before {at}.")
+        manifest_path = candidates[-1]
+    else:
+        manifest_path = find_manifest(name)
+    manifest = load_manifest(manifest_path)
+    for relative, entry in manifest["files"].items():
+        file_hash = hashlib.sha256()
+        target = output / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=target.parent)
+        with os.fdopen(fd, "wb") as f:
+            for digest in entry["chunks"]:
+                chunk = gzip.decompress(_chunk_path(digest).read_bytes())
+                if hashlib.sha256(chunk).hexdigest() != digest:
+                    os.unlink(tmp)
+                    raise SystemExit(f"Chunk {digest} is corrupted.")
+                file_hash.update(chunk)
+                f.write(chunk)
+        if file_hash.hexdigest() != entry["sha256"]:
+            os.unlink(tmp)
+            raise SystemExit(f"Restored {relative} doesn't match its backup.")
+        os.replace(tmp, target)
+        print(f"Restored {target}")
+    print(f"Restored backup {manifest_path.name} to {output}")
+    if replay:
+        print(f"Replayed {replay_journal(manifest, output, at)} journal record(s) on top")
+
+
+class LedgerWatcher(FileSystemEventHandler):
+    """
+    Takes a backup once the ledger files have gone BACKUP_DEBOUNCE_SECONDS
+    without a write, keeping to BACKUP_MAX_PER_HOUR watched backups an hour.
+    """
+
+    def __init__(self):
+        self._changed = threading.Event()
+        self._last_change = 0.0
+        self._taken = deque()  # monotonic times of watched backups in the last hour
+        self._refresh_files()
+
+    def _refresh_files(self):
+        self._files = {str(p) for p in ledger_files(LEDGER_PATH)} if LEDGER_PATH.exists() else set()
+        self._files.add(str(LEDGER_PATH.resolve()))
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        paths = {event.src_path, getattr(event, "dest_path", "") or event.src_path}
+        if any(str(Path(p).resolve()) in self._files for p in paths):
+            self._last_change = time.monotonic()
+            self._changed.set()
+
+    def run(self):
+        while True:
+            self._changed.wait()
+            now = time.monotonic()
+            wait = self._last_change + BACKUP_DEBOUNCE_SECONDS - now
+            while self._taken and now - self._taken[0] >= 3600:
+                self._taken.popleft()
+            if len(self._taken) >= BACKUP_MAX_PER_HOUR:
+                wait = max(wait, self._taken[0] + 3600 - now)
+            if wait > 0:
+                time.sleep(min(wait, BACKUP_DEBOUNCE_SECONDS))
+                continue
+            self._changed.clear()
+            try:
+                if backup_changes():
+                    self._taken.append(time.monotonic())
+            except Exception as e:
+                print(f"Backup failed:\n{e}")
+            # A new year shard may have been included
+            self._refresh_files()
+
+
+def _start_observer(handler: LedgerWatcher):
+    directory = str(LEDGER_PATH.resolve().parent)
+    if not BACKUP_FORCE_POLLING:
+        try:
+            observer = Observer()
+            observer.schedule(handler, directory, recursive=True)
+            observer.start()
+            print(f"Watching {directory} for ledger changes")
+            return observer
+        except OSError as e:
+            print(f"Can't watch {directory} ({e}), polling instead")
+    observer = PollingObserver(timeout=POLL_INTERVAL_SECONDS)
+    observer.schedule(handler, directory, recursive=True)
+    observer.start()
+    print(f"Polling {directory} for ledger changes every {POLL_INTERVAL_SECONDS}s")
+    return observer
+
+
+def _add_daily_job(scheduler):
     scheduler.add_job(
         run_backup_once,
         trigger=CronTrigger(hour=BACKUP_HOUR, minute=0),
@@ -49,6 +606,27 @@ if __name__ == "__main__":
         max_instances=1,
     )
 
+
+def run_scheduler():
+    print("Starting backup service. Running initial backup...")
+    run_backup_once()
+
+    if BACKUP_MODE == "watch":
+        scheduler = BackgroundScheduler()
+        _add_daily_job(scheduler)
+        scheduler.start()
+        handler = LedgerWatcher()
+        _start_observer(handler)
+        print(f"Backing up {BACKUP_DEBOUNCE_SECONDS:g}s after the last ledger write "
+              f"(at most {BACKUP_MAX_PER_HOUR} an hour), and daily at {BACKUP_HOUR:02d}:00.")
+        handler.run()
+        return
+
+    scheduler = BlockingScheduler()
+
+
+    _add_daily_job(scheduler)
+
     # For testing, runs once per minute
     # scheduler.add_job(
     #     run_backup_once,
@@ -61,3 +639,32 @@ if __name__ == "__main__":
 
     print(f"Scheduled daily backup at {BACKUP_HOUR:02d}:00 with {MISSING_GRACE_TIME//60} minute grace.")
     scheduler.start()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Ledger backups")
+    commands = arg_parser.add_subparsers(dest="command")
+    commands.add_parser("once", help="Back up the ledger now")
+    commands.add_parser("list", help="List backups")
+    commands.add_parser("prune", help="Apply the retention policy now")
+    restore_cmd = commands.add_parser("restore", help="Restore a backup")
+    restore_cmd.add_argument("backup", nargs="?", default="latest", help="'latest' or part of a backup name")
+    restore_cmd.add_argument("--output", type=Path, required=True, help="Directory to restore the files into")
+    restore_cmd.add_argument("--at", type=datetime.fromisoformat, help="Restore the ledger as it was at this time")
+    restore_cmd.add_argument("--from-remote", action="store_true", help="Download missing backups from the remote first")
+    args = arg_parser.parse_args()
+
+    if args.command == "once":
+        run_backup_once()
+    elif args.command == "list":
+        for path in list_manifests():
+            files = load_manifest(path)["files"]
+            print(f"{path.stem}  {len(files)} file(s)  {sum(f['size'] for f in files.values())} bytes")
+    elif args.command == "prune":
+        prune()
+    elif args.command == "restore":
+        if args.from_remote:
+            download()
+        restore(args.backup, args.output, args.at)
+    else:
+        run_scheduler()
@@ -0,0 +1,49 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import backup_runner  # noqa: E402
+
+START = datetime(2025, 8, 1, 12, 0, 0)
+
+
+class Clock(datetime):
+    """`datetime` whose now() is set by the test: backups are named to the second."""
+    current = START
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+    @classmethod
+    def advance(cls, **delta) -> datetime:
+        cls.current = cls.current + timedelta(**delta)
+        return cls.current
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(Clock, "current", START)
+    monkeypatch.setattr(backup_runner, "datetime", Clock)
+    return Clock
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch, clock):
+    """The backup runner, backing up `tmp_path/data/budget.beancount` into `tmp_path/data/backups`."""
+    data = tmp_path / "data"
+    data.mkdir()
+    backups = data / "backups"
+    monkeypatch.setattr(backup_runner, "LEDGER_PATH", data / "budget.beancount")
+    monkeypatch.setattr(backup_runner, "BACKUP_DIR", backups)
+    monkeypatch.setattr(backup_runner, "CHUNK_DIR", backups / "chunks")
+    monkeypatch.setattr(backup_runner, "MANIFEST_DIR", backups / "manifests")
+    monkeypatch.setattr(backup_runner, "SEGMENT_DIR", backups / "journal")
+    monkeypatch.setattr(backup_runner, "JOURNAL_DIR", data / ".beanbrain-journal")
+    monkeypatch.setattr(backup_runner, "RCLONE_REMOTE", ":local")
+    monkeypatch.setattr(backup_runner, "RCLONE_REMOTE_FOLDER", str(tmp_path / "remote"))
+    return backup_runner
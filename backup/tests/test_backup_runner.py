@@ -0,0 +1,267 @@
+import gzip
+import hashlib
+import json
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from watchdog.events import FileModifiedEvent
+
+LEDGER = """option "operating_currency" "EUR"
+include "accounts.beancount"
+
+2025-01-05 * "Groceries"
+  Expenses:Food  20.00 EUR
+  Assets:Checking
+"""
+
+ACCOUNTS = """2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:Food
+"""
+
+TXN = """
+2025-01-06 * "Bakery"
+  Expenses:Food  4.50 EUR
+  Assets:Checking
+"""
+
+
+@pytest.fixture
+def ledger(runner):
+    runner.LEDGER_PATH.write_text(LEDGER)
+    (runner.LEDGER_PATH.parent / "accounts.beancount").write_text(ACCOUNTS)
+    return runner.LEDGER_PATH
+
+
+@pytest.fixture
+def watcher(runner, ledger, monkeypatch):
+    """A LedgerWatcher running in the background, with backups replaced by a record of when they ran."""
+    monkeypatch.setattr(runner, "BACKUP_DEBOUNCE_SECONDS", 0.2)
+    watcher = runner.LedgerWatcher()
+    watcher.backups = []
+    monkeypatch.setattr(runner, "backup_changes", lambda: watcher.backups.append(time.monotonic()) or True)
+    threading.Thread(target=watcher.run, daemon=True).start()
+    yield watcher
+    # LedgerWatcher.run never returns: park it on an event nothing sets, before the patches are undone
+    watcher._changed = threading.Event()
+    time.sleep(0.3)
+
+
+def append(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+
+def journaled_append(runner, text, at: datetime) -> int:
+    """Append `text` to the ledger the way the brain does, journaling it (core.ledger_journal.AppendJournal)."""
+    directory = runner.journal_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    if not (directory / "journal-id").exists():
+        (directory / "journal-id").write_text("0123456789abcdef")
+    segment = directory / "000000000001.jsonl"
+    seq = len(segment.read_text().splitlines()) + 1 if segment.exists() else 1
+    offset = runner.LEDGER_PATH.stat().st_size
+    append(runner.LEDGER_PATH, text)
+    data = text.encode("utf-8")
+    record = {"seq": seq, "ts": at.timestamp(), "file": "budget.beancount", "offset": offset, "length": len(data),
+              "sha256": hashlib.sha256(data).hexdigest(), "data": text}
+    with open(segment, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return seq
+
+
+def bakery(day: int) -> str:
+    return TXN.replace("2025-01-06", f"2025-01-{day:02d}")
+
+
+def chunks(runner) -> set:
+    return {p.name for p in runner.CHUNK_DIR.glob("*/*.gz")}
+
+
+def test_backup_and_restore_every_ledger_file(runner, ledger, tmp_path):
+    manifest = runner.run_backup_once()
+    assert manifest.name == "budget_2025-08-01_120000.json"
+    assert sorted(runner.load_manifest(manifest)["files"]) == ["accounts.beancount", "budget.beancount"]
+
+    runner.restore("latest", tmp_path / "restored")
+    assert (tmp_path / "restored" / "budget.beancount").read_text() == LEDGER
+    assert (tmp_path / "restored" / "accounts.beancount").read_text() == ACCOUNTS
+
+
+def test_unchanged_ledger_writes_nothing(runner, ledger, clock):
+    runner.run_backup_once()
+    stored = chunks(runner)
+    clock.advance(minutes=5)
+
+    assert runner.run_backup_once() is None
+    assert len(runner.list_manifests()) == 1
+    assert chunks(runner) == stored
+
+
+def test_backups_share_unchanged_chunks(runner, ledger, clock, monkeypatch):
+    monkeypatch.setattr(runner, "CHUNK_SIZE", 32)
+    first = runner.load_manifest(runner.run_backup_once())["files"]["budget.beancount"]["chunks"]
+    stored = chunks(runner)
+    clock.advance(minutes=5)
+    append(ledger, TXN)
+
+    second = runner.load_manifest(runner.run_backup_once())["files"]["budget.beancount"]["chunks"]
+    # Every full chunk before the append is shared; only the rest is stored again
+    full = len(LEDGER) // 32
+    assert second[:full] == first[:full]
+    assert len(chunks(runner) - stored) == len(second) - full
+
+
+def test_new_parse_errors_hold_the_backup_back(runner, ledger, clock):
+    runner.run_backup_once()
+    clock.advance(minutes=5)
+    append(ledger, '\n2025-01-07 * "Half-writ')
+
+    assert runner.run_backup_once() is None
+    assert len(runner.list_manifests()) == 1
+
+
+def test_restore_rejects_a_corrupted_chunk(runner, ledger, tmp_path):
+    manifest = runner.load_manifest(runner.run_backup_once())
+    digest = manifest["files"]["budget.beancount"]["chunks"][0]
+    runner._chunk_path(digest).write_bytes(gzip.compress(LEDGER.replace("20.00", "25.00").encode()))
+
+    with pytest.raises(SystemExit, match="corrupted"):
+        runner.restore("latest", tmp_path / "restored")
+    assert not (tmp_path / "restored" / "budget.beancount").exists()
+
+
+def test_prune_drops_old_backups_and_their_chunks(runner, ledger, clock, tmp_path):
+    old = runner.run_backup_once()
+    old_chunks = chunks(runner)
+    clock.advance(days=2)
+    ledger.write_text(LEDGER.replace("Groceries", "Market"))
+    kept = runner.run_backup_once()
+
+    # Both are from August: past the daily window, only the newest is kept
+    runner.prune(clock.advance(days=48))
+    assert runner.list_manifests() == [kept]
+    assert not old.exists()
+    used = {f"{d}.gz" for entry in runner.load_manifest(kept)["files"].values() for d in entry["chunks"]}
+    assert chunks(runner) == used
+    assert old_chunks - used
+
+    runner.restore("latest", tmp_path / "restored")
+    assert "Market" in (tmp_path / "restored" / "budget.beancount").read_text()
+
+
+def test_retention_keeps_the_newest_backup_per_period(runner):
+    names = ["2025-08-01_100000", "2025-08-01_101500", "2025-08-01_113000", "2025-08-01_114500", "2025-08-01_120000"]
+    manifests = [Path(f"budget_{name}.json") for name in names]
+    kept = runner.select_kept(manifests, datetime(2025, 8, 1, 12, 10))
+    # The last hour in full, then the newest of each earlier hour
+    assert kept == set(manifests[1:])
+
+
+def test_backup_waits_for_writes_to_settle(watcher, ledger):
+    started = time.monotonic()
+    for _ in range(4):
+        watcher.on_any_event(FileModifiedEvent(str(ledger)))
+        time.sleep(0.1)
+    time.sleep(0.5)
+
+    assert len(watcher.backups) == 1
+    # Counted from the last write, not the first
+    assert watcher.backups[0] - started >= 0.3 + 0.2
+
+
+def test_unrelated_files_are_ignored(watcher, ledger):
+    watcher.on_any_event(FileModifiedEvent(str(ledger.parent / "backups" / "manifests" / "x.json")))
+    watcher.on_any_event(FileModifiedEvent(str(ledger.parent / "notes.txt")))
+    time.sleep(0.5)
+    assert watcher.backups == []
+
+    # Included files are watched too
+    watcher.on_any_event(FileModifiedEvent(str(ledger.parent / "accounts.beancount")))
+    time.sleep(0.5)
+    assert len(watcher.backups) == 1
+
+
+def test_watched_backups_are_capped_per_hour(watcher, ledger, runner, monkeypatch):
+    monkeypatch.setattr(runner, "BACKUP_MAX_PER_HOUR", 2)
+    for _ in range(3):
+        watcher.on_any_event(FileModifiedEvent(str(ledger)))
+        time.sleep(0.5)
+    assert len(watcher.backups) == 2
+
+
+def test_writes_to_the_ledger_are_noticed(watcher, ledger, runner, monkeypatch):
+    monkeypatch.setattr(runner, "POLL_INTERVAL_SECONDS", 0.1)
+    observer = runner._start_observer(watcher)
+    try:
+        time.sleep(0.2)
+        append(ledger, TXN)
+        deadline = time.monotonic() + 5
+        while not watcher.backups and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        observer.stop()
+        observer.join()
+    assert len(watcher.backups) == 1
+
+
+@pytest.fixture
+def journaled(runner, ledger, clock):
+    """A full backup taken at START of a ledger the brain journals, then two journaled appends."""
+    journaled_append(runner, bakery(6), clock.current - timedelta(minutes=1))
+    assert runner.run_backup_once() is not None
+    journaled_append(runner, bakery(7), clock.current + timedelta(minutes=10))
+    journaled_append(runner, bakery(8), clock.current + timedelta(minutes=20))
+    clock.advance(minutes=30)
+    return ledger
+
+
+def test_journaled_appends_are_shipped_without_a_full_backup(runner, journaled):
+    assert runner.backup_changes()
+    assert len(runner.list_manifests()) == 1
+    assert [r["seq"] for r in runner.read_shipped(runner.journal_id(), 1)] == [2, 3]
+
+    # Nothing new: nothing to do
+    assert not runner.backup_changes()
+
+
+def test_outside_edit_forces_a_full_backup(runner, journaled, clock):
+    runner.backup_changes()
+    clock.advance(minutes=5)
+    # e.g. saved from Fava: not journaled
+    append(journaled, bakery(9))
+
+    assert runner.backup_changes()
+    assert len(runner.list_manifests()) == 2
+    assert runner.load_manifest(runner.list_manifests()[-1])["journal"]["seq"] == 3
+
+
+def test_restore_latest_replays_the_journal(runner, journaled, tmp_path):
+    runner.backup_changes()
+    runner.restore("latest", tmp_path / "restored")
+    assert (tmp_path / "restored" / "budget.beancount").read_text() == journaled.read_text()
+
+
+def test_restore_at_stops_at_that_time(runner, journaled, clock, tmp_path):
+    runner.backup_changes()
+    start = clock.current - timedelta(minutes=30)
+
+    runner.restore("latest", tmp_path / "restored", at=start + timedelta(minutes=15))
+    assert (tmp_path / "restored" / "budget.beancount").read_text() == LEDGER + bakery(6) + bakery(7)
+
+    with pytest.raises(SystemExit, match="No backup before"):
+        runner.restore("latest", tmp_path / "earlier", at=start - timedelta(minutes=1))
+
+
+@pytest.mark.skipif(shutil.which("rclone") is None, reason="rclone is not installed")
+def test_restore_from_the_remote(runner, journaled, tmp_path):
+    runner.backup_changes()
+    assert (tmp_path / "remote" / "manifests").exists()
+    shutil.rmtree(runner.BACKUP_DIR)
+
+    runner.download()
+    runner.restore("latest", tmp_path / "restored")
+    assert (tmp_path / "restored" / "budget.beancount").read_text() == journaled.read_text()
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 from domain.schemas.database import get_db
-from domain.models.dtos import AutomationCreate, AutomationUpdate, AutomationOut
+from domain.models.dtos import AutomationCreate, AutomationUpdate, AutomationOut, CatchUpOut
 from core.automation_service import AutomationService
 from typing import List
 
@@ -11,13 +11,18 @@ router = APIRouter(prefix="/automation", tags=["Automation"])
 def get_automation_service(
     request: Request
 ) -> AutomationService:
-    scheduler = request.app.state.scheduler
-    return AutomationService(scheduler=scheduler)
+    dispatcher = request.app.state.dispatcher
+    return AutomationService(dispatcher=dispatcher)
 
 @router.post("", response_model=AutomationOut)
 def create_automation(body: AutomationCreate, automation_service: AutomationService = Depends(get_automation_service)):
     return automation_service.create(body)
 
+@router.post("/catch-up", response_model=CatchUpOut)
+def catch_up_automations(automation_service: AutomationService = Depends(get_automation_service)):
+    """Run every automation that is due now, including runs missed earlier."""
+    return automation_service.run_due()
+
 @router.get("", response_model=List[AutomationOut])
 def list_automations(automation_service: AutomationService = Depends(get_automation_service)):
     return automation_service.list()
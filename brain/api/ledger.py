@@ -0,0 +1,98 @@
+from datetime import date
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Header, Query
+from starlette.status import HTTP_201_CREATED
+import conf
+from domain.models.dtos import (
+    AccountBalanceOut,
+    BalancesOut,
+    BatchAppendIn,
+    BatchAppendOut,
+    MonthlySpendOut,
+    RollingAverageOut,
+    TopPayeesOut,
+)
+from core.idempotency import IDEMPOTENCY_HEADER
+from core.ledger_service import LedgerService
+
+router = APIRouter(prefix="/ledger", tags=["Ledger"])
+
+
+def get_ledger_service() -> LedgerService:
+    return LedgerService()
+
+
+@router.post("/transactions:batch", response_model=BatchAppendOut, status_code=HTTP_201_CREATED)
+def append_transactions_batch(
+    body: BatchAppendIn,
+    idempotency_key: Optional[str] = Header(
+        None, alias=IDEMPOTENCY_HEADER, max_length=255,
+        description="Retries with the same key return the first response instead of appending again",
+    ),
+    ledger_service: LedgerService = Depends(get_ledger_service),
+):
+    return ledger_service.append_batch(body, idempotency_key)
+
+
+@router.get("/balances", response_model=BalancesOut)
+def balances(
+    as_of: Optional[date] = Query(None, description="Balances at the end of this day (default: now)"),
+    include_subaccounts: bool = Query(False, description="Also list parent accounts with their sub-accounts rolled up"),
+    ledger_service: LedgerService = Depends(get_ledger_service),
+):
+    return ledger_service.balances(as_of, include_subaccounts)
+
+
+@router.get("/balances/{account}", response_model=AccountBalanceOut)
+def account_balance(
+    account: str,
+    as_of: Optional[date] = Query(None, description="Balance at the end of this day (default: now)"),
+    include_subaccounts: bool = Query(False),
+    interval: Optional[Literal["day", "month"]] = Query(None, description="Also return the balance history per period"),
+    start: Optional[date] = Query(None, description="First day of the history"),
+    end: Optional[date] = Query(None, description="Last day of the history (default: as_of)"),
+    ledger_service: LedgerService = Depends(get_ledger_service),
+):
+    return ledger_service.account_balance(account, as_of, include_subaccounts, interval, start, end)
+
+
+@router.get("/analytics/monthly", response_model=MonthlySpendOut)
+def analytics_monthly(
+    account: str = Query("Expenses", description="Root of the account subtree"),
+    currency: str = Query(conf.DEFAULT_CURRENCY),
+    depth: int = Query(1, ge=0, description="Split by sub-accounts this many levels below the root"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    ledger_service: LedgerService = Depends(get_ledger_service),
+):
+    return ledger_service.monthly_spend(account, currency, depth, start, end)
+
+
+@router.get("/analytics/top-payees", response_model=TopPayeesOut)
+def analytics_top_payees(
+    account: str = Query("Expenses", description="Root of the account subtree"),
+    currency: str = Query(conf.DEFAULT_CURRENCY),
+    limit: int = Query(10, ge=1, le=500),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    ledger_service: LedgerService = Depends(get_ledger_service),
+):
+    return ledger_service.top_payees(account, currency, limit, start, end)
+
+
+@router.get("/analytics/rolling", response_model=RollingAverageOut)
+def analytics_rolling(
+    account: str = Query("Expenses", description="Root of the account subtree"),
+    currency: str = Query(conf.DEFAULT_CURRENCY),
+    window: int = Query(3, ge=1, description="Number of periods averaged"),
+    interval: Literal["day", "month"] = "month",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    ledger_service: LedgerService = Depends(get_ledger_service),
+):
+    return ledger_service.rolling_average(account, currency, window, interval, start, end)
+
+
+@router.get("/stats")
+def ledger_stats(ledger_service: LedgerService = Depends(get_ledger_service)):
+    return ledger_service.stats()
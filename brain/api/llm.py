@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from pydantic import BaseModel, Field
 from starlette.status import HTTP_201_CREATED
-import os
+from core.idempotency import IDEMPOTENCY_HEADER
 from core.llm_service import LLMTransactionService
 
 router = APIRouter(prefix="/llm", tags=["LLM Transactions"])
@@ -10,21 +11,31 @@ router = APIRouter(prefix="/llm", tags=["LLM Transactions"])
 
 class NaturalTextInput(BaseModel):
     text: str = Field(..., example="Bought groceries at Carrefour for 23.50 euros")
+    mode: Optional[Literal["two_step", "single"]] = Field(
+        None, description="LLM pipeline mode; defaults to LLM_PIPELINE_MODE"
+    )
 
 
 
-def get_llm_service() -> LLMTransactionService:
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if not openai_key:
+def get_llm_service(request: Request) -> LLMTransactionService:
+    client = request.app.state.openai_client
+    if client is None:
         raise RuntimeError("OPENAI_API_KEY not set in environment")
-    return LLMTransactionService(openai_api_key=openai_key)
+    return LLMTransactionService(client=client, llm_semaphore=request.app.state.llm_semaphore)
 
 
 
 @router.post("/append", status_code=HTTP_201_CREATED)
-def append_transaction_from_text(
+async def append_transaction_from_text(
     body: NaturalTextInput,
+    idempotency_key: Optional[str] = Header(
+        None, alias=IDEMPOTENCY_HEADER, max_length=255,
+        description="Retries with the same key return the first response instead of appending again",
+    ),
     llm_service: LLMTransactionService = Depends(get_llm_service)
 ):
-    transaction = llm_service.append_from_natural_text(body.text)
+    try:
+        transaction = await llm_service.append_from_natural_text(body.text, mode=body.mode, idempotency_key=idempotency_key)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     return transaction
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""Synthetic Beancount ledgers of a given size for benchmarks."""
+import random
+from datetime import date, timedelta
+
+SOURCES = ["Assets:Bank:Checking", "Assets:Cash", "Liabilities:CreditCard"]
+CATEGORIES = {
+    "Food:Groceries": ["Carrefour", "Spinneys", "Lidl"],
+    "Food:Restaurants": ["Pizza Place", "Sushi Bar", "Burger Joint"],
+    "Food:Coffee": ["Starbucks", "Costa"],
+    "Transport:Taxi": ["Uber", "Bolt"],
+    "Transport:Fuel": ["Shell", "Total"],
+    "Subscriptions:Spotify": ["Spotify"],
+    "Subscriptions:Netflix": ["Netflix"],
+    "Housing:Rent": ["Landlord"],
+    "Health:Pharmacy": ["Pharmacy"],
+    "Shopping:Clothes": ["Zara", "H&M"],
+}
+
+# Inputs in the style users type into /llm/append
+SAMPLE_INPUTS = [
+    "groceries at carrefour 23.50",
+    "spotify 9.99",
+    "uber to the airport 18",
+    "coffee at starbucks 4.5 with cash",
+    "rent 800",
+    "dinner at the sushi bar 42",
+    "fuel at shell 60 with credit card",
+    "netflix 15.49",
+    "pharmacy 12.30",
+    "new jacket at zara 75",
+]
+
+
+def generate_ledger(path: str, transactions: int, extra_accounts: int = 0, seed: int = 1) -> None:
+    """
+    Write a ledger with `transactions` two-posting transactions.
+
+    Args:
+        path (str): Output file.
+        transactions (int): Number of transactions.
+        extra_accounts (int): Additional (rarely used) expense accounts, to
+            grow the chart of accounts independently of the history.
+        seed (int): Random seed, so runs are comparable.
+    """
+    rng = random.Random(seed)
+    start = date(2015, 1, 1)
+    expenses = [f"Expenses:{c}" for c in CATEGORIES]
+    extras = [f"Expenses:Misc:Category{i}" for i in range(extra_accounts)]
+    per_day = max(1, transactions // 3650)
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('option "operating_currency" "USD"\n\n')
+        for account in SOURCES + expenses + extras:
+            comment = account.split(":")[-1].lower()
+            f.write(f"{start} open {account} ; {comment}\n")
+        for i in range(transactions):
+            day = start + timedelta(days=1 + i // per_day)
+            category = rng.choice(list(CATEGORIES))
+            payee = rng.choice(CATEGORIES[category])
+            source = rng.choice(SOURCES)
+            target = rng.choice(extras) if extras and rng.random() < 0.05 else f"Expenses:{category}"
+            amount = rng.randint(100, 20000) / 100
+            f.write(
+                f'\n{day} * "{payee}" "{category.split(":")[-1]}"\n'
+                f"  {source}  -{amount:.2f} USD\n"
+                f"  {target}  {amount:.2f} USD\n"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic Beancount ledger")
+    parser.add_argument("path")
+    parser.add_argument("transactions", type=int)
+    parser.add_argument("--extra-accounts", type=int, default=0)
+    args = parser.parse_args()
+    generate_ledger(args.path, args.transactions, args.extra_accounts)
@@ -0,0 +1,165 @@
+"""
+Benchmark of the /llm/append pipeline against a local stub model server.
+
+For each ledger size and pipeline mode, a synthetic ledger is generated and
+requests are sent to the real FastAPI app (in-process, over ASGI) with the
+OpenAI client pointed at the stub. Per-stage latencies come from
+core.profiling; the model latency is whatever the stub is told to add, so
+everything else in the report is our own overhead.
+
+Usage (from brain/):
+    python -m bench.llm_pipeline --sizes 1000 10000 50000 --modes two_step single \
+        --requests 200 --concurrency 8 --latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+import conf
+from bench.ledger_gen import SAMPLE_INPUTS, generate_ledger
+from bench.stub_openai import StubOpenAIServer
+from core.beancount_service import warm_ledger
+from core.ledger_writer import get_ledger_writer
+from core.profiling import add_stage_observer, record_stage, remove_stage_observer, timed
+from infrastructure.llm.openai_client import build_openai_client
+
+# Report order; anything else that gets timed is listed after these
+STAGES = [
+    "total", "warmup", "local_classify", "ledger_read", "prompt_build", "llm_queue", "llm_call",
+    "append", "lock_wait", "validation", "write",
+]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for stage in STAGES + sorted(set(samples) - set(STAGES)):
+        values = sorted(samples.get(stage, []))
+        if not values:
+            continue
+        summary[stage] = {
+            "n": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    return summary
+
+
+async def run_case(stub: StubOpenAIServer, ledger_path: str, mode: str, requests: int, concurrency: int) -> Dict:
+    from main import app  # imported late so conf overrides are already in place
+    import core.account_retrieval  # noqa: F401  (registers its view for the warmup)
+
+    samples: Dict[str, List[float]] = defaultdict(list)
+
+    def observe(stage: str, seconds: float, labels: Dict[str, str]) -> None:
+        samples[stage].append(seconds)
+
+    conf.BEANCOUNT_FILE = ledger_path
+    app.state.openai_client = build_openai_client("bench", base_url=stub.base_url)
+    app.state.llm_semaphore = asyncio.Semaphore(conf.LLM_MAX_CONCURRENCY)
+
+    add_stage_observer(observe)
+    try:
+        # Parse and build the indexes up front, as a long-running server would have
+        with timed("warmup"):
+            warm_ledger(ledger_path)
+
+        gate = asyncio.Semaphore(concurrency)
+        rng = random.Random(0)
+        errors = 0
+
+        async def one(client: httpx.AsyncClient) -> None:
+            nonlocal errors
+            async with gate:
+                started = time.perf_counter()
+                response = await client.post("/llm/append", json={"text": rng.choice(SAMPLE_INPUTS), "mode": mode})
+                record_stage("total", time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            wall_started = time.perf_counter()
+            await asyncio.gather(*(one(client) for _ in range(requests)))
+            wall = time.perf_counter() - wall_started
+    finally:
+        remove_stage_observer(observe)
+        get_ledger_writer(ledger_path).stop()
+        await app.state.openai_client.close()
+
+    return {
+        "mode": mode,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 2),
+        "stages": summarize(samples),
+    }
+
+
+def print_report(result: Dict) -> None:
+    print(f"\n== {result['transactions']} txns / {result['mode']} — "
+          f"{result['requests']} requests, {result['errors']} errors, {result['throughput_rps']} req/s")
+    print(f"{'stage':<16}{'n':>7}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    for stage, s in result["stages"].items():
+        print(f"{stage:<16}{s['n']:>7}{s['p50_ms']:>12.3f}{s['p95_ms']:>12.3f}{s['p99_ms']:>12.3f}{s['max_ms']:>12.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the /llm/append pipeline against a stub model")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Ledger sizes (transactions)")
+    parser.add_argument("--extra-accounts", type=int, default=0, help="Additional accounts in the chart")
+    parser.add_argument("--modes", nargs="+", default=["two_step", "single"], choices=["two_step", "single"])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated model latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--local", action="store_true", help="Let the local classifier skip the model")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    conf.LLM_LOCAL_CLASSIFIER = args.local
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="beanbrain-bench-")
+    try:
+        with StubOpenAIServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms) as stub:
+            for size in args.sizes:
+                template = os.path.join(workdir, f"template-{size}.beancount")
+                generate_ledger(template, size, args.extra_accounts)
+                for mode in args.modes:
+                    # Fresh copy per case: every run appends to its ledger
+                    ledger_path = os.path.join(workdir, f"{size}-{mode}.beancount")
+                    shutil.copyfile(template, ledger_path)
+                    result = asyncio.run(run_case(stub, ledger_path, mode, args.requests, args.concurrency))
+                    result["transactions"] = size
+                    results.append(result)
+                    print_report(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Minimal OpenAI-compatible chat completions server for benchmarks.
+
+Answers POST /v1/chat/completions after a configurable delay with canned but
+valid JSON: accounts are picked from the prompt (or the JSON schema enum), so
+the rest of the pipeline runs exactly as it would against the real API.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+ACCOUNT_LINE_RE = re.compile(r"^\s+- ([A-Z][\w-]*(?::[\w-]+)+)", re.MULTILINE)
+AMOUNT_RE = re.compile(r"(\d+(?:\.\d{1,2})?)")
+
+
+def _pick_accounts(accounts: List[str]) -> Tuple[str, str]:
+    sources = [a for a in accounts if a.startswith(("Assets:", "Liabilities:"))] or accounts
+    targets = [a for a in accounts if a.startswith("Expenses:")] or accounts
+    return random.choice(sources), random.choice(targets)
+
+
+def _user_text(prompt: str) -> str:
+    match = re.search(r'"""(.*?)"""', prompt, re.DOTALL)
+    return match.group(1) if match else prompt
+
+
+def canned_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    """The JSON object the pipeline expects for this request."""
+    system = body["messages"][0]["content"]
+    prompt = body["messages"][-1]["content"]
+    amount = AMOUNT_RE.search(_user_text(prompt))
+    details = {
+        "amount_value": float(amount.group(1)) if amount else 10.0,
+        "currency": "USD",
+        "narration": "Bench Purchase",
+        "payee": "Bench Store",
+    }
+
+    schema = (body.get("response_format") or {}).get("json_schema")
+    if schema:
+        accounts = schema["schema"]["properties"]["from_account"]["enum"]
+        from_account, to_account = _pick_accounts(accounts)
+        return {"from_account": from_account, "to_account": to_account, **details}
+    if "classify" in system:
+        from_account, to_account = _pick_accounts(ACCOUNT_LINE_RE.findall(prompt))
+        return {"from_account": from_account, "to_account": to_account}
+    return details
+
+
+class StubOpenAIServer:
+    """
+    Threaded stub server, usable as a context manager.
+
+    Args:
+        latency_ms (float): Mean delay before each response.
+        jitter_ms (float): Uniform +/- jitter around the mean.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; don't let Nagle delay the body
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                server.requests += 1
+                delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+                if delay > 0:
+                    time.sleep(delay / 1000)
+                payload = json.dumps({
+                    "id": f"chatcmpl-bench-{server.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": json.dumps(canned_response(body))},
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-openai", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubOpenAIServer":
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StubOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the stub OpenAI server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = StubOpenAIServer(port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    print(f"Serving on {stub.base_url}")
+    stub.serve_forever()
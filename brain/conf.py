@@ -4,12 +4,95 @@ DEFAULT_CURRENCY = "USD"
 DEFAULT_TZ = os.getenv(
     "DEFAULT_TZ", "Asia/Beirut"
 )
-DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", 10)
+DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", DEFAULT_CURRENCY)
+
+# "incremental" checks appended entries against the in-memory ledger state,
+# "full" re-loads the whole candidate ledger on every append
+LEDGER_VALIDATION_MODE = os.getenv("LEDGER_VALIDATION_MODE", "incremental")
+
+# Parse and query the ledger in a separate worker process, so parsing a large
+# ledger doesn't stall the API (0 keeps everything in the web process)
+LEDGER_WORKER_PROCESS = bool(int(os.getenv("LEDGER_WORKER_PROCESS", 1)))
+# A call the worker hasn't answered after this long (a hung parse, a deadlock)
+# fails, and the worker is killed and restarted on the next call
+LEDGER_WORKER_TIMEOUT_SECONDS = float(os.getenv("LEDGER_WORKER_TIMEOUT_SECONDS", 300))
+
+# Parsed ledgers are saved here so a restart doesn't re-parse them from
+# scratch (empty disables it)
+LEDGER_SNAPSHOT_DIR = os.getenv(
+    "LEDGER_SNAPSHOT_DIR", os.path.join(os.path.dirname(BEANCOUNT_FILE), ".beanbrain-cache")
+)
+
+# Posting tables for analytics are saved here and memory-mapped by every
+# worker reading the same ledger (empty keeps them in memory only)
+ANALYTICS_TABLE_DIR = os.getenv(
+    "ANALYTICS_TABLE_DIR", os.path.join(LEDGER_SNAPSHOT_DIR, "postings") if LEDGER_SNAPSHOT_DIR else ""
+)
+
+# Every appended block is journaled here so backups can ship just the new
+# entries and restore to any point in time (empty disables it)
+LEDGER_JOURNAL_DIR = os.getenv(
+    "LEDGER_JOURNAL_DIR", os.path.join(os.path.dirname(BEANCOUNT_FILE), ".beanbrain-journal")
+)
+
+# Appends arriving within this window are committed together in one write
+LEDGER_WRITER_WINDOW_MS = int(os.getenv("LEDGER_WRITER_WINDOW_MS", 10))
+LEDGER_WRITER_MAX_BATCH = int(os.getenv("LEDGER_WRITER_MAX_BATCH", 500))
+
+# "two_step" infers accounts then completes fields; "single" asks for everything in one call
+LLM_PIPELINE_MODE = os.getenv("LLM_PIPELINE_MODE", "two_step")
+
+# Shared OpenAI client: connection pool size, request timeout (s), retries,
+# and how many LLM calls may be in flight at once across all requests
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# OpenAI-compatible endpoint to use instead of api.openai.com (unset: default)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# Skip the LLM when the history-based classifier is at least this confident
+LLM_LOCAL_CLASSIFIER = bool(int(os.getenv("LLM_LOCAL_CLASSIFIER", 1)))
+LLM_LOCAL_CONFIDENCE = float(os.getenv("LLM_LOCAL_CONFIDENCE", 0.8))
+
+# List only the accounts relevant to the input in LLM prompts: up to TOP_K per
+# account type, within a token budget; the full list is used below MIN_SCORE
+LLM_RETRIEVAL_ENABLED = bool(int(os.getenv("LLM_RETRIEVAL_ENABLED", 1)))
+LLM_RETRIEVAL_TOP_K = int(os.getenv("LLM_RETRIEVAL_TOP_K", 8))
+LLM_RETRIEVAL_MIN_SCORE = float(os.getenv("LLM_RETRIEVAL_MIN_SCORE", 0.15))
+LLM_ACCOUNTS_TOKEN_BUDGET = int(os.getenv("LLM_ACCOUNTS_TOKEN_BUDGET", 1500))
+
+# Backfill automation runs missed while the service was down (at startup and
+# via POST /automation/catch-up), up to this many occurrences per automation
+AUTOMATION_CATCHUP_ON_STARTUP = bool(int(os.getenv("AUTOMATION_CATCHUP_ON_STARTUP", 1)))
+AUTOMATION_CATCHUP_MAX_RUNS = int(os.getenv("AUTOMATION_CATCHUP_MAX_RUNS", 400))
+# Automations whose write failed for a transient reason (disk full, worker
+# died) stay due; the dispatcher retries them after a delay doubling from
+# MIN up to MAX seconds per consecutive failing pass
+AUTOMATION_RETRY_MIN_SECONDS = float(os.getenv("AUTOMATION_RETRY_MIN_SECONDS", 5))
+AUTOMATION_RETRY_MAX_SECONDS = float(os.getenv("AUTOMATION_RETRY_MAX_SECONDS", 300))
+
+# With several workers, only the one holding this lock runs automations; the
+# others retry every SCHEDULER_LEADER_RETRY_SECONDS and take over if it dies
+SCHEDULER_LOCK_FILE = os.getenv(
+    "SCHEDULER_LOCK_FILE", os.path.join(os.path.dirname(BEANCOUNT_FILE), ".beanbrain-scheduler.lock")
+)
+SCHEDULER_LEADER_RETRY_SECONDS = float(os.getenv("SCHEDULER_LEADER_RETRY_SECONDS", 10))
+
+# Idempotency keys (Idempotency-Key header on appends) are remembered this
+# long; a key still in flight after IDEMPOTENCY_PENDING_SECONDS is considered
+# abandoned and resolved against the ledger on the next retry
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+IDEMPOTENCY_PENDING_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_SECONDS", 120))
 
 DATABASE_URL = os.getenv(
     "DATABASE_URL", "sqlite:///./automations.db"
 )
 
+# Prometheus metrics at /metrics (latencies of parses, locks, validation, LLM
+# calls, DB sessions and scheduler lag); 0 disables the endpoint and hooks
+METRICS_ENABLED = bool(int(os.getenv("METRICS_ENABLED", 1)))
+
 POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
 MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
 POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
@@ -0,0 +1,272 @@
+import math
+import re
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from beancount.core import data
+
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+import core.ledger_validation  # noqa: F401  (registers the "validation" view used below)
+from core.ledger_worker import offloaded
+
+TOKEN_RE = re.compile(r"[^\W\d_]{2,}", re.UNICODE)
+# Grouped thousands ("1,200.00") first, then plain or decimal-comma amounts ("9.50", "23,50")
+AMOUNT_RE = re.compile(r"(?<![\w.,])(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d{1,2})?)(?![\w]|[.,]\d)")
+CURRENCY_CODE_RE = re.compile(r"\b([A-Z]{3})\b")
+CURRENCY_WORDS = {
+    "$": "USD", "dollar": "USD", "dollars": "USD", "usd": "USD",
+    "€": "EUR", "euro": "EUR", "euros": "EUR", "eur": "EUR",
+    "£": "GBP", "pound": "GBP", "pounds": "GBP", "gbp": "GBP",
+}
+# Words that carry no signal about which accounts are involved
+STOPWORDS = {
+    "a", "an", "the", "for", "at", "to", "from", "with", "using", "on", "in", "of", "and", "my",
+    "paid", "pay", "bought", "buy", "spent", "got", "just", "some", "by", "via",
+} | set(CURRENCY_WORDS)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+@dataclass
+class Classification:
+    from_account: str
+    to_account: str
+    confidence: float
+    narration: str
+    payee: str
+    currency: str
+
+
+class AccountClassifier:
+    """
+    Nearest-neighbour classifier from transaction text to (from, to) accounts.
+
+    Every distinct (payee + narration + account name tokens, account pair) seen
+    in the ledger is one TF-IDF document. A query is scored against all
+    documents through an inverted index with NumPy, and the k nearest
+    neighbours (by cosine) vote on the pair. Confidence combines the winning
+    vote share with how much of the query the best document explains.
+    New transactions are added as they are appended; the weights are
+    recompiled lazily on the next query.
+    """
+
+    def __init__(self, snapshot: LedgerSnapshot, k: int = 10):
+        self.k = k
+        self._vocab: Dict[str, int] = {}
+        self._pairs: Dict[Tuple[str, str], int] = {}
+        self._pair_names: List[Tuple[str, str]] = []
+        self._docs: Dict[Tuple[Tuple[int, ...], int], int] = {}
+        self._doc_pair: List[int] = []
+        self._doc_count: List[int] = []
+        # Most recent (narration, payee, currency) seen for each document
+        self._doc_example: List[Tuple[str, str, str]] = []
+        self._rows: List[int] = []
+        self._cols: List[int] = []
+        self._compiled = None
+        self.extend(snapshot.entries)
+
+    @staticmethod
+    def _pair_of(txn: data.Transaction) -> Optional[Tuple[str, str, str]]:
+        if len(txn.postings) != 2:
+            return None
+        a, b = txn.postings
+        if a.units is None or b.units is None or a.units.number is None or b.units.number is None:
+            return None
+        if a.units.number < 0 < b.units.number:
+            return a.account, b.account, b.units.currency
+        if b.units.number < 0 < a.units.number:
+            return b.account, a.account, a.units.currency
+        return None
+
+    def extend(self, entries) -> "AccountClassifier":
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            pair = self._pair_of(entry)
+            if pair is None:
+                continue
+            from_account, to_account, currency = pair
+            text_tokens = tokenize(f"{entry.payee or ''} {entry.narration or ''}")
+            if not text_tokens:
+                continue
+            # Account components let "... with cash" pick the right source account
+            tokens = text_tokens + tokenize(" ".join(
+                " ".join(acct.split(":")[1:]) for acct in (from_account, to_account)
+            ))
+            pair_id = self._pairs.get((from_account, to_account))
+            if pair_id is None:
+                pair_id = self._pairs[(from_account, to_account)] = len(self._pair_names)
+                self._pair_names.append((from_account, to_account))
+            token_ids = tuple(sorted({self._vocab.setdefault(t, len(self._vocab)) for t in tokens}))
+            key = (token_ids, pair_id)
+            example = ((entry.narration or "").strip(), (entry.payee or "").strip(), currency)
+            doc = self._docs.get(key)
+            if doc is None:
+                doc = self._docs[key] = len(self._doc_pair)
+                self._doc_pair.append(pair_id)
+                self._doc_count.append(0)
+                self._doc_example.append(example)
+                self._rows.extend([doc] * len(token_ids))
+                self._cols.extend(token_ids)
+            self._doc_count[doc] += 1
+            self._doc_example[doc] = example
+            self._compiled = None
+        return self
+
+    def _compile(self):
+        rows = np.asarray(self._rows, dtype=np.int64)
+        cols = np.asarray(self._cols, dtype=np.int64)
+        n_docs = len(self._doc_pair)
+        df = np.bincount(cols, minlength=len(self._vocab))
+        idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+        weights = idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=n_docs))
+        # Inverted index: postings of token t are order[starts[t]:starts[t + 1]]
+        order = np.argsort(cols, kind="stable")
+        starts = np.searchsorted(cols[order], np.arange(len(self._vocab) + 1))
+        self._compiled = (rows[order], weights[order], idf, norms, starts)
+        return self._compiled
+
+    def _vote(self, text: str, active_accounts: Optional[Set[str]]):
+        """Score `text` against the history; returns per-pair votes and evidence."""
+        if not self._doc_pair:
+            return None
+        doc_rows, doc_weights, idf, norms, starts = self._compiled or self._compile()
+
+        words = tokenize(text)
+        # Tokens added after the last compile are simply not indexed yet
+        known = [self._vocab[w] for w in set(words) if self._vocab.get(w, len(starts)) < len(starts) - 1]
+        if not known:
+            return None
+        coverage = len(known) / len(set(words))
+
+        scores = np.zeros(len(norms))
+        for t in known:
+            lo, hi = starts[t], starts[t + 1]
+            np.add.at(scores, doc_rows[lo:hi], doc_weights[lo:hi] * idf[t])
+        query_norm = math.sqrt(float(np.sum(idf[known] ** 2)))
+        sims = scores / (norms * query_norm)
+        # Share of the query's weight each document accounts for
+        containment = scores / (query_norm ** 2)
+
+        k = min(self.k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        votes: Dict[int, float] = {}
+        best_doc: Dict[int, int] = {}
+        for doc in top:
+            if sims[doc] <= 0:
+                continue
+            pair_id = self._doc_pair[doc]
+            from_account, to_account = self._pair_names[pair_id]
+            if active_accounts is not None and not {from_account, to_account} <= active_accounts:
+                continue
+            votes[pair_id] = votes.get(pair_id, 0.0) + sims[doc] * math.log1p(self._doc_count[doc])
+            if pair_id not in best_doc or sims[doc] > sims[best_doc[pair_id]]:
+                best_doc[pair_id] = doc
+        if not votes:
+            return None
+        return votes, best_doc, containment, coverage
+
+    def classify(self, text: str, active_accounts: Optional[Set[str]] = None) -> Optional[Classification]:
+        """
+        Guess the accounts and fields of a transaction described in `text`.
+
+        Args:
+            text (str): Natural language input, e.g. "spotify 9.99".
+            active_accounts (Optional[Set[str]]): If given, pairs using any other
+                account are ignored (e.g. closed accounts).
+
+        Returns:
+            Optional[Classification]: The best guess with a confidence in [0, 1],
+            or None if nothing in the history resembles the input.
+        """
+        voted = self._vote(text, active_accounts)
+        if voted is None:
+            return None
+        votes, best_doc, containment, coverage = voted
+
+        pair_id = max(votes, key=votes.get)
+        doc = best_doc[pair_id]
+        confidence = float(votes[pair_id] / sum(votes.values())) * min(float(containment[doc]), 1.0) * coverage
+        narration, payee, currency = self._doc_example[doc]
+        from_account, to_account = self._pair_names[pair_id]
+        return Classification(from_account, to_account, confidence, narration, payee, currency)
+
+    def candidate_pairs(self, text: str, active_accounts: Optional[Set[str]] = None, limit: int = 3) -> List[Tuple[str, str]]:
+        """The (from, to) pairs most similar to `text`, best first."""
+        voted = self._vote(text, active_accounts)
+        if voted is None:
+            return []
+        votes = voted[0]
+        ranked = sorted(votes, key=votes.get, reverse=True)[:limit]
+        return [self._pair_names[p] for p in ranked]
+
+
+def extract_amount(text: str) -> Optional[Decimal]:
+    """The amount in `text`, or None if there is none or several (e.g. "2 coffees 9.50")."""
+    matches = AMOUNT_RE.findall(text)
+    if len(matches) != 1:
+        return None
+    value = matches[0]
+    # A comma is a thousands separator when grouping digits, else a decimal comma
+    value = value.replace(",", "") if re.search(r",\d{3}(?:\D|$)", value) else value.replace(",", ".")
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def extract_currency(text: str, known: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    The currency named in `text`, as a code or a word ("euros", "$").
+
+    With `known`, anything else is ignored, so capitalised words such as
+    "KFC" or "ATM" aren't taken for currencies.
+    """
+    for code in CURRENCY_CODE_RE.findall(text):
+        if known is None or code in known:
+            return code
+    lowered = text.lower()
+    for word, code in CURRENCY_WORDS.items():
+        if known is not None and code not in known:
+            continue
+        if word in ("$", "€", "£"):
+            if word in text:
+                return code
+        elif re.search(rf"\b{word}\b", lowered):
+            return code
+    return None
+
+
+ledger_cache.register_view("classifier", AccountClassifier, lambda clf, snapshot, new: clf.extend(new))
+
+
+def get_account_classifier(ledger_path: str) -> AccountClassifier:
+    return ledger_cache.view(ledger_path, "classifier")
+
+
+@offloaded
+def classify_text(ledger_path: str, text: str) -> Optional[Classification]:
+    """Classify `text` against the ledger's history, ignoring closed accounts."""
+    state = ledger_cache.view(ledger_path, "validation")
+    return get_account_classifier(ledger_path).classify(text, set(state.opens) - set(state.closes))
+
+
+@offloaded
+def known_currencies(ledger_path: str) -> Set[str]:
+    """Currencies the ledger declares: commodities, currency constraints of opens and operating currencies."""
+    state = ledger_cache.view(ledger_path, "validation")
+    known = set(state.commodities) | set(state.options_map.get("operating_currency") or ())
+    for entry in state.opens.values():
+        known.update(entry.currencies or ())
+    return known
+
+
+@offloaded
+def candidate_account_pairs(ledger_path: str, text: str, limit: int = 3) -> List[Tuple[str, str]]:
+    state = ledger_cache.view(ledger_path, "validation")
+    return get_account_classifier(ledger_path).candidate_pairs(text, set(state.opens), limit)
@@ -0,0 +1,160 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from beancount.core import data
+
+from core.account_classifier import tokenize
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+from core.ledger_scan import scan_directives
+from core.ledger_worker import offloaded
+
+CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+# Rough chars-per-token ratio for budgeting prompt sections without a tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def _name_tokens(account: str) -> List[str]:
+    parts = account.split(":")[1:]
+    return tokenize(" ".join(CAMEL_RE.sub(" ", p) for p in parts))
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class AccountRetriever:
+    """
+    Lexical retrieval of candidate accounts for a transaction description.
+
+    Each open account is described by the words in its name, its inline
+    comment and the narrations/payees historically posted to it. Accounts are
+    ranked against the input with TF-IDF cosine, so the prompt only needs to
+    list the few that are plausible instead of the whole chart of accounts.
+    The full listing and every rendered line are cached per ledger version.
+    """
+
+    def __init__(self, snapshot: LedgerSnapshot):
+        self._comments = scan_directives(snapshot.path).comments()
+        self._groups: Dict[str, List[str]] = defaultdict(list)
+        self._lines: Dict[str, str] = {}
+        self._terms: Dict[str, Counter] = {}
+        self._usage: Counter = Counter()
+        self._full_section: Optional[str] = None
+        self._index = None
+        self.extend(snapshot.entries)
+
+    def extend(self, entries) -> "AccountRetriever":
+        for entry in entries:
+            if isinstance(entry, data.Open) and entry.account not in self._terms:
+                acct = entry.account
+                self._groups[acct.split(":")[0]].append(acct)
+                comment = self._comments.get(acct)
+                self._lines[acct] = f"  - {acct}  # {comment}" if comment else f"  - {acct}"
+                terms = Counter()
+                # Name and comment words count double: they describe the account on purpose
+                for t in _name_tokens(acct) + tokenize(comment or ""):
+                    terms[t] += 2
+                self._terms[acct] = terms
+                self._full_section = None
+            elif isinstance(entry, data.Transaction):
+                words = tokenize(f"{entry.payee or ''} {entry.narration or ''}")
+                for acct in {p.account for p in entry.postings}:
+                    terms = self._terms.get(acct)
+                    if terms is not None:
+                        terms.update(words)
+                        self._usage[acct] += 1
+            else:
+                continue
+            self._index = None
+        return self
+
+    def _compile(self):
+        df = Counter()
+        for terms in self._terms.values():
+            df.update(terms.keys())
+        n = len(self._terms)
+        idf = {t: math.log((1 + n) / (1 + c)) + 1.0 for t, c in df.items()}
+        postings: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+        norms = {}
+        for acct, terms in self._terms.items():
+            sq = 0.0
+            for t, tf in terms.items():
+                w = (1 + math.log(tf)) * idf[t]
+                postings[t].append((acct, w))
+                sq += w * w
+            norms[acct] = math.sqrt(sq) or 1.0
+        self._index = (idf, postings, norms)
+        return self._index
+
+    def rank(self, text: str) -> Dict[str, float]:
+        """Cosine similarity of every account matching at least one input word."""
+        idf, postings, norms = self._index or self._compile()
+        words = [w for w in set(tokenize(text)) if w in idf]
+        if not words:
+            return {}
+        query_norm = math.sqrt(sum(idf[w] ** 2 for w in words))
+        scores: Dict[str, float] = defaultdict(float)
+        for w in words:
+            for acct, weight in postings[w]:
+                scores[acct] += weight * idf[w]
+        return {a: s / (norms[a] * query_norm) for a, s in scores.items()}
+
+    def full_section(self) -> str:
+        """Every open account, grouped by type, as listed in the prompt."""
+        if self._full_section is None:
+            self._full_section = self._render({g: sorted(a) for g, a in self._groups.items()})
+        return self._full_section
+
+    def _render(self, groups: Dict[str, List[str]]) -> str:
+        return "\n\n".join(
+            f"{group} Accounts:\n" + "\n".join(self._lines[a] for a in accts)
+            for group, accts in groups.items() if accts
+        )
+
+    def select(self, text: str, top_k: int, token_budget: int, min_score: float) -> Tuple[str, List[str], bool]:
+        """
+        Render the account section of a prompt for `text`.
+
+        Keeps the `top_k` best-matching accounts of each type (topped up with
+        the most used ones, so there is always a plausible source of funds),
+        shrinking k until the section fits in `token_budget`. Falls back to the
+        full listing when nothing matches better than `min_score`.
+
+        Returns:
+            Tuple[str, List[str], bool]: The section, the accounts it lists, and
+            whether it is the full (fallback) listing.
+        """
+        scores = self.rank(text)
+        if not scores or max(scores.values()) < min_score:
+            return self.full_section(), [a for accts in self._groups.values() for a in accts], True
+
+        ranked = {
+            group: sorted(accts, key=lambda a: (-scores.get(a, 0.0), -self._usage[a], a))
+            for group, accts in self._groups.items()
+        }
+        for k in range(max(top_k, 1), 0, -1):
+            groups = {g: sorted(accts[:k]) for g, accts in ranked.items()}
+            section = self._render(groups)
+            if estimate_tokens(section) <= token_budget:
+                break
+        return section, [a for accts in groups.values() for a in accts], False
+
+
+ledger_cache.register_view("accounts", AccountRetriever, lambda r, snapshot, new: r.extend(new))
+
+
+def get_account_retriever(ledger_path: str) -> AccountRetriever:
+    return ledger_cache.view(ledger_path, "accounts")
+
+
+@offloaded
+def select_accounts(ledger_path: str, text: str, top_k: int, token_budget: int, min_score: float) -> Tuple[str, List[str], bool]:
+    return get_account_retriever(ledger_path).select(text, top_k, token_budget, min_score)
+
+
+@offloaded
+def render_all_accounts(ledger_path: str) -> str:
+    return get_account_retriever(ledger_path).full_section()
@@ -1,12 +1,11 @@
 from __future__ import annotations
 
+from concurrent.futures import Future
 from datetime import datetime, timezone
 from decimal import Decimal, InvalidOperation
-from typing import List
+from typing import List, Optional
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from apscheduler.triggers.cron import CronTrigger
 from dateutil.tz import gettz
 
 from domain.schemas.automation import AutomationDB
@@ -14,25 +13,38 @@ from domain.models.dtos import (
     AutomationCreate,
     AutomationUpdate,
     AutomationOut,
+    CatchUpOut,
 )
 
-from core.log.logging_service import get_logger
+from core.log.logging_service import get_logger, log_context
 logger = get_logger(__name__)
 from infrastructure.persistence.automation_repository import AutomationRepository
-from core.beancount_service import append_simple_tx
-from conf import BEANCOUNT_FILE
-from infrastructure.scheduler.scheduler_service import remove_job_if_exists
+from core.beancount_service import BatchValidationError, build_transaction
+from core.idempotency import AUTOMATION_SCOPE, IdempotencyService
+from core.ledger_writer import get_ledger_writer
+from core.profiling import record_stage
+from conf import AUTOMATION_CATCHUP_MAX_RUNS, BEANCOUNT_FILE, SCHEDULER_LOCK_FILE
+from infrastructure.scheduler.scheduler_service import as_utc, exclusive_lock, missed_run_times, next_run_time
+
+# Claim, write and advance happen as one step across threads and worker processes
+DISPATCH_LOCK_FILE = SCHEDULER_LOCK_FILE + ".dispatch"
 
 class AutomationService:
-    def __init__(self, scheduler):
+    def __init__(self, dispatcher=None):
+        """
+        Args:
+            dispatcher (AutomationDispatcher | None): Woken when schedules change.
+        """
         self.repo = AutomationRepository()
-        self.scheduler = scheduler
+        self.dispatcher = dispatcher
 
 
 
     def create(self, body: AutomationCreate) -> AutomationOut:
-        a = self.repo.create(AutomationDB(**body.model_dump()))
-        self._schedule(a)
+        a = AutomationDB(**body.model_dump())
+        a.next_run_at = self._next_run(a)
+        a = self.repo.create(a)
+        self._wake()
         return self._to_out(a)
 
     def list(self) -> List[AutomationOut]:
@@ -55,87 +67,177 @@ class AutomationService:
         for k, v in data.items():
             setattr(a, k, v)
 
+        if data.keys() & {"cron_expression", "timezone", "enabled"}:
+            a.next_run_at = self._next_run(a)
         a = self.repo.update(a)
-        self._schedule(a)
+        self._wake()
         return self._to_out(a)
 
     def delete(self, id_: int) -> None:
         a = self.repo.get(id_)
         if not a:
             raise HTTPException(status_code=404, detail="Not found")
-        remove_job_if_exists(a.id, self.scheduler)
         self.repo.delete(a)
-
-    def resync_all(self) -> None:
-        for a in self.repo.list():
-            self._schedule(a)
+        self._wake()
+
+    def next_due_at(self) -> Optional[datetime]:
+        return self.repo.earliest_next_run()
+
+    def schedule_unscheduled(self) -> int:
+        """
+        Compute `next_run_at` for automations that don't have one yet (created
+        before it was stored). It counts from their last run, so runs missed
+        in between are caught up by the dispatcher.
+        """
+        rows = self.repo.unscheduled()
+        self.repo.bulk_update([
+            {"id": a.id, "next_run_at": next_run_time(a.cron_expression, a.timezone, a.last_ran_at or a.created_at)}
+            for a in rows
+        ])
+        return len(rows)
+
+    def run_due(self, now: datetime | None = None, skip_before: datetime | None = None) -> CatchUpOut:
+        """
+        Run every automation due at `now`, including runs missed since its
+        `next_run_at` (e.g. while the service was down).
+
+        Due automations are claimed with one query, all their transactions
+        (one per occurrence, dated at the occurrence) are handed to the ledger
+        writer at once so they are validated and written together, and their
+        `next_run_at` is advanced in one update. An automation whose
+        transactions fail is reported without blocking the others: if they
+        can't be built or don't validate it is advanced past them, but after
+        a transient error (e.g. the ledger worker died) it stays due and is
+        listed in `retrying`, so the runs are retried on a later pass.
+        Each run is written under its own idempotency key, so runs a pass
+        wrote before dying (without advancing `next_run_at`) aren't written again.
+
+        Args:
+            now (datetime | None): Defaults to the current time.
+            skip_before (datetime | None): Occurrences before this are skipped
+                (not run) instead of being caught up.
+        """
+        now = now or datetime.now(timezone.utc)
+        with exclusive_lock(DISPATCH_LOCK_FILE):
+            failed = {}
+            retrying = []
+            planned = []
+            advanced = {}
+            occurrences = 0
+            due = self.repo.due(now)
+            for a in due:
+                tz = gettz(a.timezone) or timezone.utc
+                first = as_utc(a.next_run_at).astimezone(tz)
+                lag = (now - first).total_seconds()
+                # One series for all automations; the per-automation lag goes to the log
+                record_stage("scheduler_lag", lag)
+                with log_context(automation_id=a.id):
+                    logger.info(f"Automation {a.id} runs {lag:.1f}s after its scheduled time")
+                runs = [first] + missed_run_times(a.cron_expression, a.timezone, first, now, AUTOMATION_CATCHUP_MAX_RUNS - 1)
+                if len(runs) == AUTOMATION_CATCHUP_MAX_RUNS:
+                    # The rest is picked up on the next pass
+                    with log_context(automation_id=a.id):
+                        logger.warning(f"Automation {a.id} missed more than {AUTOMATION_CATCHUP_MAX_RUNS} runs; running the oldest")
+                    advanced[a.id] = {"id": a.id, "next_run_at": next_run_time(a.cron_expression, a.timezone, runs[-1])}
+                else:
+                    advanced[a.id] = {"id": a.id, "next_run_at": next_run_time(a.cron_expression, a.timezone, now)}
+                if skip_before is not None:
+                    runs = [r for r in runs if r >= skip_before]
+                if not runs:
+                    continue
+                occurrences += len(runs)
+                try:
+                    with log_context(automation_id=a.id):
+                        txns = [self._build_transaction(a, run.date()) for run in runs]
+                except HTTPException as e:
+                    failed[a.id] = [str(e.detail)]
+                    continue
+                planned.append((a, runs, txns))
+
+            idempotency = IdempotencyService(BEANCOUNT_FILE)
+            run_keys = {
+                a.id: [f"{AUTOMATION_SCOPE}:{a.id}:{as_utc(run).isoformat()}" for run in runs]
+                for a, runs, _ in planned
+            }
+            written = idempotency.claim_runs({
+                key: [txn] for a, _, txns in planned for key, txn in zip(run_keys[a.id], txns)
+            })
+
+            writer = get_ledger_writer(BEANCOUNT_FILE)
+            submitted = []
+            for a, runs, txns in planned:
+                keys, todo = [], []
+                for key, txn in zip(run_keys[a.id], txns):
+                    if key not in written:
+                        keys.append(key)
+                        todo.append(txn)
+                with log_context(automation_id=a.id):
+                    if len(todo) < len(txns):
+                        logger.info(f"Automation {a.id}: {len(txns) - len(todo)} run(s) already written, skipping them")
+                    try:
+                        future = writer.submit(todo, auto_open_accounts=True) if todo else None
+                    except Exception as e:
+                        # e.g. the writer thread can't start: a transient failure, handled below
+                        future = Future()
+                        future.set_exception(e)
+                submitted.append((a, runs, keys, future))
+
+            appended = 0
+            completed, released = [], []
+            for a, runs, keys, future in submitted:
+                try:
+                    if future is not None:
+                        future.result()
+                except BatchValidationError as e:
+                    failed[a.id] = list(dict.fromkeys([m for msgs in e.item_errors.values() for m in msgs] + e.general_errors))
+                    released.extend(keys)
+                    continue
+                except Exception as e:
+                    # Not the payload's fault: leave it due so the next pass retries these runs
+                    failed[a.id] = [str(e)]
+                    released.extend(keys)
+                    del advanced[a.id]
+                    retrying.append(a.id)
+                    continue
+                advanced[a.id]["last_ran_at"] = as_utc(runs[-1])
+                completed.extend(keys)
+                appended += len(keys)
+
+            idempotency.complete_runs(completed)
+            idempotency.release_runs(released)
+            self.repo.bulk_update(list(advanced.values()))
+
+        if due:
+            logger.info(f"Ran {appended}/{occurrences} occurrence(s) of {len(due)} due automation(s), {len(failed)} failed")
+        for id_, errors in failed.items():
+            with log_context(automation_id=id_):
+                logger.error(f"Automation {id_} failed: {errors}")
+        return CatchUpOut(automations=len(due), occurrences=occurrences, appended=appended, failed=failed,
+                          retrying=retrying)
 
     # ---------- Internal methods ----------
 
-    def _schedule(self, a: AutomationDB) -> None:
-
-        # Always clear any prior job for this automation
-        remove_job_if_exists(a.id, self.scheduler)
+    def _next_run(self, a: AutomationDB) -> Optional[datetime]:
         if not a.enabled:
-            return
-
-        # Parse cron expression and create trigger
+            return None
         try:
-            # Split cron expression into components (minute, hour, day, month, day_of_week)
-            cron_parts = a.cron_expression.split()
-            if len(cron_parts) != 5:
-                raise ValueError("Cron expression must have exactly 5 parts")
-            
-            minute, hour, day, month, day_of_week = cron_parts
-            
-            # Get timezone info
-            tz = gettz(a.timezone) or timezone.utc
-            
-            trigger = CronTrigger(
-                minute=minute,
-                hour=hour,
-                day=day,
-                month=month,
-                day_of_week=day_of_week,
-                timezone=tz
-            )
-
-            self.scheduler.add_job(
-                func=self._execute_by_id,
-                trigger=trigger,
-                args=[a.id],
-                id=a.id,
-                replace_existing=True,
-                misfire_grace_time=3600,  # Allow 1 hour grace period for missed executions
-            )
+            return next_run_time(a.cron_expression, a.timezone, datetime.now(timezone.utc))
         except Exception as e:
-            print(e)
             raise HTTPException(400, f"Failed to schedule automation: {str(e)}")
 
-    def _execute_by_id(self, automation_id: str) -> None:
-        a = self.repo.get(automation_id)
-        if not a or not a.enabled:
-            return
+    def _wake(self) -> None:
+        if self.dispatcher is not None:
+            self.dispatcher.wake()
 
-        try:
-            # Update last_ran_at timestamp
-            a.last_ran_at = datetime.now(timezone.utc)
-            self.repo.update(a)
-            
-            self._execute(a)
-        except Exception:
-            # In production, log this properly
-            raise
-
-    def _execute(self, a: AutomationDB) -> None:
-        logger.info("Excuting automation")
+    def _build_transaction(self, a: AutomationDB, run_date=None):
+        """The transaction an automation appends when it runs on `run_date` (default: today)."""
         p = a.payload or {}
 
         ledger_path = BEANCOUNT_FILE
         payee = p.get("payee")  # optional
         narration = p.get("narration", f"Automated: {a.name}")
 
-        # Date: use payload.date (YYYY-MM-DD) if provided; else "today" in the automation's TZ
+        # Date: use payload.date (YYYY-MM-DD) if provided; else the run date in the automation's TZ
         date_str = p.get("date")
         if date_str:
             try:
@@ -143,6 +245,8 @@ class AutomationService:
                 tx_date = datetime.strptime(date_str, "%Y-%m-%d").date()
             except ValueError:
                 raise HTTPException(400, f"Invalid date format '{date_str}', expected YYYY-MM-DD")
+        elif run_date is not None:
+            tx_date = run_date
         else:
             tz = gettz(a.timezone) or timezone.utc
             tx_date = datetime.now(tz).date()
@@ -166,23 +270,14 @@ class AutomationService:
         if not acc_from or not acc_to:
             raise HTTPException(400, "Missing 'from' or 'to' account in payload")
 
-        # Append the 2-posting transaction (from = negative leg, to = positive leg)
-        logger.info(f"Appending to : {ledger_path} on {tx_date} {acc_from} -> {acc_to} {amt} {currency} {narration}, {payee}")
-        try:
-            append_simple_tx(
-                ledger_path=ledger_path,
-                tx_date=tx_date,
-                amount_value=amt,
-                currency=currency,
-                from_account=acc_from,
-                to_account=acc_to,
-                narration=narration,
-                payee=payee,
-                auto_open_accounts=True,
-            )
-        except ValueError as e:
-            # Bubble up Beancount validation/parse issues clearly
-            raise HTTPException(400, f"Beancount validation failed: {e}")
+        # The 2-posting transaction (from = negative leg, to = positive leg)
+        logger.debug(f"Transaction for {ledger_path} on {tx_date} {acc_from} -> {acc_to} {amt} {currency} {narration}, {payee}")
+        return build_transaction(
+            tx_date,
+            [(acc_from, -amt, currency), (acc_to, amt, currency)],
+            narration=narration,
+            payee=payee,
+        )
 
     @staticmethod
     def _to_out(a: AutomationDB) -> AutomationOut:
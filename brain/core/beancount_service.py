@@ -1,64 +1,84 @@
+import bisect
+from contextlib import contextmanager
 from datetime import date as Date
 from decimal import Decimal
 from pathlib import Path
 from typing import List, Dict
 from beancount.core import data, amount, number
 from beancount.parser import printer
-from beancount import loader
 import fcntl  # Unix only
+import os
+import time
 from collections import defaultdict
 import conf
+from core.ledger_cache import get_ledger_snapshot, ledger_cache
+from core.ledger_index import get_posting_index
+from core.ledger_journal import AppendJournal
+from core.ledger_scan import directive_scanner, scan_directives
+from core.ledger_shards import shard_loader
+from core.ledger_store import SnapshotStore
+from core.ledger_worker import offloaded
+from core.ledger_validation import validate_block
+from core.profiling import record_stage, timed
 from core.log.logging_service import get_logger
 logger = get_logger(__name__)
 
-def _safe_append_to_file(path: Path, text: str, lock: bool = True):
-    with open(path, "a", encoding="utf-8") as f:
-        if lock:
-            fcntl.flock(f, fcntl.LOCK_EX)
-        f.write(text)
-        if lock:
+if conf.LEDGER_SNAPSHOT_DIR:
+    ledger_cache.store = SnapshotStore(conf.LEDGER_SNAPSHOT_DIR)
+_journal = AppendJournal(conf.LEDGER_JOURNAL_DIR) if conf.LEDGER_JOURNAL_DIR else None
+
+@contextmanager
+def _locked_ledger(path: Path):
+    """Open the ledger for appending and hold an exclusive lock on it."""
+    with open(path, "ab") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            with timed("lock_hold"):
+                yield f
+        finally:
             fcntl.flock(f, fcntl.LOCK_UN)
 
+def _safe_append_to_file(f, text: str):
+    """Append to an already locked ledger handle and make it durable."""
+    f.write(text.encode("utf-8"))
+    f.flush()
+    os.fsync(f.fileno())
+
 
 # Beancount specific functionalities
 
+@offloaded
 def get_all_accounts_grouped(ledger_path: str) -> Dict[str, List[str]]:
-    entries, _, _ = loader.load_file(ledger_path)
+    scan = scan_directives(ledger_path)
+    if scan.synthesizes_opens:
+        # Some opens only exist once plugins ran over the parsed ledger
+        accounts = {e.account for e in get_ledger_snapshot(ledger_path).entries if isinstance(e, data.Open)}
+    else:
+        accounts = scan.opens
     grouped_accounts = defaultdict(list)
 
-    for entry in entries:
-        if isinstance(entry, data.Open):
-            account_type = entry.account.split(":")[0]
-            grouped_accounts[account_type].append(entry.account)
+    for account in accounts:
+        account_type = account.split(":")[0]
+        grouped_accounts[account_type].append(account)
 
     for group in grouped_accounts:
         grouped_accounts[group].sort()
 
     return dict(grouped_accounts)
 
-def get_recent_transactions(ledger_path: str, account: str, limit: int = 5) -> List[data.Transaction]:
-    entries, _, _ = loader.load_file(ledger_path)
-    txns = [
-        entry for entry in entries
-        if isinstance(entry, data.Transaction)
-        and any(post.account == account for post in entry.postings)
-    ]
-    return txns[-limit:]
+@offloaded
+def get_recent_transactions(ledger_path: str, account: str, limit: int = 5, include_subaccounts: bool = False) -> List[data.Transaction]:
+    return get_posting_index(ledger_path).last(account, limit, include_subaccounts)
 
+@offloaded
 def format_recent_transactions(ledger_path: str, account: str, limit: int = 5) -> str:
     txns = get_recent_transactions(ledger_path, account, limit)
     formatted_txns = [printer.format_entry(txn) for txn in txns]
     return "\n".join(formatted_txns)
 
-def get_recent_narrations_and_payees(ledger_path: str, account: str, limit: int = 5) -> list[tuple[str, str]]:
-    entries, _, _ = loader.load_file(ledger_path)
-    txns = [
-        entry for entry in entries
-        if isinstance(entry, data.Transaction)
-        and any(post.account == account for post in entry.postings)
-    ]
-
-    recent = txns[-limit:]
+@offloaded
+def get_recent_narrations_and_payees(ledger_path: str, account: str, limit: int = 5, include_subaccounts: bool = False) -> list[tuple[str, str]]:
+    recent = get_posting_index(ledger_path).last(account, limit, include_subaccounts)
     result = [
         (txn.narration.strip(), txn.payee.strip() if txn.payee else "")
         for txn in recent
@@ -68,10 +88,11 @@ def get_recent_narrations_and_payees(ledger_path: str, account: str, limit: int
 
 
 
+@offloaded
 def get_inline_account_comments_map(ledger_path: str) -> Dict[str, str]:
     """
     Extract inline comments (on the same line) for account 'Open' directives
-    by reading the raw file text.
+    by scanning the raw file text, without parsing the ledger.
 
     Args:
         ledger_path (str): Path to the Beancount ledger file.
@@ -79,21 +100,179 @@ def get_inline_account_comments_map(ledger_path: str) -> Dict[str, str]:
     Returns:
         Dict[str, str]: A mapping of account names to inline comments.
     """
-    with open(ledger_path, encoding="utf-8") as f:
-        lines = f.readlines()
+    return scan_directives(ledger_path).comments()
+
+class BatchValidationError(ValueError):
+    """
+    Raised when a batch of transactions fails validation. Nothing is written.
+
+    Attributes:
+        item_errors (Dict[int, List[str]]): Error messages per transaction index.
+        general_errors (List[str]): Errors not tied to a single transaction
+            (e.g. an auto-opened account).
+    """
+    def __init__(self, item_errors: Dict[int, List[str]], general_errors: List[str]):
+        self.item_errors = item_errors
+        self.general_errors = general_errors
+        first = general_errors[0] if general_errors else next(iter(item_errors.values()))[0]
+        super().__init__(f"Beancount validation failed: {first}")
+
+    def __reduce__(self):
+        # Raised in the ledger worker and re-raised in the web process
+        return type(self), (self.item_errors, self.general_errors)
+
+
+def build_transaction(
+    tx_date: Date,
+    postings: List[tuple],
+    narration: str = "",
+    payee: str | None = None,
+    flag: str = "*",
+    tags: set | None = None,
+    links: set | None = None,
+) -> data.Transaction:
+    """
+    Build a transaction from (account, amount, currency) tuples.
+
+    At most one posting may leave amount and currency as None; Beancount
+    interpolates it to balance the others.
+    """
+    meta = data.new_metadata("<append>", 0)
+    txn_postings = []
+    for account, amount_value, currency in postings:
+        units = None
+        if amount_value is not None:
+            units = amount.Amount(number.D(str(amount_value)), currency)
+        txn_postings.append(data.Posting(account, units, None, None, None, None))
+    return data.Transaction(
+        meta=meta,
+        date=tx_date,
+        flag=flag,
+        payee=payee or None,
+        narration=narration,
+        tags=frozenset(tags or ()),
+        links=frozenset(links or ()),
+        postings=txn_postings,
+    )
+
+
+@offloaded
+def append_many(
+    ledger_path: str,
+    transactions: List[data.Transaction],
+    auto_open_accounts: bool = True,
+) -> Dict[str, object]:
+    """
+    Append a batch of transactions to a Beancount ledger, all or nothing.
 
-    entries, _, _ = loader.load_file(ledger_path)
-    comments_map = {}
+    The ledger is locked once, missing accounts are opened once (dated at
+    their first use in the batch), the whole batch is validated in a single
+    pass and then written with a single append.
 
-    for entry in entries:
-        if isinstance(entry, data.Open):
-            lineno = entry.meta["lineno"] - 1  # 0-based index
-            line = lines[lineno]
-            if ";" in line:
-                comment = line.split(";", 1)[1].strip()
-                comments_map[entry.account] = comment
+    Args:
+        ledger_path (str): Path to the Beancount ledger file.
+        transactions (List[data.Transaction]): Transactions to append.
+        auto_open_accounts (bool): Open accounts the ledger doesn't know yet.
+
+    Returns:
+        Dict[str, object]: Number of appended transactions, opened accounts and
+        the time spent waiting for the ledger lock.
+
+    Raises:
+        BatchValidationError: If any transaction fails; nothing is written.
+    """
+    ledger = Path(ledger_path)
+    ledger.parent.mkdir(parents=True, exist_ok=True)
+    if not transactions:
+        return {"appended": 0, "opened_accounts": [], "lock_wait_seconds": 0.0}
+
+    rendered_txs = [printer.format_entry(txn) for txn in transactions]
+
+    # Read, validate and write under one lock so nothing can slip in between
+    wait_started = time.perf_counter()
+    with _locked_ledger(ledger):
+        lock_wait = time.perf_counter() - wait_started
+        record_stage("lock_wait", lock_wait)
+        with timed("ledger_read"):
+            snapshot = get_ledger_snapshot(ledger_path)
+            # Sharded ledger in a new year: appends go to a new shard from now on
+            if shard_loader.start_shard(snapshot.path, snapshot.target, Date.today().year):
+                ledger_cache.invalidate(ledger_path)
+                snapshot = get_ledger_snapshot(ledger_path)
+
+        # Collect existing opened accounts (only from 'open' directives for simplicity)
+        existing_accounts = ledger_cache.view_of(snapshot, "validation").opens
+
+        # Auto-open any missing accounts, dated at their first use
+        open_block = ""
+        first_use: Dict[str, Date] = {}
+        if auto_open_accounts:
+            for txn in transactions:
+                for post in txn.postings:
+                    if post.account not in existing_accounts:
+                        first_use[post.account] = min(txn.date, first_use.get(post.account, txn.date))
+            if first_use:
+                opens = []
+                for acct in sorted(first_use):
+                    ometa = data.new_metadata(str(ledger), 0)
+                    opens.append(printer.format_entry(data.Open(ometa, first_use[acct], acct, [], None)))
+                open_block = "\n".join(opens) + "\n"
+
+        # Render the appended block, remembering where each transaction starts
+        block = ("" if snapshot.ends_with_newline else "\n") + open_block
+        starts = []
+        for rendered_tx in rendered_txs:
+            block += "\n"
+            starts.append(snapshot.line_count + 1 + block.count("\n"))
+            block += rendered_tx + "\n"
+
+        with timed("validation"):
+            booked, errors = validate_block(snapshot, block, conf.LEDGER_VALIDATION_MODE)
+        if errors:
+            item_errors: Dict[int, List[str]] = defaultdict(list)
+            general_errors = []
+            for err in errors:
+                lineno = (err.source or {}).get("lineno")
+                index = bisect.bisect_right(starts, lineno) - 1 if lineno is not None else -1
+                if index >= 0:
+                    item_errors[index].append(err.message)
+                else:
+                    general_errors.append(err.message)
+            raise BatchValidationError(dict(item_errors), general_errors)
+
+        # The active shard of a sharded ledger, or the ledger itself
+        with timed("write"), ledger_cache.lock(ledger_path), open(snapshot.target, "ab") as target:
+            offset = os.fstat(target.fileno()).st_size
+            _safe_append_to_file(target, block)
+            if booked is not None:
+                ledger_cache.extend(snapshot, booked, block)
+            if _journal is not None:
+                try:
+                    _journal.record(snapshot.path, snapshot.target, offset, block)
+                except OSError:
+                    # The block is written; backups notice the gap and take a full copy
+                    logger.exception(f"Failed to journal the append to {snapshot.target}")
+
+    logger.info(f"Appended {len(transactions)} transaction(s) to {snapshot.target}, opened {sorted(first_use)}")
+    return {"appended": len(transactions), "opened_accounts": sorted(first_use), "lock_wait_seconds": lock_wait}
+
+
+@offloaded
+def warm_ledger(ledger_path: str) -> int:
+    """Parse the ledger and build its indexes ahead of the first request; returns its version."""
+    return ledger_cache.warm(ledger_path).version
+
+
+@offloaded
+def persist_ledger_snapshots() -> None:
+    """Save parsed ledgers that changed since last saved, for the next cold start."""
+    ledger_cache.persist()
+
+
+@offloaded
+def get_ledger_cache_stats() -> Dict[str, object]:
+    return {**ledger_cache.stats(), "directive_scan": directive_scanner.stats()}
 
-    return comments_map
 
 def append_simple_tx(
     ledger_path: str,
@@ -118,66 +297,14 @@ def append_simple_tx(
             "Grocery run"
         )
     """
-    ledger = Path(ledger_path)
-    ledger.parent.mkdir(parents=True, exist_ok=True)
-
-    original_text = ledger.read_text(encoding="utf-8") if ledger.exists() else ""
-
-    # Collect existing opened accounts (only from 'open' directives for simplicity)
-    existing_accounts = set()
-    if original_text:
-        entries, _, _ = loader.load_string(original_text)
-        for e in entries:
-            if isinstance(e, data.Open):
-                existing_accounts.add(e.account)
-
-    # Build transaction
-    meta = data.new_metadata(str(ledger), 0)
     quant = number.D(str(amount_value))
-    units = amount.Amount(quant, currency)
-    neg_units = amount.Amount(-quant, currency)
-
-    postings = [
-        data.Posting(from_account, neg_units, None, None, None, None),
-        data.Posting(to_account,   units,    None, None, None, None),
-    ]
-
-    txn = data.Transaction(
-        meta=meta,
-        date=tx_date,
-        flag="*",
-        payee=payee,
+    txn = build_transaction(
+        tx_date,
+        [(from_account, -quant, currency), (to_account, quant, currency)],
         narration=narration,
-        tags=set(),
-        links=set(),
-        postings=postings,
-    )
-
-    # Auto-open any missing accounts
-    open_block = ""
-    if auto_open_accounts:
-        needed = {from_account, to_account} - existing_accounts
-        if needed:
-            opens = []
-            for acct in sorted(needed):
-                ometa = data.new_metadata(str(ledger), 0)
-                opens.append(printer.format_entry(data.Open(ometa, tx_date, acct, [], None)))
-            open_block = "\n".join(opens) + "\n"
-
-    # Render candidate ledger and validate before writing
-    rendered_tx = printer.format_entry(txn)
-    candidate = (
-        (original_text.rstrip() + "\n\n" if original_text else "")
-        + open_block
-        + rendered_tx
-        + "\n"
+        payee=payee,
     )
-
-    _, errors, _ = loader.load_string(candidate)
-    if errors:
-        raise ValueError(f"Beancount validation failed: {errors[0]}")
-
-    _safe_append_to_file(ledger, open_block + "\n" + rendered_tx + "\n")
+    append_many(ledger_path, [txn], auto_open_accounts=auto_open_accounts)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from beancount.core import data
+from fastapi import HTTPException
+
+import conf
+from core.ledger_fingerprints import count_transactions, transaction_fingerprint
+from domain.schemas.idempotency import IdempotencyKeyDB
+from infrastructure.persistence.idempotency_repository import IdempotencyRepository
+from infrastructure.scheduler.scheduler_service import as_utc
+
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Scope of the keys automation runs are written under
+AUTOMATION_SCOPE = "automation"
+PURGE_INTERVAL_SECONDS = 3600
+
+_last_purge: Optional[float] = None
+_purge_lock = threading.Lock()
+
+
+def request_hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class IdempotencyService:
+    """
+    Idempotency keys for ledger appends.
+
+    A key is claimed (inserted) before the request does any work, so of
+    several concurrent retries only one runs: the others get its stored
+    response once it completed, or 409 while it is in flight. Right before
+    the write the key also records how many transactions with each of the
+    request's fingerprints the ledger will hold once they are in. If the
+    process dies between writing and completing the key, the next retry finds
+    them in the fingerprint index and replays the response instead of
+    appending again.
+    """
+
+    def __init__(self, ledger_path: str = conf.BEANCOUNT_FILE):
+        self.ledger_path = ledger_path
+        self.repo = IdempotencyRepository()
+
+    def claim(self, key: str, scope: str, payload: Any) -> Optional[Dict[str, Any]]:
+        """
+        Start a request under `key`.
+
+        Returns:
+            Optional[Dict[str, Any]]: The stored response if the request was
+            already done (replay it), else None: go ahead, then `complete` or
+            `release` the key.
+
+        Raises:
+            HTTPException: 422 if the key was used for a different request,
+                409 if the request holding it is still in progress.
+        """
+        self._purge_expired()
+        now = datetime.now(timezone.utc)
+        digest = request_hash({"scope": scope, "payload": payload})
+        if self.repo.claim(IdempotencyKeyDB(key=key, scope=scope, request_hash=digest, created_at=now)):
+            return None
+
+        row = self.repo.get(key)
+        if row is None:
+            # Purged or released in between
+            return self.claim(key, scope, payload)
+        if row.scope != scope or row.request_hash != digest:
+            raise HTTPException(422, f"{IDEMPOTENCY_HEADER} {key!r} was already used for a different request")
+        if row.completed_at is not None:
+            logger.info(f"Replaying the response of idempotency key {key}")
+            return row.response
+
+        age = (now - as_utc(row.created_at)).total_seconds()
+        if age < conf.IDEMPOTENCY_PENDING_SECONDS:
+            retry_after = max(1, int(conf.IDEMPOTENCY_PENDING_SECONDS - age))
+            raise HTTPException(409, f"A request with {IDEMPOTENCY_HEADER} {key!r} is still in progress",
+                                headers={"Retry-After": str(retry_after)})
+        # Abandoned: its transactions may or may not have been written
+        if row.fingerprints and self._written(row.fingerprints):
+            logger.warning(f"Idempotency key {key} was abandoned after its write; replaying its response")
+            self.repo.complete_many([key], now)
+            return row.response
+        if not self.repo.take_over(key, row.created_at, now):
+            raise HTTPException(409, f"A request with {IDEMPOTENCY_HEADER} {key!r} is still in progress")
+        logger.warning(f"Retrying abandoned idempotency key {key}")
+        return None
+
+    def expect(self, key: str, transactions: List[data.Transaction], response: Dict[str, Any]) -> None:
+        """Record, right before the write, what the ledger holds once `transactions` are in and what to return."""
+        self.repo.update(key, {"fingerprints": self._expected({key: transactions})[key], "response": response})
+
+    def complete(self, key: str, response: Dict[str, Any]) -> None:
+        self.repo.complete_many([key], datetime.now(timezone.utc), response)
+
+    def release(self, key: str) -> None:
+        """Forget the key of a request that failed without writing, so a retry runs it again."""
+        self.repo.delete_many([key])
+
+    def claim_runs(self, runs: Dict[str, List[data.Transaction]]) -> Set[str]:
+        """
+        Claim automation runs (key -> transactions) before writing them.
+
+        Runs are dispatched under an exclusive lock, so a key still in flight
+        here was abandoned by a pass that died.
+
+        Returns:
+            Set[str]: Keys of runs already written (by a pass that completed
+            them, or one that died before it could), which must be skipped.
+            The others are recorded as in flight.
+        """
+        now = datetime.now(timezone.utc)
+        existing = self.repo.get_many(list(runs))
+        written = set()
+        for key, row in existing.items():
+            if row.completed_at is not None or (row.fingerprints and self._written(row.fingerprints)):
+                written.add(key)
+        self.repo.complete_many([k for k in written if existing[k].completed_at is None], now)
+
+        pending = {k: txns for k, txns in runs.items() if k not in written}
+        expected = self._expected(pending)
+        self.repo.save_many([
+            IdempotencyKeyDB(
+                key=key,
+                scope=AUTOMATION_SCOPE,
+                request_hash=request_hash(sorted(expected[key])),
+                fingerprints=expected[key],
+                response={"appended": len(txns)},
+                created_at=now,
+            )
+            for key, txns in pending.items()
+        ])
+        return written
+
+    def complete_runs(self, keys: List[str]) -> None:
+        self.repo.complete_many(keys, datetime.now(timezone.utc))
+
+    def release_runs(self, keys: List[str]) -> None:
+        self.repo.delete_many(keys)
+
+    def _expected(self, requests: Dict[str, List[data.Transaction]]) -> Dict[str, Dict[str, int]]:
+        """Per request, the count of each of its fingerprints once it and the ones before it are written."""
+        fingerprints = {key: Counter(transaction_fingerprint(t) for t in txns) for key, txns in requests.items()}
+        unique = sorted({fp for counts in fingerprints.values() for fp in counts})
+        # Identical transactions appended meanwhile by someone else can make a
+        # request look written; keys only guard against our own retries
+        totals = dict(zip(unique, count_transactions(self.ledger_path, unique))) if unique else {}
+        expected = {}
+        for key, counts in fingerprints.items():
+            for fp, n in counts.items():
+                totals[fp] += n
+            expected[key] = {fp: totals[fp] for fp in counts}
+        return expected
+
+    def _written(self, expected: Dict[str, int]) -> bool:
+        fingerprints = list(expected)
+        counts = count_transactions(self.ledger_path, fingerprints)
+        return all(count >= expected[fp] for fp, count in zip(fingerprints, counts))
+
+    def _purge_expired(self) -> None:
+        """Drop expired keys, at most once per PURGE_INTERVAL_SECONDS per process."""
+        global _last_purge
+        with _purge_lock:
+            if _last_purge is not None and time.monotonic() - _last_purge < PURGE_INTERVAL_SECONDS:
+                return
+            _last_purge = time.monotonic()
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=conf.IDEMPOTENCY_KEY_TTL_HOURS)
+        # Abandoned automation runs are kept until a pass resolves them
+        removed = self.repo.purge(cutoff, keep_pending_scopes=[AUTOMATION_SCOPE])
+        if removed:
+            logger.info(f"Purged {removed} expired idempotency key(s)")
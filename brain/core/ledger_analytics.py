@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import tempfile
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from beancount.core import data
+
+import conf
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+from core.ledger_worker import offloaded
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Column name -> dtype; one row per posting
+COLUMNS = {
+    "day": np.int32,       # days since 1970-01-01
+    "month": np.int32,     # year * 12 + month - 1
+    "account": np.int32,
+    "currency": np.int16,
+    "amount": np.float64,
+    "payee": np.int32,     # -1 when the transaction has no payee
+}
+
+
+class _Dictionary:
+    """Dictionary encoding of one string column."""
+    __slots__ = ("values", "ids")
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values: List[str] = list(values)
+        self.ids: Dict[str, int] = {v: i for i, v in enumerate(self.values)}
+
+    def encode(self, value: str) -> int:
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+
+def _month_label(month: int) -> str:
+    return f"{month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def _round(values: np.ndarray) -> List[float]:
+    # Float sums of decimal amounts; drop the binary noise
+    return np.round(values, 8).tolist()
+
+
+class PostingTable:
+    """
+    Every posting of a ledger as NumPy columns.
+
+    Accounts, currencies and payees are dictionary-encoded, so a query is a
+    few vectorized passes over integer and float arrays (masks, `bincount`)
+    instead of a loop over transactions. Rows are in ledger order; appends add
+    rows at the end (columns grow by doubling).
+
+    A table can be saved as one `.npy` file per column and opened again
+    memory-mapped, so processes reading the same ledger share one copy.
+    """
+
+    def __init__(self):
+        self.accounts = _Dictionary()
+        self.currencies = _Dictionary()
+        self.payees = _Dictionary()
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.size = 0
+
+    @classmethod
+    def from_snapshot(cls, snapshot: LedgerSnapshot) -> "PostingTable":
+        table = cls()
+        table.extend(snapshot.entries)
+        return table
+
+    def extend(self, entries: Iterable[data.Directive]) -> "PostingTable":
+        rows = []
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            day = entry.date.toordinal() - EPOCH_ORDINAL
+            month = entry.date.year * 12 + entry.date.month - 1
+            payee = self.payees.encode(entry.payee) if entry.payee else -1
+            for posting in entry.postings:
+                units = posting.units
+                if units is None or not isinstance(units.number, Decimal):
+                    continue
+                rows.append((day, month, self.accounts.encode(posting.account),
+                             self.currencies.encode(units.currency), float(units.number), payee))
+        if rows:
+            self._append(rows)
+        return self
+
+    def _append(self, rows: List[Tuple]) -> None:
+        needed = self.size + len(rows)
+        for i, (name, dtype) in enumerate(COLUMNS.items()):
+            column = self._columns[name]
+            # Memory-mapped columns are read-only; the first append copies them
+            if len(column) < needed or not column.flags.writeable:
+                grown = np.empty(max(needed, 2 * len(column), 1024), dtype=dtype)
+                grown[:self.size] = column[:self.size]
+                column = self._columns[name] = grown
+            column[self.size:needed] = [row[i] for row in rows]
+        self.size = needed
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name][:self.size]
+
+    # ---------- Queries ----------
+
+    def _subtree_ids(self, root: str) -> np.ndarray:
+        prefix = root + ":"
+        return np.array([i for i, name in enumerate(self.accounts.values) if name == root or name.startswith(prefix)],
+                        dtype=np.int32)
+
+    def _mask(self, root: str, currency: str, start: Optional[date], end: Optional[date]) -> Optional[np.ndarray]:
+        currency_id = self.currencies.ids.get(currency)
+        ids = self._subtree_ids(root)
+        if currency_id is None or not len(ids):
+            return None
+        in_subtree = np.zeros(len(self.accounts.values), dtype=bool)
+        in_subtree[ids] = True
+        mask = (self.column("currency") == currency_id) & in_subtree[self.column("account")]
+        if start is not None:
+            mask &= self.column("day") >= start.toordinal() - EPOCH_ORDINAL
+        if end is not None:
+            mask &= self.column("day") <= end.toordinal() - EPOCH_ORDINAL
+        return mask
+
+    def monthly(self, root: str, currency: str, depth: int = 1,
+                start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Monthly totals of an account subtree, split by the sub-accounts
+        `depth` levels below `root` (postings higher up are grouped under
+        their own account).
+        """
+        mask = self._mask(root, currency, start, end)
+        if mask is None or not mask.any():
+            return {"months": [], "series": {}, "total": []}
+
+        # Group key of every account: its ancestor `depth` levels below root
+        level = root.count(":") + 1 + depth
+        groups = _Dictionary()
+        group_of = np.full(len(self.accounts.values), -1, dtype=np.int32)
+        for i in self._subtree_ids(root):
+            group_of[i] = groups.encode(":".join(self.accounts.values[i].split(":")[:level]))
+
+        months = self.column("month")[mask]
+        first = int(months.min())
+        n_months = int(months.max()) - first + 1
+        keys = group_of[self.column("account")[mask]] * n_months + (months - first)
+        sums = np.bincount(keys, weights=self.column("amount")[mask], minlength=len(groups.values) * n_months)
+        sums = sums.reshape(len(groups.values), n_months)
+        return {
+            "months": [_month_label(m) for m in range(first, first + n_months)],
+            "series": {name: _round(sums[i]) for i, name in sorted(enumerate(groups.values), key=lambda x: x[1])},
+            "total": _round(sums.sum(axis=0)),
+        }
+
+    def top_payees(self, root: str, currency: str, limit: int = 10,
+                   start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Payees with the largest totals in an account subtree."""
+        mask = self._mask(root, currency, start, end)
+        if mask is None:
+            return []
+        mask &= self.column("payee") >= 0
+        payees = self.column("payee")[mask]
+        if not len(payees):
+            return []
+        sums = np.bincount(payees, weights=self.column("amount")[mask], minlength=len(self.payees.values))
+        counts = np.bincount(payees, minlength=len(self.payees.values))
+        # Largest by magnitude, so it works for income (negative) subtrees too
+        order = np.argsort(-np.abs(sums), kind="stable")[:limit]
+        return [
+            {"payee": self.payees.values[i], "amount": round(float(sums[i]), 8), "count": int(counts[i])}
+            for i in order if counts[i]
+        ]
+
+    def rolling(self, root: str, currency: str, window: int = 3, interval: str = "month",
+                start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Totals of an account subtree per day or month (empty periods count as
+        zero) with their trailing average over `window` periods.
+        """
+        mask = self._mask(root, currency, start, end)
+        if mask is None or not mask.any():
+            return {"periods": [], "totals": [], "average": []}
+        periods = self.column("month" if interval == "month" else "day")[mask]
+        first = int(periods.min())
+        totals = np.bincount(periods - first, weights=self.column("amount")[mask])
+        cumulative = np.concatenate(([0.0], np.cumsum(totals)))
+        counts = np.minimum(np.arange(1, len(totals) + 1), window)
+        average = (cumulative[1:] - cumulative[np.maximum(np.arange(1, len(totals) + 1) - window, 0)]) / counts
+        if interval == "month":
+            labels = [_month_label(m) for m in range(first, first + len(totals))]
+        else:
+            labels = [date.fromordinal(d + EPOCH_ORDINAL).isoformat() for d in range(first, first + len(totals))]
+        return {"periods": labels, "totals": _round(totals), "average": _round(average)}
+
+    # ---------- Memory-mapped storage ----------
+
+    def save(self, directory: str, source: str) -> None:
+        """Write the table to `directory`; `source` identifies the ledger content it was built from."""
+        os.makedirs(directory, exist_ok=True)
+        for name in COLUMNS:
+            fd, tmp = tempfile.mkstemp(prefix=f".{name}-", suffix=".npy", dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, self.column(name))
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, os.path.join(directory, f"{name}.npy"))
+        meta = {
+            "source": source,
+            "size": self.size,
+            "accounts": self.accounts.values,
+            "currencies": self.currencies.values,
+            "payees": self.payees.values,
+        }
+        # Written last: readers only trust columns once the metadata matches
+        fd, tmp = tempfile.mkstemp(prefix=".meta-", suffix=".json", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, os.path.join(directory, "meta.json"))
+
+    @classmethod
+    def open(cls, directory: str, source: str) -> Optional["PostingTable"]:
+        """Map a saved table read-only, if it was built from `source`."""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["source"] != source:
+                return None
+            table = cls()
+            for name in COLUMNS:
+                column = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                if len(column) != meta["size"]:
+                    return None
+                table._columns[name] = column
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        table.size = meta["size"]
+        table.accounts = _Dictionary(meta["accounts"])
+        table.currencies = _Dictionary(meta["currencies"])
+        table.payees = _Dictionary(meta["payees"])
+        return table
+
+
+def _table_dir(ledger_path: str) -> str:
+    name = os.path.splitext(os.path.basename(ledger_path))[0]
+    tag = hashlib.sha1(ledger_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(conf.ANALYTICS_TABLE_DIR, f"{name}-{tag}")
+
+
+def _source_of(snapshot: LedgerSnapshot) -> str:
+    # The append target's digest, plus the identity of every other file
+    others = [
+        (p, i.size, i.mtime_ns) if i else (p, None, None)
+        for p, i in zip(snapshot.files, snapshot.identities) if p != snapshot.target
+    ]
+    return hashlib.sha256(json.dumps([snapshot.digest, others]).encode()).hexdigest()
+
+
+def _build(snapshot: LedgerSnapshot) -> PostingTable:
+    if not conf.ANALYTICS_TABLE_DIR:
+        return PostingTable.from_snapshot(snapshot)
+    directory, source = _table_dir(snapshot.path), _source_of(snapshot)
+    table = PostingTable.open(directory, source)
+    if table is not None:
+        logger.info(f"Mapped the posting table of {snapshot.path} from {directory} ({table.size} rows)")
+        return table
+    table = PostingTable.from_snapshot(snapshot)
+    try:
+        table.save(directory, source)
+    except OSError:
+        logger.exception(f"Failed to save the posting table to {directory}")
+    return table
+
+
+ledger_cache.register_view("analytics", _build, lambda table, snapshot, new: table.extend(new))
+
+
+def _table(ledger_path: str) -> PostingTable:
+    return ledger_cache.view(ledger_path, "analytics")
+
+
+@offloaded
+def monthly_spend(ledger_path: str, account: str, currency: str, depth: int = 1,
+                  start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    return _table(ledger_path).monthly(account, currency, depth, start, end)
+
+
+@offloaded
+def top_payees(ledger_path: str, account: str, currency: str, limit: int = 10,
+               start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+    return _table(ledger_path).top_payees(account, currency, limit, start, end)
+
+
+@offloaded
+def rolling_average(ledger_path: str, account: str, currency: str, window: int = 3, interval: str = "month",
+                    start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    return _table(ledger_path).rolling(account, currency, window, interval, start, end)
@@ -0,0 +1,211 @@
+import bisect
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from beancount.core import account as account_lib, data
+
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+from core.ledger_worker import offloaded
+
+ZERO = Decimal(0)
+
+# Bucket key of a date for each supported interval
+INTERVALS = {
+    "day": lambda d: d,
+    "month": lambda d: d.replace(day=1),
+}
+
+
+def _bucket_label(key: date, interval: str) -> str:
+    return key.strftime("%Y-%m") if interval == "month" else key.isoformat()
+
+
+class _Series:
+    """One account's balance changes per bucket, with the running balance after each."""
+    __slots__ = ("keys", "changes", "totals")
+
+    def __init__(self):
+        self.keys: List[date] = []
+        self.changes: List[Dict[str, Decimal]] = []
+        self.totals: List[Dict[str, Decimal]] = []
+
+    @classmethod
+    def from_changes(cls, changes: Dict[date, Dict[str, Decimal]]) -> "_Series":
+        series = cls()
+        running: Dict[str, Decimal] = {}
+        for key in sorted(changes):
+            for currency, number in changes[key].items():
+                running[currency] = running.get(currency, ZERO) + number
+            series.keys.append(key)
+            series.changes.append(changes[key])
+            series.totals.append(dict(running))
+        return series
+
+    def add(self, key: date, currency: str, number: Decimal) -> None:
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.keys.insert(i, key)
+            self.changes.insert(i, {})
+            self.totals.insert(i, dict(self.totals[i - 1]) if i else {})
+        change = self.changes[i]
+        change[currency] = change.get(currency, ZERO) + number
+        # Appends land in the last bucket, so this is usually one iteration
+        for totals in self.totals[i:]:
+            totals[currency] = totals.get(currency, ZERO) + number
+
+    def at(self, day: date) -> Dict[str, Decimal]:
+        """Balance at the end of `day`."""
+        i = bisect.bisect_right(self.keys, day)
+        return dict(self.totals[i - 1]) if i else {}
+
+    def between(self, start: Optional[date], end: Optional[date]) -> Iterable[Tuple[date, Dict[str, Decimal], Dict[str, Decimal]]]:
+        lo = bisect.bisect_left(self.keys, start) if start else 0
+        hi = bisect.bisect_right(self.keys, end) if end else len(self.keys)
+        for i in range(lo, hi):
+            yield self.keys[i], self.changes[i], self.totals[i]
+
+
+class BalanceView:
+    """
+    Materialized balances of every account, per currency (in units).
+
+    Kept for each account on its own and for each account with its
+    sub-accounts (so `Expenses` rolls up everything below it), with daily and
+    monthly buckets holding the change in the bucket and the balance after it.
+    Built once per ledger version and updated in place on appends (under the
+    ledger's cache lock, which readers must hold too), so reads never parse or
+    scan the ledger.
+    """
+
+    def __init__(self, snapshot: LedgerSnapshot):
+        # account -> day -> currency -> change, for postings to that exact account
+        daily: Dict[str, Dict[date, Dict[str, Decimal]]] = defaultdict(lambda: defaultdict(dict))
+        for entry in snapshot.entries:
+            if isinstance(entry, data.Transaction):
+                for posting in entry.postings:
+                    units = posting.units
+                    if units is None or not isinstance(units.number, Decimal):
+                        continue
+                    changes = daily[posting.account][entry.date]
+                    changes[units.currency] = changes.get(units.currency, ZERO) + units.number
+
+        # Roll each account's changes up into itself and every parent
+        subtree: Dict[str, Dict[date, Dict[str, Decimal]]] = defaultdict(lambda: defaultdict(dict))
+        for acct, days in daily.items():
+            for parent in account_lib.parents(acct):
+                target = subtree[parent]
+                for day, changes in days.items():
+                    bucket = target[day]
+                    for currency, number in changes.items():
+                        bucket[currency] = bucket.get(currency, ZERO) + number
+
+        self._series: Dict[Tuple[str, bool, str], _Series] = {}
+        for include_subaccounts, source in ((False, daily), (True, subtree)):
+            for acct, days in source.items():
+                for interval, bucket_of in INTERVALS.items():
+                    if interval == "day":
+                        changes = days
+                    else:
+                        changes = defaultdict(dict)
+                        for day, day_changes in days.items():
+                            bucket = changes[bucket_of(day)]
+                            for currency, number in day_changes.items():
+                                bucket[currency] = bucket.get(currency, ZERO) + number
+                    self._series[(acct, include_subaccounts, interval)] = _Series.from_changes(changes)
+
+        self._totals: Dict[Tuple[str, bool], Dict[str, Decimal]] = {
+            (acct, include_subaccounts): dict(series.totals[-1]) if series.totals else {}
+            for (acct, include_subaccounts, interval), series in self._series.items() if interval == "day"
+        }
+
+    def extend(self, new_entries: Iterable[data.Directive]) -> "BalanceView":
+        for entry in new_entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            for posting in entry.postings:
+                units = posting.units
+                if units is None or not isinstance(units.number, Decimal):
+                    continue
+                targets = [(posting.account, False)] + [(p, True) for p in account_lib.parents(posting.account)]
+                for acct, include_subaccounts in targets:
+                    for interval, bucket_of in INTERVALS.items():
+                        key = (acct, include_subaccounts, interval)
+                        if key not in self._series:
+                            self._series[key] = _Series()
+                        self._series[key].add(bucket_of(entry.date), units.currency, units.number)
+                    totals = self._totals.setdefault((acct, include_subaccounts), {})
+                    totals[units.currency] = totals.get(units.currency, ZERO) + units.number
+        return self
+
+    def accounts(self, include_subaccounts: bool = False) -> List[str]:
+        return sorted(acct for acct, sub in self._totals if sub == include_subaccounts)
+
+    def balance(self, account: str, as_of: Optional[date] = None, include_subaccounts: bool = False) -> Optional[Dict[str, Decimal]]:
+        """Balance of an account, now or at the end of `as_of`; None if it has no postings."""
+        if (account, include_subaccounts) not in self._totals:
+            return None
+        if as_of is None:
+            return dict(self._totals[(account, include_subaccounts)])
+        return self._series[(account, include_subaccounts, "day")].at(as_of)
+
+    def series(self, account: str, interval: str, include_subaccounts: bool = False,
+               start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Change and closing balance of an account per bucket that has postings, oldest first."""
+        series = self._series.get((account, include_subaccounts, interval))
+        if series is None:
+            return []
+        # Buckets are keyed by their first day; include the one `start` falls in
+        start = INTERVALS[interval](start) if start else None
+        return [
+            {"period": _bucket_label(key, interval), "change": dict(change), "balance": dict(totals)}
+            for key, change, totals in series.between(start, end)
+        ]
+
+
+ledger_cache.register_view("balances", BalanceView, lambda view, snapshot, new: view.extend(new))
+
+
+@offloaded
+def get_balances(ledger_path: str, as_of: Optional[date] = None, include_subaccounts: bool = False) -> Dict[str, Any]:
+    """
+    Balances of every account with postings.
+
+    Args:
+        ledger_path (str): Path to the Beancount ledger file.
+        as_of (Optional[date]): Balances at the end of this day (default: now).
+        include_subaccounts (bool): Also list parent accounts, rolling up
+            their sub-accounts.
+
+    Returns:
+        Dict[str, Any]: The ledger version and account -> currency -> amount.
+    """
+    # The view is extended in place on appends, under this lock
+    with ledger_cache.lock(ledger_path):
+        snapshot = ledger_cache.get(ledger_path)
+        view = ledger_cache.view_of(snapshot, "balances")
+        balances = {acct: view.balance(acct, as_of, include_subaccounts) for acct in view.accounts(include_subaccounts)}
+    return {"version": snapshot.version, "balances": balances}
+
+
+@offloaded
+def get_account_balance(ledger_path: str, account: str, as_of: Optional[date] = None,
+                        include_subaccounts: bool = False, interval: Optional[str] = None,
+                        start: Optional[date] = None, end: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    """
+    Balance of one account, optionally with its history per day or month.
+
+    Returns:
+        Optional[Dict[str, Any]]: None if the account has no postings.
+    """
+    with ledger_cache.lock(ledger_path):
+        snapshot = ledger_cache.get(ledger_path)
+        view = ledger_cache.view_of(snapshot, "balances")
+        balance = view.balance(account, as_of, include_subaccounts)
+        if balance is None:
+            return None
+        result = {"version": snapshot.version, "account": account, "balance": balance, "series": []}
+        if interval is not None:
+            result["series"] = view.series(account, interval, include_subaccounts, start, end or as_of)
+    return result
@@ -0,0 +1,373 @@
+import bisect
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, fields, replace
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from beancount import loader
+from beancount.core import data
+
+from core.ledger_shards import shard_loader
+from core.profiling import current_caller, record_stage
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class FileIdentity:
+    """Cheap on-disk identity of one ledger file (top-level or included)."""
+    path: str
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def of(cls, path: str) -> Optional["FileIdentity"]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return cls(path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+@dataclass(frozen=True)
+class LedgerSnapshot:
+    """
+    An immutable, fully loaded view of a ledger at one point in time.
+
+    `entries` and `errors` are tuples and `options_map` is a read-only mapping,
+    so a snapshot can be shared between threads and requests without copying.
+    `target` is the file appends go to: the top-level file, or the active
+    shard of a sharded ledger (see core.ledger_shards). `digest`, `line_count`
+    and `ends_with_newline` describe that file.
+    """
+    path: str
+    version: int
+    files: Tuple[str, ...]
+    identities: Tuple[Optional[FileIdentity], ...]
+    target: str
+    digest: str
+    line_count: int
+    ends_with_newline: bool
+    entries: Tuple[data.Directive, ...]
+    errors: Tuple[data.BeancountError, ...]
+    options_map: Mapping[str, Any]
+
+    def is_current(self) -> bool:
+        """True if none of the files this snapshot was loaded from changed since."""
+        return tuple(FileIdentity.of(p) for p in self.files) == self.identities
+
+    @property
+    def target_index(self) -> int:
+        return self.files.index(self.target)
+
+    def __reduce__(self):
+        # MappingProxyType doesn't pickle; snapshots are persisted by core.ledger_store
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        values["options_map"] = dict(self.options_map)
+        return _unpickle_snapshot, (values,)
+
+
+def _unpickle_snapshot(values: Dict[str, Any]) -> LedgerSnapshot:
+    values["options_map"] = MappingProxyType(values["options_map"])
+    return LedgerSnapshot(**values)
+
+
+def _scan_file(path: str):
+    """Hash a file and count its lines in one buffered pass."""
+    h = hashlib.sha256()
+    lines = 0
+    last = b"\n"
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+                lines += chunk.count(b"\n")
+                last = chunk[-1:]
+    except FileNotFoundError:
+        pass
+    return h, lines, last == b"\n"
+
+
+def _merge_sorted(entries: Tuple[data.Directive, ...], new_entries: Sequence[data.Directive]) -> Tuple[data.Directive, ...]:
+    # New entries almost always land at the tail, so bisecting beats re-sorting
+    merged = list(entries)
+    for entry in sorted(new_entries, key=data.entry_sortkey):
+        index = bisect.bisect_right(merged, data.entry_sortkey(entry), key=data.entry_sortkey)
+        merged.insert(index, entry)
+    return tuple(merged)
+
+
+class LedgerCache:
+    """
+    Process-wide cache of parsed ledgers, keyed on file identity.
+
+    A snapshot is reused for as long as the device, inode, size and mtime of the
+    top-level file and of every file it includes are unchanged. Any write to the
+    ledger (ours, Fava's, or a manual edit) changes at least one of those, so
+    the next `get` transparently re-parses.
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, LedgerSnapshot] = {}
+        self._hashers: Dict[str, Any] = {}
+        self._views: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._view_builders: Dict[str, Tuple[Callable, Optional[Callable]]] = {}
+        self._locks: Dict[str, threading.RLock] = {}
+        self._guard = threading.Lock()
+        self._version = 0
+        self._persisted: Dict[str, int] = {}
+        # Optional on-disk store (core.ledger_store) to restore from instead of parsing
+        self.store = None
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self.parse_seconds = 0.0
+
+    def _lock_for(self, path: str) -> threading.RLock:
+        with self._guard:
+            return self._locks.setdefault(path, threading.RLock())
+
+    def lock(self, ledger_path: str) -> threading.RLock:
+        """
+        The lock guarding a ledger's cache entry.
+
+        Hold it while appending to the file and extending the snapshot, so
+        readers that notice the change wait for the extension instead of
+        starting a full re-parse.
+        """
+        return self._lock_for(os.path.abspath(ledger_path))
+
+    def _next_version(self) -> int:
+        with self._guard:
+            self._version += 1
+            return self._version
+
+    def get(self, ledger_path: str) -> LedgerSnapshot:
+        """
+        Return the current snapshot of a ledger, parsing it only if it changed.
+
+        Args:
+            ledger_path (str): Path to the top-level Beancount file.
+
+        Returns:
+            LedgerSnapshot: Parsed entries, errors and options for the ledger.
+        """
+        path = os.path.abspath(ledger_path)
+        snapshot = self._snapshots.get(path)
+        if snapshot is not None and snapshot.is_current():
+            self.hits += 1
+            return snapshot
+
+        # Serialize parses of the same file so concurrent misses parse only once
+        with self._lock_for(path):
+            snapshot = self._snapshots.get(path)
+            if snapshot is not None and snapshot.is_current():
+                self.hits += 1
+                return snapshot
+            snapshot = self.store.restore(self, path) if self.store is not None else None
+            if snapshot is None:
+                snapshot = self._load(path)
+                self._snapshots[path] = snapshot
+            return snapshot
+
+    def _load(self, path: str) -> LedgerSnapshot:
+        self.misses += 1
+        # Stat before parsing: a write racing the parse then shows up as a miss next time
+        top = FileIdentity.of(path)
+        started = time.perf_counter()
+        sharded = shard_loader.load(path) if top is not None else None
+        if sharded is not None:
+            entries, errors, options_map, files, target = sharded
+        elif top is None:
+            entries, errors, options_map = loader.load_string("")
+            files, target = (path,), path
+        else:
+            entries, errors, options_map = loader.load_file(path)
+            files, target = (path,) + tuple(p for p in options_map.get("include", []) if p != path), path
+        identities = (top,) + tuple(FileIdentity.of(p) for p in files[1:])
+        elapsed = time.perf_counter() - started
+        self.parse_seconds += elapsed
+        record_stage("ledger_parse", elapsed, caller=current_caller())
+        version = self._next_version()
+        hasher, line_count, ends_with_newline = _scan_file(target)
+        self._hashers[path] = hasher
+
+        logger.info(f"Parsed ledger {path} (v{version}, {len(entries)} entries) in {elapsed * 1000:.1f} ms")
+        return LedgerSnapshot(
+            path=path,
+            version=version,
+            files=files,
+            identities=identities,
+            target=target,
+            digest=hasher.hexdigest(),
+            line_count=line_count,
+            ends_with_newline=ends_with_newline,
+            entries=tuple(entries),
+            errors=tuple(errors),
+            options_map=MappingProxyType(options_map),
+        )
+
+    def extend(self, snapshot: LedgerSnapshot, new_entries: List[data.Directive], text: str) -> Optional[LedgerSnapshot]:
+        """
+        Advance a snapshot past text we just appended to its target file.
+
+        The caller must hold the ledger's write lock and `snapshot` must have been
+        current when it was taken, so the file is exactly the snapshot plus `text`.
+        If that doesn't hold (someone else wrote in between) the ledger is simply
+        invalidated and the next `get` re-parses it.
+
+        Args:
+            snapshot (LedgerSnapshot): The snapshot the append was validated against.
+            new_entries (List[data.Directive]): Booked entries parsed from `text`.
+            text (str): Exactly what was appended to the file.
+
+        Returns:
+            Optional[LedgerSnapshot]: The extended snapshot, or None if invalidated.
+        """
+        path = snapshot.path
+        raw = text.encode("utf-8")
+        index = snapshot.target_index
+        with self._lock_for(path):
+            current = FileIdentity.of(snapshot.target)
+            previous = snapshot.identities[index]
+            expected_size = (previous.size if previous else 0) + len(raw)
+            if self._snapshots.get(path) is not snapshot or current is None or current.size != expected_size:
+                self.invalidate(path)
+                return None
+
+            hasher = self._hashers[path]
+            hasher.update(raw)
+            extended = replace(
+                snapshot,
+                version=self._next_version(),
+                identities=snapshot.identities[:index] + (current,) + snapshot.identities[index + 1:],
+                digest=hasher.hexdigest(),
+                line_count=snapshot.line_count + text.count("\n"),
+                ends_with_newline=text.endswith("\n") if text else snapshot.ends_with_newline,
+                entries=_merge_sorted(snapshot.entries, new_entries),
+            )
+
+            # Carry views that know how to absorb new entries; drop the rest
+            _, views = self._views.get(path, (snapshot.version, {}))
+            carried = {}
+            for name, value in views.items():
+                _, extend_view = self._view_builders[name]
+                if extend_view is not None:
+                    carried[name] = extend_view(value, extended, new_entries)
+            self._views[path] = (extended.version, carried)
+            self._snapshots[path] = extended
+            self.extensions += 1
+            return extended
+
+    def register_view(self, name: str, build: Callable[[LedgerSnapshot], Any],
+                      extend: Optional[Callable[[Any, LedgerSnapshot, List[data.Directive]], Any]] = None) -> None:
+        """
+        Register a structure derived from a snapshot (an index, a state, ...).
+
+        `build(snapshot)` computes it from scratch once per ledger version.
+        `extend(value, snapshot, new_entries)`, if given, updates it after an
+        append instead of rebuilding it.
+        """
+        self._view_builders[name] = (build, extend)
+
+    def view(self, ledger_path: str, name: str) -> Any:
+        """Return the named view for the current version of a ledger."""
+        return self.view_of(self.get(ledger_path), name)
+
+    def view_of(self, snapshot: LedgerSnapshot, name: str) -> Any:
+        build, _ = self._view_builders[name]
+        with self._lock_for(snapshot.path):
+            version, views = self._views.get(snapshot.path, (None, {}))
+            if version == snapshot.version and name in views:
+                return views[name]
+            value = build(snapshot)
+            # Only memoize views of the snapshot currently held in the cache
+            if self._snapshots.get(snapshot.path) is snapshot:
+                if version != snapshot.version:
+                    views = {}
+                    self._views[snapshot.path] = (snapshot.version, views)
+                views[name] = value
+            return value
+
+    def warm(self, ledger_path: str) -> LedgerSnapshot:
+        """Parse a ledger and build every registered view of it ahead of use."""
+        snapshot = self.get(ledger_path)
+        for name in list(self._view_builders):
+            self.view_of(snapshot, name)
+        self.persist(ledger_path)
+        return snapshot
+
+    def registered_views(self) -> Dict[str, Callable]:
+        return {name: build for name, (build, _) in self._view_builders.items()}
+
+    def adopt(self, snapshot: LedgerSnapshot, views: Dict[str, Any], hasher) -> None:
+        """
+        Install a snapshot restored from disk as the current one.
+
+        `hasher` must have consumed exactly the file content the snapshot
+        covers, so later appends can keep extending it.
+        """
+        path = snapshot.path
+        with self._lock_for(path):
+            with self._guard:
+                # Versions restart with the process; keep them increasing
+                self._version = max(self._version, snapshot.version)
+            self._hashers[path] = hasher
+            # Views no longer registered can't be extended; drop them
+            views = {name: value for name, value in views.items() if name in self._view_builders}
+            self._views[path] = (snapshot.version, views)
+            self._snapshots[path] = snapshot
+            self._persisted[path] = snapshot.version
+
+    def persist(self, ledger_path: Optional[str] = None) -> None:
+        """Save the current snapshot (and its views) of one or all ledgers, if changed since last saved."""
+        if self.store is None:
+            return
+        paths = [os.path.abspath(ledger_path)] if ledger_path else list(self._snapshots)
+        for path in paths:
+            # Held while pickling: views are updated in place by appends
+            with self._lock_for(path):
+                snapshot = self._snapshots.get(path)
+                if snapshot is None or self._persisted.get(path) == snapshot.version:
+                    continue
+                version, views = self._views.get(path, (None, {}))
+                try:
+                    self.store.save(self, snapshot, views if version == snapshot.version else {})
+                except Exception:
+                    logger.exception(f"Failed to persist the snapshot of {path}")
+                    continue
+                self._persisted[path] = snapshot.version
+
+    def invalidate(self, ledger_path: Optional[str] = None) -> None:
+        """Drop the cached snapshot of one ledger, or of all ledgers."""
+        with self._guard:
+            if ledger_path is None:
+                self._snapshots.clear()
+                self._views.clear()
+            else:
+                self._snapshots.pop(os.path.abspath(ledger_path), None)
+                self._views.pop(os.path.abspath(ledger_path), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "extensions": self.extensions,
+            "parse_seconds": round(self.parse_seconds, 6),
+            "restores": self.store.restores if self.store is not None else 0,
+            **shard_loader.stats(),
+            "ledgers": {p: s.version for p, s in self._snapshots.items()},
+        }
+
+
+# Shared by every reader in the process
+ledger_cache = LedgerCache()
+
+
+def get_ledger_snapshot(ledger_path: str) -> LedgerSnapshot:
+    return ledger_cache.get(ledger_path)
@@ -0,0 +1,53 @@
+import hashlib
+from collections import Counter
+from typing import Iterable, List
+
+from beancount.core import data
+from beancount.core.interpolate import AUTOMATIC_META
+
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+from core.ledger_worker import offloaded
+
+
+def transaction_fingerprint(txn: data.Transaction) -> str:
+    """
+    Identify a transaction by its date, payee, narration and postings.
+
+    Postings left for beancount to interpolate are skipped, so a transaction
+    built with an elided amount matches the same transaction once booked.
+    Amounts are compared by value (50 and 50.00 are the same).
+    """
+    postings = sorted(
+        (p.account, format(p.units.number.normalize(), "f"), p.units.currency)
+        for p in txn.postings
+        if p.units is not None and p.units.number is not None and not (p.meta and AUTOMATIC_META in p.meta)
+    )
+    key = "\x1f".join([txn.date.isoformat(), txn.payee or "", txn.narration or ""] + ["\x1e".join(p) for p in postings])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class FingerprintIndex:
+    """How many transactions of the ledger have each fingerprint."""
+
+    def __init__(self, snapshot: LedgerSnapshot):
+        self._counts: Counter = Counter()
+        self.extend(snapshot.entries)
+
+    def extend(self, entries: Iterable[data.Directive]) -> "FingerprintIndex":
+        for entry in entries:
+            if isinstance(entry, data.Transaction):
+                self._counts[transaction_fingerprint(entry)] += 1
+        return self
+
+    def count(self, fingerprint: str) -> int:
+        return self._counts.get(fingerprint, 0)
+
+
+ledger_cache.register_view("fingerprints", FingerprintIndex, lambda index, snapshot, new: index.extend(new))
+
+
+@offloaded
+def count_transactions(ledger_path: str, fingerprints: List[str]) -> List[int]:
+    """How many transactions of the ledger have each of `fingerprints`."""
+    index = ledger_cache.view(ledger_path, "fingerprints")
+    return [index.count(fp) for fp in fingerprints]
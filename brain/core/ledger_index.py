@@ -0,0 +1,70 @@
+import bisect
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from beancount.core import account as account_lib, data
+
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+
+
+class PostingIndex:
+    """
+    Transactions per account, kept in ledger (date) order.
+
+    Each transaction is listed once under every account it posts to, and once
+    under every parent of those accounts, so `Expenses:Food` also covers
+    `Expenses:Food:Groceries`. "Last N for account X" is then a slice of one list.
+    """
+
+    def __init__(self, snapshot: LedgerSnapshot):
+        self._exact: Dict[str, List[data.Transaction]] = defaultdict(list)
+        self._subtree: Dict[str, List[data.Transaction]] = defaultdict(list)
+        for entry in snapshot.entries:
+            if isinstance(entry, data.Transaction):
+                self._add(entry, at_end=True)
+
+    def _add(self, txn: data.Transaction, at_end: bool) -> None:
+        accounts = {p.account for p in txn.postings}
+        parents = set()
+        for acct in accounts:
+            parents.update(account_lib.parents(acct))
+        for index, acct_set in ((self._exact, accounts), (self._subtree, parents)):
+            for acct in acct_set:
+                txns = index[acct]
+                if at_end:
+                    txns.append(txn)
+                else:
+                    pos = bisect.bisect_right(txns, data.entry_sortkey(txn), key=data.entry_sortkey)
+                    txns.insert(pos, txn)
+
+    def extend(self, new_entries: Iterable[data.Directive]) -> "PostingIndex":
+        for entry in new_entries:
+            if isinstance(entry, data.Transaction):
+                self._add(entry, at_end=False)
+        return self
+
+    def last(self, account: str, limit: int = 5, include_subaccounts: bool = False) -> List[data.Transaction]:
+        """
+        The `limit` most recent transactions touching an account, oldest first.
+
+        Args:
+            account (str): Account name.
+            limit (int): Maximum number of transactions to return.
+            include_subaccounts (bool): Also match postings to sub-accounts.
+
+        Returns:
+            List[data.Transaction]: Up to `limit` transactions in date order.
+        """
+        index = self._subtree if include_subaccounts else self._exact
+        txns = index.get(account, [])
+        return txns[-limit:] if limit > 0 else []
+
+    def accounts(self) -> List[str]:
+        return sorted(self._exact)
+
+
+ledger_cache.register_view("postings", PostingIndex, lambda index, snapshot, new: index.extend(new))
+
+
+def get_posting_index(ledger_path: str) -> PostingIndex:
+    return ledger_cache.view(ledger_path, "postings")
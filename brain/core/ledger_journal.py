@@ -0,0 +1,104 @@
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+# A new segment is started once the current one reaches this size
+SEGMENT_BYTES = 1024 * 1024
+
+
+class AppendJournal:
+    """
+    Sequenced record of every block appended to a ledger.
+
+    Each ledger gets a directory of segment files (`<first seq>.jsonl`), one
+    JSON line per append: its sequence number, time, the file it went to
+    (relative to the ledger's directory), the byte offset and length it was
+    written at, its sha256 and the block itself. The backup service ships new
+    records off-site and replays them onto a full backup to restore the
+    ledger as of any point in time; a record whose offset doesn't line up
+    with the previous ones (the ledger was edited by something else) tells it
+    to take a new full backup.
+
+    Records are written under the ledger lock, after the block itself is
+    durable, so sequence numbers follow the ledger's write order across
+    workers.
+
+    Args:
+        directory (str): Where journals are kept, one sub-directory per ledger.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._tail: Optional[Tuple[str, int, int]] = None  # (segment, its size, last seq) as last written
+
+    def path_for(self, ledger_path: str) -> str:
+        name = os.path.splitext(os.path.basename(ledger_path))[0]
+        tag = hashlib.sha1(ledger_path.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, f"{name}-{tag}")
+
+    @staticmethod
+    def segments(directory: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(directory, "*.jsonl")))
+
+    def _last_seq(self, segment: str) -> int:
+        size = os.path.getsize(segment)
+        # Another worker may have appended since; only then re-read the segment
+        if self._tail is not None and self._tail[:2] == (segment, size):
+            return self._tail[2]
+        last = int(os.path.basename(segment)[:-len(".jsonl")]) - 1
+        complete = 0
+        with open(segment, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                last = json.loads(line)["seq"]
+                complete += len(line)
+        if complete != size:
+            # A record torn by a crash; the next one would be appended to it
+            logger.warning(f"Dropping a partial record at the end of {segment}")
+            os.truncate(segment, complete)
+        return last
+
+    def record(self, ledger_path: str, file: str, offset: int, text: str) -> int:
+        """
+        Journal `text`, just appended to `file` at byte `offset`. The caller
+        holds the ledger lock. Returns the record's sequence number.
+        """
+        directory = self.path_for(ledger_path)
+        os.makedirs(directory, exist_ok=True)
+        # Identifies this journal's numbering; a recreated journal starts over at 1
+        id_path = os.path.join(directory, "journal-id")
+        if not os.path.exists(id_path):
+            with open(id_path, "w", encoding="utf-8") as f:
+                f.write(uuid.uuid4().hex)
+
+        segments = self.segments(directory)
+        seq = self._last_seq(segments[-1]) + 1 if segments else 1
+        if not segments or os.path.getsize(segments[-1]) >= SEGMENT_BYTES:
+            segment = os.path.join(directory, f"{seq:012d}.jsonl")
+        else:
+            segment = segments[-1]
+
+        data = text.encode("utf-8")
+        record = {
+            "seq": seq,
+            "ts": time.time(),
+            "file": os.path.relpath(file, os.path.dirname(ledger_path)),
+            "offset": offset,
+            "length": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "data": text,
+        }
+        with open(segment, "ab") as f:
+            f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._tail = (segment, os.path.getsize(segment), seq)
+        return seq
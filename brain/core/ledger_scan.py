@@ -0,0 +1,234 @@
+"""
+Streaming scan of a ledger's account declarations.
+
+Listing accounts (and the `; comment` after their `open`) only needs the
+`open`, `close` and `commodity` lines, not booked entries. The scanner finds
+them with one regex pass over each memory-mapped file, following `include`s
+the way beancount's loader does, and keeps what it found per file identity:
+after an append only the file that changed is scanned again, so listing
+accounts costs a small fraction of a full parse.
+
+Opens synthesized by plugins (e.g. `beancount.plugins.auto_accounts`) are not
+in the text; `LedgerScan.synthesizes_opens` tells callers to use the parsed
+ledger instead.
+"""
+import glob
+import mmap
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date as Date
+from typing import Dict, List, Optional, Tuple
+
+from core.ledger_cache import FileIdentity
+from core.profiling import record_stage
+
+DIRECTIVE_RE = re.compile(
+    rb'^(?:(\d{4}[-/]\d{2}[-/]\d{2})[ \t]+(open|close|commodity)[ \t]+([^\s;]+)([^\n]*)'
+    rb'|(include|plugin)[ \t]+"([^"\n]*)")',
+    re.MULTILINE,
+)
+CURRENCY_RE = re.compile(r"[A-Z][A-Z0-9'._-]*")
+BOOKING_RE = re.compile(r'"([^"]*)"')
+# Plugins that add Open entries the ledger text doesn't contain
+AUTO_OPEN_PLUGINS = frozenset({"beancount.plugins.auto_accounts", "beancount.plugins.auto"})
+
+
+@dataclass(frozen=True)
+class OpenLine:
+    """An `open` directive as written in the ledger."""
+    date: Date
+    account: str
+    currencies: Tuple[str, ...]
+    booking: Optional[str]
+    comment: Optional[str]
+    filename: str
+    lineno: int
+
+
+@dataclass(frozen=True)
+class FileScan:
+    """The declarations of one file, in file order."""
+    opens: Tuple[OpenLine, ...]
+    closes: Tuple[Tuple[str, Date], ...]
+    commodities: Tuple[Tuple[str, Date], ...]
+    includes: Tuple[str, ...]
+    plugins: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class LedgerScan:
+    """The declarations of a ledger and every file it includes."""
+    path: str
+    files: Tuple[str, ...]
+    identities: Tuple[Optional[FileIdentity], ...]
+    opens: Dict[str, OpenLine]
+    closes: Dict[str, Date]
+    commodities: Dict[str, Date]
+    plugins: Tuple[str, ...]
+
+    def is_current(self) -> bool:
+        return tuple(FileIdentity.of(p) for p in self.files) == self.identities
+
+    @property
+    def synthesizes_opens(self) -> bool:
+        return any(p in AUTO_OPEN_PLUGINS for p in self.plugins)
+
+    def comments(self) -> Dict[str, str]:
+        return {acct: o.comment for acct, o in self.opens.items() if o.comment}
+
+
+def _date(text: str) -> Date:
+    return Date(int(text[:4]), int(text[5:7]), int(text[8:10]))
+
+
+def scan_file(path: str) -> FileScan:
+    """Find the declarations in one file with a single pass over its bytes."""
+    opens, closes, commodities, includes, plugins = [], [], [], [], []
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return FileScan((), (), (), (), ())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+            lineno, counted = 1, 0
+            for match in DIRECTIVE_RE.finditer(text):
+                keyword = match.group(2) or match.group(5)
+                if keyword == b"include":
+                    includes.append(match.group(6).decode("utf-8"))
+                    continue
+                if keyword == b"plugin":
+                    plugins.append(match.group(6).decode("utf-8"))
+                    continue
+                day = _date(match.group(1).decode("ascii"))
+                name = match.group(3).decode("utf-8")
+                if keyword == b"close":
+                    closes.append((name, day))
+                elif keyword == b"commodity":
+                    commodities.append((name, day))
+                else:
+                    lineno += text[counted:match.start()].count(b"\n")
+                    counted = match.start()
+                    rest, _, comment = match.group(4).decode("utf-8").partition(";")
+                    spec, _, booking = rest.partition('"')
+                    booking_match = BOOKING_RE.match('"' + booking) if booking else None
+                    opens.append(OpenLine(
+                        date=day,
+                        account=name,
+                        currencies=tuple(CURRENCY_RE.findall(spec)),
+                        booking=booking_match.group(1) if booking_match else None,
+                        comment=comment.strip() or None,
+                        filename=path,
+                        lineno=lineno,
+                    ))
+    return FileScan(tuple(opens), tuple(closes), tuple(commodities), tuple(includes), tuple(plugins))
+
+
+def _expand(including: str, pattern: str) -> List[str]:
+    # Same resolution as beancount's loader: relative to the including file, globbed
+    if not os.path.isabs(pattern):
+        pattern = os.path.join(os.path.dirname(including), pattern)
+    return sorted(os.path.normpath(p) for p in glob.glob(pattern, recursive=True))
+
+
+class DirectiveScanner:
+    """
+    Process-wide cache of ledger scans.
+
+    A ledger's scan is reused while none of its files changed; when one did,
+    only the files whose identity changed are scanned again.
+    """
+
+    def __init__(self):
+        self._files: Dict[str, Tuple[Optional[FileIdentity], FileScan]] = {}
+        self._ledgers: Dict[str, LedgerScan] = {}
+        self._guard = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.files_scanned = 0
+
+    def _file(self, path: str) -> Tuple[Optional[FileIdentity], Optional[FileScan]]:
+        identity = FileIdentity.of(path)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == identity:
+            return cached
+        if identity is None:
+            return None, None
+        # Stat before scanning: a write racing the scan then shows up as a change next time
+        result = (identity, scan_file(path))
+        self._files[path] = result
+        self.files_scanned += 1
+        return result
+
+    def scan(self, ledger_path: str) -> LedgerScan:
+        """
+        Return the declarations of a ledger, scanning only the files that changed.
+
+        Args:
+            ledger_path (str): Path to the top-level Beancount file.
+
+        Returns:
+            LedgerScan: Opens (first declaration wins), closes, commodities and
+            plugins of the ledger and its includes.
+        """
+        path = os.path.abspath(ledger_path)
+        scan = self._ledgers.get(path)
+        if scan is not None and scan.is_current():
+            self.hits += 1
+            return scan
+
+        with self._guard:
+            scan = self._ledgers.get(path)
+            if scan is not None and scan.is_current():
+                self.hits += 1
+                return scan
+            self.misses += 1
+            started = time.perf_counter()
+            files, identities = [], []
+            opens: Dict[str, OpenLine] = {}
+            closes: Dict[str, Date] = {}
+            commodities: Dict[str, Date] = {}
+            plugins: List[str] = []
+            pending = [path]
+            while pending:
+                current = pending.pop(0)
+                if current in files:
+                    continue
+                identity, file_scan = self._file(current)
+                files.append(current)
+                identities.append(identity)
+                if file_scan is None:
+                    continue
+                for line in file_scan.opens:
+                    opens.setdefault(line.account, line)
+                for name, day in file_scan.closes:
+                    closes.setdefault(name, day)
+                for name, day in file_scan.commodities:
+                    commodities.setdefault(name, day)
+                plugins.extend(file_scan.plugins)
+                for pattern in file_scan.includes:
+                    pending.extend(_expand(current, pattern))
+
+            scan = LedgerScan(
+                path=path,
+                files=tuple(files),
+                identities=tuple(identities),
+                opens=opens,
+                closes=closes,
+                commodities=commodities,
+                plugins=tuple(plugins),
+            )
+            self._ledgers[path] = scan
+            record_stage("directive_scan", time.perf_counter() - started)
+            return scan
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "files_scanned": self.files_scanned}
+
+
+# Shared by every account-listing caller in the process
+directive_scanner = DirectiveScanner()
+
+
+def scan_directives(ledger_path: str) -> LedgerScan:
+    return directive_scanner.scan(ledger_path)
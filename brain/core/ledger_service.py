@@ -0,0 +1,105 @@
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+
+import conf
+from core.beancount_service import BatchValidationError, build_transaction, get_ledger_cache_stats
+from core.idempotency import IdempotencyService
+from core.ledger_analytics import monthly_spend, rolling_average, top_payees
+from core.ledger_balances import get_account_balance, get_balances
+from core.ledger_worker import get_ledger_worker
+from core.ledger_writer import get_ledger_writer
+from domain.models.dtos import (
+    AccountBalanceOut,
+    BalancesOut,
+    BatchAppendIn,
+    BatchAppendOut,
+    MonthlySpendOut,
+    RollingAverageOut,
+    TopPayeesOut,
+)
+
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+
+class LedgerService:
+    def __init__(self, ledger_path: str = conf.BEANCOUNT_FILE):
+        self.ledger_path = ledger_path
+
+    def append_batch(self, body: BatchAppendIn, idempotency_key: Optional[str] = None) -> BatchAppendOut:
+        idempotency = IdempotencyService(self.ledger_path) if idempotency_key else None
+        if idempotency is not None:
+            replay = idempotency.claim(idempotency_key, "ledger.batch", body.model_dump(mode="json"))
+            if replay is not None:
+                return BatchAppendOut(**replay)
+
+        txns = [
+            build_transaction(
+                t.date,
+                [(p.account, p.amount, p.currency) for p in t.postings],
+                narration=t.narration,
+                payee=t.payee,
+                flag=t.flag,
+                tags=set(t.tags),
+                links=set(t.links),
+            )
+            for t in body.transactions
+        ]
+        try:
+            if idempotency is not None:
+                # Which accounts the write opens is only known once it is done
+                idempotency.expect(idempotency_key, txns, {"appended": len(txns), "opened_accounts": None})
+            result = get_ledger_writer(self.ledger_path).submit(
+                txns, auto_open_accounts=body.auto_open_accounts
+            ).result()
+        except Exception as e:
+            # Nothing was written; a retry with the same key runs again
+            if idempotency is not None:
+                idempotency.release(idempotency_key)
+            if isinstance(e, BatchValidationError):
+                raise HTTPException(400, {
+                    "message": str(e),
+                    "errors": [{"index": i, "errors": errs} for i, errs in sorted(e.item_errors.items())],
+                    "general_errors": e.general_errors,
+                })
+            raise
+        if idempotency is not None:
+            idempotency.complete(idempotency_key, result)
+        return BatchAppendOut(**result)
+
+    def balances(self, as_of: Optional[date] = None, include_subaccounts: bool = False) -> BalancesOut:
+        return BalancesOut(**get_balances(self.ledger_path, as_of, include_subaccounts))
+
+    def account_balance(self, account: str, as_of: Optional[date] = None, include_subaccounts: bool = False,
+                        interval: Optional[str] = None, start: Optional[date] = None,
+                        end: Optional[date] = None) -> AccountBalanceOut:
+        result = get_account_balance(self.ledger_path, account, as_of, include_subaccounts, interval, start, end)
+        if result is None:
+            raise HTTPException(404, f"No postings to {account}")
+        return AccountBalanceOut(**result)
+
+    def monthly_spend(self, account: str, currency: str, depth: int = 1,
+                      start: Optional[date] = None, end: Optional[date] = None) -> MonthlySpendOut:
+        result = monthly_spend(self.ledger_path, account, currency, depth, start, end)
+        return MonthlySpendOut(account=account, currency=currency, **result)
+
+    def top_payees(self, account: str, currency: str, limit: int = 10,
+                   start: Optional[date] = None, end: Optional[date] = None) -> TopPayeesOut:
+        payees = top_payees(self.ledger_path, account, currency, limit, start, end)
+        return TopPayeesOut(account=account, currency=currency, payees=payees)
+
+    def rolling_average(self, account: str, currency: str, window: int = 3, interval: str = "month",
+                        start: Optional[date] = None, end: Optional[date] = None) -> RollingAverageOut:
+        result = rolling_average(self.ledger_path, account, currency, window, interval, start, end)
+        return RollingAverageOut(account=account, currency=currency, window=window, **result)
+
+    def stats(self) -> dict:
+        stats = {
+            "cache": get_ledger_cache_stats(),
+            "writer": get_ledger_writer(self.ledger_path).stats(),
+        }
+        if conf.LEDGER_WORKER_PROCESS:
+            stats["worker"] = get_ledger_worker().stats()
+        return stats
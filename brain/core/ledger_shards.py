@@ -0,0 +1,439 @@
+"""
+Year-sharded ledgers.
+
+A sharded ledger is a root file (options, plugins, account declarations) that
+includes one file per year, named `YYYY.beancount`:
+
+    option "operating_currency" "USD"
+    2015-01-01 open Assets:Cash
+    include "budget/2024.beancount"
+    include "budget/2025.beancount"
+
+The latest shard is the active one: appends go there, and it is the only
+shard expected to change. Closed shards are parsed and booked once and the
+result is kept until one of them (or the root) changes, so re-loading the
+ledger after a write costs about as much as the current year, not all of
+history. Plugins and validation still run over the whole ledger.
+
+Run `python -m core.ledger_shards migrate <ledger>` to split an existing
+single-file ledger into this layout.
+"""
+import copy
+import fcntl  # Unix only
+import glob
+import os
+import re
+import shutil
+import sys
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import date as Date
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from beancount import loader
+from beancount.core import compare, data
+from beancount.ops import validation
+from beancount.parser import booking, booking_full, parser
+
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+SHARD_NAME_RE = re.compile(r"^(\d{4})\.beancount$")
+# Directives that configure the whole ledger and stay in the root file
+ROOT_DIRECTIVE_RE = re.compile(r"^(option|plugin|include)\b")
+# Directives whose effect depends on their position in the file
+STATEFUL_DIRECTIVE_RE = re.compile(r"^(pushtag|poptag|pushmeta|popmeta)\b")
+INCLUDE_RE = re.compile(rb'^include[ \t]+"([^"\n]*)"', re.MULTILINE)
+ROOT_ENTRY_TYPES = (data.Open, data.Close, data.Commodity)
+
+
+def shard_year(path: str) -> Optional[int]:
+    match = SHARD_NAME_RE.match(os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+
+def _stat_key(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _expand_includes(root: str, patterns: List[str]) -> Tuple[List[str], List[data.BeancountError]]:
+    # Same resolution as beancount's loader: relative to the including file, globbed
+    cwd = os.path.dirname(root)
+    paths, errors = [], []
+    for pattern in patterns:
+        matched = glob.glob(pattern if os.path.isabs(pattern) else os.path.join(cwd, pattern), recursive=True)
+        if not matched:
+            errors.append(loader.LoadError(data.new_metadata("<load>", 0), f'File glob "{pattern}" does not match any files'))
+        paths.extend(os.path.normpath(p) for p in matched)
+    return list(dict.fromkeys(paths)), errors
+
+
+def _includes_shards(root: str) -> bool:
+    """Whether a file includes year shards, from a scan of its `include` lines (no parse)."""
+    with open(root, "rb") as f:
+        patterns = [m.decode("utf-8") for m in INCLUDE_RE.findall(f.read())]
+    includes, _ = _expand_includes(root, patterns)
+    return any(shard_year(p) is not None for p in includes)
+
+
+def _booking_methods(entries: List[data.Directive]) -> Dict[str, data.Booking]:
+    return {e.account: e.booking for e in entries if isinstance(e, data.Open) and e.booking}
+
+
+def _last_transaction_date(entries: List[data.Directive]) -> Optional[Date]:
+    for entry in reversed(entries):
+        if isinstance(entry, data.Transaction):
+            return entry.date
+    return None
+
+
+class ShardedLoad(NamedTuple):
+    entries: List[data.Directive]
+    errors: List[data.BeancountError]
+    options_map: Dict[str, Any]
+    files: Tuple[str, ...]
+    active: str
+
+
+@dataclass
+class _ClosedShards:
+    """Parsed (and, once booked, booked) closed shards of one ledger."""
+    key: Tuple
+    entries: List[data.Directive]
+    errors: List[data.BeancountError]
+    option_maps: List[Dict[str, Any]]
+    # Booking methods declared by the closed shards, and the ones they were booked with
+    declared: Dict[str, data.Booking] = field(default_factory=dict)
+    methods: Optional[Dict[str, data.Booking]] = None
+    booked: Optional[List[data.Directive]] = None
+    booking_errors: List[data.BeancountError] = field(default_factory=list)
+    balances: Optional[Dict[str, Any]] = None
+    last_date: Optional[Date] = None
+
+
+class ShardedLoader:
+    """
+    Loads sharded ledgers, reusing the closed shards from the previous load.
+
+    Produces the same entries, errors and options as beancount's loader
+    (parse, booking, plugins, validation), except that closed shards are only
+    parsed and booked again when one of them or the root file changes. The
+    active shard is booked on top of the closed shards' final balances, which
+    holds as long as none of its transactions predates the last closed one;
+    otherwise everything is booked together.
+    """
+
+    def __init__(self):
+        self._closed: Dict[str, _ClosedShards] = {}
+        self._patterns: Dict[str, List[str]] = {}
+        self._guard = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, root: str, appended: Optional[Tuple[str, int]] = None) -> Optional[ShardedLoad]:
+        """
+        Load a ledger if it is sharded.
+
+        Args:
+            root (str): Absolute path of the top-level file.
+            appended (Optional[Tuple[str, int]]): Text to load as if it were
+                appended to the active shard, with the line it would start at
+                (used to validate an append against the whole ledger).
+
+        Returns:
+            Optional[ShardedLoad]: None if the ledger isn't sharded (or uses
+            features this loader doesn't handle), so the caller loads it with
+            beancount's loader instead.
+        """
+        root_key = _stat_key(root)
+        # Most ledgers aren't sharded: tell without parsing the whole file twice
+        if root_key is None or not _includes_shards(root):
+            return None
+        root_entries, errors, root_options = parser.parse_file(root)
+        includes, include_errors = _expand_includes(root, root_options["include"])
+        shards = sorted((shard_year(p), p) for p in includes if shard_year(p) is not None)
+        if not shards:
+            return None
+        errors.extend(include_errors)
+        self._patterns[root] = list(root_options["include"])
+
+        active = shards[-1][1]
+        closed_paths = [p for _, p in shards[:-1]]
+        closed = self._closed_shards(root, root_key, closed_paths)
+        if closed is None:
+            return None
+
+        # Everything but the closed shards is parsed on every load
+        entries = list(root_entries)
+        option_maps = []
+        for path in includes:
+            if path in closed_paths:
+                continue
+            src_entries, src_errors, src_options = parser.parse_file(path)
+            if src_options["include"]:
+                return None
+            entries.extend(src_entries)
+            errors.extend(src_errors)
+            option_maps.append(src_options)
+        if appended is not None:
+            text, first_line = appended
+            src_entries, src_errors, _ = parser.parse_string(text, report_filename=active, report_firstline=first_line)
+            entries.extend(src_entries)
+            errors.extend(src_errors)
+        entries.sort(key=data.entry_sortkey)
+
+        options_map = loader.aggregate_options_map(root_options, closed.option_maps + option_maps)
+        options_map["include"] = sorted([root] + includes)
+        errors = closed.errors + errors
+
+        methods = defaultdict(lambda: options_map["booking_method"])
+        methods.update(closed.declared)
+        methods.update(_booking_methods(entries))
+        first_date = next((e.date for e in entries if isinstance(e, data.Transaction)), None)
+        with self._guard:
+            if closed.booked is None or closed.methods != dict(methods):
+                self._book_closed(closed, options_map, methods)
+            else:
+                self.hits += 1
+            reusable = closed.last_date is None or first_date is None or first_date > closed.last_date
+            balances = copy.deepcopy(closed.balances) if reusable else None
+
+        if reusable:
+            booked, booking_errors = booking_full.book(entries, options_map, methods, balances)
+            booking_errors = closed.booking_errors + booking_errors
+            entries = closed.booked + booked
+            # Both halves are sorted; timsort merges them in one pass
+            entries.sort(key=data.entry_sortkey)
+        else:
+            logger.info(f"Active shard of {root} has entries before its closed shards end; booking all of them")
+            entries = closed.entries + entries
+            entries.sort(key=data.entry_sortkey)
+            entries, booking_errors = booking_full.book(entries, options_map, methods)
+        errors.extend(booking_errors)
+        errors.extend(booking.validate_missing_eliminated(entries, options_map))
+
+        entries, errors = self._transform_and_validate(entries, errors, options_map)
+        files = (root,) + tuple(p for p in options_map["include"] if p != root)
+        return ShardedLoad(entries, errors, options_map, files, active)
+
+    def _closed_shards(self, root: str, root_key: Tuple, paths: List[str]) -> Optional[_ClosedShards]:
+        # The root holds the options booking depends on, so it is part of the key
+        key = (root_key,) + tuple((p, _stat_key(p)) for p in paths)
+        with self._guard:
+            closed = self._closed.get(root)
+            if closed is not None and closed.key == key:
+                return closed
+
+        self.misses += 1
+        entries, errors, option_maps = [], [], []
+        for path in paths:
+            src_entries, src_errors, src_options = parser.parse_file(path)
+            if src_options["include"]:
+                return None
+            entries.extend(src_entries)
+            errors.extend(src_errors)
+            option_maps.append(src_options)
+        entries.sort(key=data.entry_sortkey)
+        closed = _ClosedShards(key=key, entries=entries, errors=errors, option_maps=option_maps,
+                               declared=_booking_methods(entries))
+        with self._guard:
+            previous = self._closed.get(root)
+            if previous is not None and [p for p, _ in previous.key[1:]] == paths:
+                logger.warning(f"Closed shards of {root} were modified; re-parsing them")
+            self._closed[root] = closed
+        logger.info(f"Parsed {len(paths)} closed shard(s) of {root} ({len(entries)} entries)")
+        return closed
+
+    @staticmethod
+    def _book_closed(closed: _ClosedShards, options_map: Dict[str, Any], methods: Dict[str, data.Booking]) -> None:
+        # Private beancount API: the public one doesn't return the final balances
+        closed.booked, closed.booking_errors, closed.balances = booking_full._book(closed.entries, options_map, methods)
+        closed.methods = dict(methods)
+        closed.last_date = _last_transaction_date(closed.booked)
+
+    @staticmethod
+    def _transform_and_validate(entries, errors, options_map):
+        # The rest of beancount's loader._load
+        saved_pythonpath = list(sys.path)
+        try:
+            if "pythonpath" in options_map:
+                sys.path[0:0] = options_map["pythonpath"]
+            entries, errors = loader.run_transformations(entries, errors, options_map, None)
+        finally:
+            sys.path[:] = saved_pythonpath
+        errors.extend(validation.validate(entries, options_map, None, None))
+        options_map["input_hash"] = loader.compute_input_hash(options_map["include"])
+        return entries, errors
+
+    def start_shard(self, root: str, active: str, year: int) -> Optional[str]:
+        """
+        Create the shard for `year` next to the active one and include it from
+        the root, if the ledger's latest shard is older. Returns the new path.
+        """
+        active_year = shard_year(active)
+        if active_year is None or active_year >= year:
+            return None
+        path = os.path.join(os.path.dirname(active), f"{year}.beancount")
+        if not os.path.exists(path):
+            with open(path, "a", encoding="utf-8"):
+                pass
+        included, _ = _expand_includes(root, self._patterns.get(root, []))
+        if path not in included:
+            prefix = ""
+            with open(root, "rb") as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    prefix = "" if f.read(1) == b"\n" else "\n"
+            relative = os.path.relpath(path, os.path.dirname(root))
+            with open(root, "a", encoding="utf-8") as f:
+                f.write(prefix + f'include "{relative}"\n')
+                f.flush()
+                os.fsync(f.fileno())
+        logger.info(f"Started shard {path} for {year}")
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        return {"closed_hits": self.hits, "closed_misses": self.misses}
+
+
+# Shared by the ledger cache and full validation
+shard_loader = ShardedLoader()
+
+
+def _rewrite(ledger, text: bytes) -> None:
+    """Replace the content of an open, locked file in place."""
+    ledger.seek(0)
+    ledger.truncate()
+    ledger.write(text)
+    ledger.flush()
+    os.fsync(ledger.fileno())
+
+
+def _migrate_locked(ledger, root: str, shard_dir: str, backup: str) -> Dict[int, str]:
+    original = ledger.read()
+    entries, errors, options_map = parser.parse_file(root)
+    includes, _ = _expand_includes(root, options_map["include"])
+    if any(shard_year(p) is not None for p in includes):
+        raise ValueError(f"{root} is already sharded")
+    lines = original.decode("utf-8").splitlines(keepends=True)
+
+    # Each entry owns its lines up to the next entry (trailing comments included)
+    entries = sorted((e for e in entries if e.meta.get("filename") == root), key=lambda e: e.meta["lineno"])
+    starts = [e.meta["lineno"] - 1 for e in entries] + [len(lines)]
+    header = lines[:starts[0]] if entries else list(lines)
+    declarations: List[str] = []
+    shards: Dict[int, List[str]] = defaultdict(list)
+    for entry, start, end in zip(entries, starts, starts[1:]):
+        chunk = []
+        for line in lines[start:end]:
+            if STATEFUL_DIRECTIVE_RE.match(line):
+                raise ValueError(f"{root} uses {line.split()[0]}, which can't be split across files")
+            (header if ROOT_DIRECTIVE_RE.match(line) else chunk).append(line)
+        if chunk and not chunk[-1].endswith("\n"):
+            chunk[-1] += "\n"
+        (declarations if isinstance(entry, ROOT_ENTRY_TYPES) else shards[entry.date.year]).extend(chunk)
+    if not shards:
+        raise ValueError(f"{root} has no dated entries to shard")
+
+    os.makedirs(shard_dir, exist_ok=True)
+    written = {}
+    for year in sorted(shards):
+        path = os.path.join(shard_dir, f"{year}.beancount")
+        if os.path.exists(path):
+            raise ValueError(f"{path} already exists")
+        written[year] = path
+    # The current year always gets a shard, so appends have somewhere to go
+    written.setdefault(Date.today().year, os.path.join(shard_dir, f"{Date.today().year}.beancount"))
+
+    shutil.copy2(root, backup)
+    try:
+        for year, path in written.items():
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(shards.get(year, []))
+        if header and not header[-1].endswith("\n"):
+            header[-1] += "\n"
+        includes_block = "".join(f'include "{os.path.relpath(p, os.path.dirname(root))}"\n' for _, p in sorted(written.items()))
+        text = "".join(header) + ("\n" + "".join(declarations) if declarations else "") + "\n" + includes_block
+        _rewrite(ledger, text.encode("utf-8"))
+
+        before, before_errors, _ = loader.load_file(backup)
+        after, after_errors, _ = loader.load_file(root)
+        # Not compare.compare_entries: it rejects ledgers with duplicate entries
+        before_hashes = Counter(compare.hash_entry(e, exclude_meta=True) for e in before)
+        after_hashes = Counter(compare.hash_entry(e, exclude_meta=True) for e in after)
+        if before_hashes != after_hashes or len(before_errors) != len(after_errors):
+            raise ValueError(
+                f"Sharded ledger doesn't load like the original ({sum((before_hashes - after_hashes).values())} "
+                f"entries missing, {sum((after_hashes - before_hashes).values())} extra, "
+                f"{len(before_errors)} -> {len(after_errors)} errors)"
+            )
+    except BaseException:
+        for path in written.values():
+            if os.path.exists(path):
+                os.unlink(path)
+        _rewrite(ledger, original)
+        os.unlink(backup)
+        raise
+    return written
+
+
+def migrate(ledger_path: str, shard_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Split a single-file ledger into a root file and one shard per year.
+
+    Options, plugins, includes and account/commodity declarations stay in the
+    root file; every other entry moves, text unchanged (comments included), to
+    the shard of its year. The original is kept next to the ledger as
+    `<name>.pre-shard`, and the new layout is checked to load to the same
+    entries before the command returns; if it doesn't, the original is put back.
+
+    Args:
+        ledger_path (str): The ledger to split.
+        shard_dir (Optional[str]): Where to put the shards; defaults to a
+            directory named after the ledger, next to it.
+
+    Returns:
+        Dict[str, Any]: The shards written (year -> path) and the backup path.
+    """
+    root = os.path.abspath(ledger_path)
+    shard_dir = os.path.abspath(shard_dir or os.path.splitext(root)[0])
+    backup = root + ".pre-shard"
+    if os.path.exists(backup):
+        raise ValueError(f"{backup} already exists; was the ledger already migrated?")
+
+    # The root is rewritten in place, never renamed: in Docker it is a
+    # bind-mounted file. Appends take the same lock (core.beancount_service).
+    with open(root, "r+b") as ledger:
+        fcntl.flock(ledger, fcntl.LOCK_EX)
+        try:
+            written = _migrate_locked(ledger, root, shard_dir, backup)
+        finally:
+            fcntl.flock(ledger, fcntl.LOCK_UN)
+
+    # beancount's load cache of the backup is of no further use
+    backup_cache = loader.get_cache_filename(loader.PICKLE_CACHE_FILENAME, backup)
+    if os.path.exists(backup_cache):
+        os.unlink(backup_cache)
+    logger.info(f"Split {root} into {len(written)} shard(s) in {shard_dir}; original kept as {backup}")
+    return {"shards": {year: written[year] for year in sorted(written)}, "backup": backup}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import conf
+
+    parser_ = argparse.ArgumentParser(description="Year-sharded ledger tools")
+    commands = parser_.add_subparsers(dest="command", required=True)
+    migrate_cmd = commands.add_parser("migrate", help="Split a single-file ledger into one file per year")
+    migrate_cmd.add_argument("ledger", nargs="?", default=conf.BEANCOUNT_FILE)
+    migrate_cmd.add_argument("--shard-dir", help="Directory for the shards (default: next to the ledger, named after it)")
+    args = parser_.parse_args()
+
+    print(json.dumps(migrate(args.ledger, args.shard_dir), indent=2))
@@ -0,0 +1,201 @@
+import gc
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Any, Dict, Optional
+
+import beancount
+
+from core.ledger_cache import FileIdentity, LedgerCache, LedgerSnapshot
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+# Bump when the layout of the stored snapshot changes
+FORMAT_VERSION = 2
+
+
+@contextmanager
+def _gc_paused():
+    # Pickling tens of thousands of small objects triggers GC passes that cost
+    # more than the (un)pickling itself
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _prefix_hasher(path: str, size: int):
+    """Running sha256 of the first `size` bytes of a file."""
+    h = hashlib.sha256()
+    remaining = size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h
+
+
+def _same_file(stored: Optional[FileIdentity], current: Optional[FileIdentity]) -> bool:
+    # Ignore device/inode: a copied or restored ledger is still the same content
+    if stored is None or current is None:
+        return stored is current
+    return (stored.size, stored.mtime_ns) == (current.size, current.mtime_ns)
+
+
+class SnapshotStore:
+    """
+    Parsed ledgers (and their views) persisted between runs.
+
+    Each ledger gets one pickle file holding a small header followed by the
+    snapshot and every view built at that version. On a cold start the cache
+    restores from it instead of parsing: the stored part of the ledger is
+    checked against its digest, and only what was appended since (by us or
+    anyone else) is parsed and applied incrementally. Anything that doesn't
+    check out (a rewritten ledger, changed includes, a different beancount or
+    view code) simply falls back to a full parse.
+
+    Args:
+        directory (str): Where snapshot files are kept.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.restores = 0
+        self.rejected = 0
+        self._keys: Dict[tuple, str] = {}
+
+    def path_for(self, ledger_path: str) -> str:
+        name = os.path.splitext(os.path.basename(ledger_path))[0]
+        tag = hashlib.sha1(ledger_path.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, f"{name}-{tag}.pickle")
+
+    def key(self, cache: LedgerCache) -> str:
+        """What a stored snapshot must have been written by to be usable."""
+        views = cache.registered_views()
+        names = tuple(sorted(views))
+        if names not in self._keys:
+            h = hashlib.sha256()
+            h.update(f"{FORMAT_VERSION}:{beancount.__version__}:{sys.version_info[:2]}:{names}".encode())
+            modules = {sys.modules[LedgerCache.__module__]}
+            modules.update(sys.modules[build.__module__] for build in views.values())
+            # Views are pickled as-is, so any change to their code invalidates them
+            for module in sorted(modules, key=lambda m: m.__name__):
+                with open(inspect.getsourcefile(module), "rb") as f:
+                    h.update(f.read())
+            self._keys[names] = h.hexdigest()
+        return self._keys[names]
+
+    def save(self, cache: LedgerCache, snapshot: LedgerSnapshot, views: Dict[str, Any]) -> None:
+        target = self.path_for(snapshot.path)
+        os.makedirs(self.directory, exist_ok=True)
+        header = {
+            "key": self.key(cache),
+            "digest": snapshot.digest,
+            "target": snapshot.target,
+            "size": snapshot.identities[snapshot.target_index].size if snapshot.identities[snapshot.target_index] else 0,
+            "views": sorted(views),
+        }
+        started = time.perf_counter()
+        fd, tmp = tempfile.mkstemp(prefix=".snapshot-", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f, _gc_paused():
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump((snapshot, views), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        logger.info(f"Saved snapshot of {snapshot.path} (v{snapshot.version}, {len(views)} view(s)) "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def restore(self, cache: LedgerCache, path: str) -> Optional[LedgerSnapshot]:
+        """
+        Install the stored snapshot of `path` into `cache`, brought up to date
+        with the ledger on disk. Called by the cache (holding the ledger's lock)
+        on a miss; returns None if the ledger has to be parsed instead.
+        """
+        source = self.path_for(path)
+        try:
+            restored = self._restore(cache, path, source)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception(f"Failed to restore the snapshot {source}")
+            restored = None
+        if restored is None:
+            self.rejected += 1
+            cache.invalidate(path)
+        else:
+            self.restores += 1
+        return restored
+
+    def _restore(self, cache: LedgerCache, path: str, source: str) -> Optional[LedgerSnapshot]:
+        started = time.perf_counter()
+        with open(source, "rb") as f:
+            header = pickle.load(f)
+            if header.get("key") != self.key(cache):
+                logger.info(f"Snapshot {source} was written by other code; ignoring it")
+                return None
+            target = FileIdentity.of(header["target"])
+            if target is None or target.size < header["size"]:
+                logger.info(f"Ledger {path} shrank since its snapshot; ignoring it")
+                return None
+            hasher = _prefix_hasher(header["target"], header["size"])
+            if hasher.hexdigest() != header["digest"]:
+                logger.info(f"Ledger {path} was rewritten since its snapshot; ignoring it")
+                return None
+            with _gc_paused():
+                snapshot, views = pickle.load(f)
+
+        index = snapshot.target_index
+        if snapshot.path != path or not all(
+            _same_file(stored, FileIdentity.of(p))
+            for i, (p, stored) in enumerate(zip(snapshot.files, snapshot.identities)) if i != index
+        ):
+            logger.info(f"Files included by {path} changed since its snapshot; ignoring it")
+            return None
+
+        tail_size = target.size - header["size"]
+        if tail_size == 0:
+            snapshot = replace(snapshot, identities=snapshot.identities[:index] + (target,) + snapshot.identities[index + 1:])
+            cache.adopt(snapshot, views, hasher)
+        else:
+            if not snapshot.ends_with_newline:
+                return None
+            # Adopt the stored prefix, then apply what was appended since like any append
+            cache.adopt(snapshot, views, hasher)
+            snapshot = self._apply_tail(cache, snapshot, header["size"])
+            if snapshot is None:
+                return None
+
+        logger.info(f"Restored {path} from its snapshot (v{snapshot.version}, {len(snapshot.entries)} entries, "
+                    f"{tail_size} new byte(s)) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return snapshot
+
+    def _apply_tail(self, cache: LedgerCache, snapshot: LedgerSnapshot, offset: int) -> Optional[LedgerSnapshot]:
+        from core.ledger_validation import validate_block
+
+        with open(snapshot.target, "rb") as f:
+            f.seek(offset)
+            raw = f.read()
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        booked, errors = validate_block(snapshot, text, "incremental")
+        if booked is None or errors:
+            logger.info(f"Text appended to {snapshot.target} since its snapshot needs a full parse")
+            return None
+        return cache.extend(snapshot, booked, text)
@@ -0,0 +1,233 @@
+import collections
+from typing import Dict, List, Optional, Set, Tuple
+
+from beancount import loader
+from beancount.core import data, getters, inventory
+from beancount.core.number import MISSING
+from beancount.ops import validation
+from beancount.parser import booking, booking_full, parser
+
+from core.ledger_cache import LedgerSnapshot, ledger_cache
+from core.ledger_shards import shard_loader
+from core.log.logging_service import get_logger
+logger = get_logger(__name__)
+
+# Directives we can check against the in-memory state alone. Anything else
+# (balance assertions, pads, documents, custom directives) needs running
+# balances or plugins over the whole history, so it takes the full path.
+INCREMENTAL_TYPES = (data.Open, data.Close, data.Commodity, data.Transaction, data.Note, data.Event, data.Price)
+
+INCREMENTAL_VALIDATIONS = [
+    validation.validate_open_close,
+    validation.validate_active_accounts,
+    validation.validate_currency_constraints,
+    validation.validate_duplicate_commodities,
+    validation.validate_check_transaction_balances,
+]
+
+
+class LedgerState:
+    """
+    Validated state of a ledger: everything needed to check new entries
+    without re-parsing it (open/close directives, commodities, booking methods
+    and, lazily, per-account inventories for booking).
+    """
+
+    def __init__(self, snapshot: LedgerSnapshot):
+        self.snapshot = snapshot
+        self.opens: Dict[str, data.Open] = {}
+        self.closes: Dict[str, data.Close] = {}
+        self.commodities: Dict[str, data.Commodity] = {}
+        self.last_date = None
+        self._inventories: Dict[str, inventory.Inventory] = {}
+        self._absorb(snapshot.entries)
+
+    def _absorb(self, entries) -> None:
+        for entry in entries:
+            if isinstance(entry, data.Open):
+                self.opens.setdefault(entry.account, entry)
+            elif isinstance(entry, data.Close):
+                self.closes.setdefault(entry.account, entry)
+            elif isinstance(entry, data.Commodity):
+                self.commodities.setdefault(entry.currency, entry)
+            elif isinstance(entry, data.Transaction):
+                for posting in entry.postings:
+                    inv = self._inventories.get(posting.account)
+                    if inv is not None:
+                        inv.add_position(posting)
+            if self.last_date is None or entry.date > self.last_date:
+                self.last_date = entry.date
+
+    def extend(self, snapshot: LedgerSnapshot, new_entries: List[data.Directive]) -> "LedgerState":
+        self.snapshot = snapshot
+        self._absorb(new_entries)
+        return self
+
+    @property
+    def options_map(self):
+        return self.snapshot.options_map
+
+    @property
+    def has_plugins(self) -> bool:
+        return bool(self.options_map.get("plugin"))
+
+    def booking_methods(self) -> Dict[str, data.Booking]:
+        default = self.options_map["booking_method"]
+        methods = collections.defaultdict(lambda: default)
+        for account, entry in self.opens.items():
+            if entry.booking:
+                methods[account] = entry.booking
+        return methods
+
+    def inventory_of(self, account: str) -> inventory.Inventory:
+        """Running balance of an account, realized on first use and kept current."""
+        inv = self._inventories.get(account)
+        if inv is None:
+            inv = inventory.Inventory()
+            for entry in self.snapshot.entries:
+                if isinstance(entry, data.Transaction):
+                    for posting in entry.postings:
+                        if posting.account == account:
+                            inv.add_position(posting)
+            self._inventories[account] = inv
+        return inv
+
+    def context_for(self, entries: List[data.Directive]) -> List[data.Directive]:
+        """Existing directives the checks need to see alongside `entries`."""
+        accounts: Set[str] = set()
+        currencies: Set[str] = set()
+        for entry in entries:
+            accounts.update(getters.get_entry_accounts(entry))
+            if isinstance(entry, data.Commodity):
+                currencies.add(entry.currency)
+        context = [self.opens[a] for a in accounts if a in self.opens]
+        context += [self.closes[a] for a in accounts if a in self.closes]
+        context += [self.commodities[c] for c in currencies if c in self.commodities]
+        return context
+
+
+def _needs_balances(entry: data.Directive) -> bool:
+    """Postings at cost or with elided units are booked against running balances."""
+    return isinstance(entry, data.Transaction) and any(
+        p.cost is not None or p.units is MISSING or p.units is None for p in entry.postings
+    )
+
+
+def _has_cost(entry: data.Directive) -> bool:
+    return isinstance(entry, data.Transaction) and any(p.cost is not None for p in entry.postings)
+
+
+def supports_incremental(state: LedgerState, entries: List[data.Directive]) -> bool:
+    """Whether `entries` can be validated against `state` without a full re-parse."""
+    if state.has_plugins:
+        return False
+    for entry in entries:
+        if not isinstance(entry, INCREMENTAL_TYPES):
+            return False
+        # Lot matching on back-dated entries depends on everything after them
+        if _has_cost(entry) and state.last_date is not None and entry.date < state.last_date:
+            return False
+    return True
+
+
+def validate_incremental(state: LedgerState, entries: List[data.Directive]) -> Tuple[List[data.Directive], List]:
+    """
+    Book and validate freshly parsed entries against the ledger state.
+
+    Runs Beancount's own booking and validation routines, but only over the new
+    entries plus the handful of existing directives they reference.
+
+    Args:
+        state (LedgerState): Validated state of the ledger being appended to.
+        entries (List[data.Directive]): Entries parsed from the block to append.
+
+    Returns:
+        Tuple[List[data.Directive], List]: Booked entries and the errors they raise.
+    """
+    balances = collections.defaultdict(inventory.Inventory)
+    for entry in entries:
+        if _needs_balances(entry):
+            for posting in entry.postings:
+                balances[posting.account] = inventory.Inventory(state.inventory_of(posting.account))
+
+    booked, errors = booking_full.book(entries, state.options_map, state.booking_methods(), balances)
+    errors.extend(booking.validate_missing_eliminated(booked, state.options_map))
+
+    # Re-opening an existing account is reported here: if the new open were
+    # dated earlier, the generic check would blame the existing directive.
+    checked = []
+    for entry in booked:
+        if isinstance(entry, data.Open) and entry.account in state.opens:
+            errors.append(validation.ValidationError(
+                entry.meta, "Duplicate open directive for {}".format(entry.account), entry))
+        else:
+            checked.append(entry)
+
+    new_ids = {id(e) for e in checked}
+    candidate = sorted(state.context_for(checked) + checked, key=data.entry_sortkey)
+    for check in INCREMENTAL_VALIDATIONS:
+        errors.extend(
+            e for e in check(candidate, state.options_map)
+            if e.entry is None or id(e.entry) in new_ids
+        )
+    return booked, errors
+
+
+def validate_full(snapshot: LedgerSnapshot, text: str) -> List:
+    """
+    Validate `text` by re-loading the whole ledger with it appended.
+
+    Only errors raised from the appended lines are reported, so problems that
+    already exist in the ledger don't block new entries.
+    """
+    first_line = snapshot.line_count + 1
+    if snapshot.target != snapshot.path:
+        # Sharded: the closed shards are reused, only the rest is re-loaded
+        loaded = shard_loader.load(snapshot.path, appended=(text, first_line))
+        if loaded is not None:
+            return [
+                e for e in loaded.errors
+                if not e.source or e.source.get("lineno") is None
+                or (e.source.get("filename") == snapshot.target and e.source["lineno"] >= first_line)
+            ]
+
+    with open(snapshot.path, encoding="utf-8") as f:
+        original_text = f.read()
+    _, errors, _ = loader.load_string(original_text + text)
+    return [
+        e for e in errors
+        if not e.source or e.source.get("lineno") is None or e.source["lineno"] >= first_line
+    ]
+
+
+def validate_block(snapshot: LedgerSnapshot, text: str, mode: str = "incremental") -> Tuple[Optional[List[data.Directive]], List]:
+    """
+    Validate a block of Beancount text about to be appended to a ledger.
+
+    Args:
+        snapshot (LedgerSnapshot): Current snapshot of the ledger.
+        text (str): The exact text that will be appended.
+        mode (str): "incremental" to check against the in-memory state,
+            "full" to re-load the whole candidate ledger.
+
+    Returns:
+        Tuple[Optional[List[data.Directive]], List]: The booked entries (None when
+        validated in full mode, since they can't be merged into the snapshot)
+        and the list of errors.
+    """
+    entries, errors, _ = parser.parse_string(
+        text, report_filename=snapshot.target, report_firstline=snapshot.line_count + 1
+    )
+    if errors:
+        return None, errors
+
+    if mode == "incremental":
+        state = ledger_cache.view_of(snapshot, "validation")
+        if supports_incremental(state, entries):
+            return validate_incremental(state, entries)
+        logger.info("Entries need a full validation pass")
+
+    return None, validate_full(snapshot, text)
+
+
+ledger_cache.register_view("validation", LedgerState, lambda state, snapshot, new: state.extend(snapshot, new))
@@ -0,0 +1,177 @@
+import functools
+import importlib
+import multiprocessing
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import conf
+from core.profiling import add_count_observer, add_stage_observer, caller, record_count, record_stage
+from core.log.logging_service import current_log_context, get_logger, log_context
+logger = get_logger(__name__)
+
+# Modules whose @offloaded functions the worker must be able to run
+OFFLOADED_MODULES = [
+    "core.beancount_service",
+    "core.account_classifier",
+    "core.account_retrieval",
+    "core.ledger_balances",
+    "core.ledger_analytics",
+    "core.ledger_fingerprints",
+]
+
+_registry: Dict[str, Callable] = {}
+_in_worker = False
+
+
+def offloaded(func: Callable) -> Callable:
+    """
+    Run `func` in the ledger worker process when LEDGER_WORKER_PROCESS is on.
+
+    Parsed ledgers (and every index built from them) then live in the worker
+    only: the web process sends the call over a pipe and gets back the result,
+    which must be small and picklable. Parsing a large ledger no longer holds
+    the web process's GIL, and the parse runs on another core.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    _registry[name] = func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _in_worker or not conf.LEDGER_WORKER_PROCESS:
+            with caller(name):
+                return func(*args, **kwargs)
+        return get_ledger_worker().call(name, args, kwargs)
+
+    return wrapper
+
+
+def _serve(conn) -> None:
+    """Worker process main loop: run registered functions on request."""
+    global _in_worker
+    _in_worker = True
+    for module in OFFLOADED_MODULES:
+        importlib.import_module(module)
+
+    stages: List[Tuple[str, float, Dict[str, str]]] = []
+    counts: List[Tuple[str, float, Dict[str, str]]] = []
+    add_stage_observer(lambda stage, seconds, labels: stages.append((stage, seconds, labels)))
+    add_count_observer(lambda name, amount, labels: counts.append((name, amount, labels)))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if request is None:
+            return
+        name, args, kwargs, context = request
+        stages.clear()
+        counts.clear()
+        try:
+            with log_context(**context), caller(name):
+                reply = ("ok", _registry[name](*args, **kwargs))
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            conn.send(reply + (list(stages), list(counts)))
+        except Exception as e:
+            # Result or exception that doesn't pickle
+            conn.send(("error", RuntimeError(f"{name} failed in the ledger worker: {e!r}"), list(stages), list(counts)))
+
+
+class LedgerWorker:
+    """
+    Client side of the ledger worker process.
+
+    One request is in flight at a time (the worker is single-threaded anyway);
+    calls from other threads wait for the pipe. Stage timings and counts
+    recorded in the worker are replayed to this process's observers. If the
+    worker dies it is restarted on the next call; one that doesn't answer
+    within LEDGER_WORKER_TIMEOUT_SECONDS is killed, so a hung call can't block
+    every other caller forever.
+    """
+
+    def __init__(self):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        self.calls = 0
+        self.restarts = 0
+
+    def _ensure_started(self) -> None:
+        if self._process is not None and self._process.is_alive():
+            return
+        if self._process is not None:
+            self.restarts += 1
+            logger.warning("Ledger worker exited; restarting it")
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_serve, args=(child_conn,), name="ledger-worker", daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+    def call(self, name: str, args: tuple = (), kwargs: Optional[dict] = None) -> Any:
+        with self._lock:
+            self._ensure_started()
+            try:
+                self._conn.send((name, args, kwargs or {}, current_log_context()))
+                if not self._conn.poll(conf.LEDGER_WORKER_TIMEOUT_SECONDS):
+                    self._process.terminate()
+                    self._process.join(1)
+                    self._conn.close()
+                    raise TimeoutError(f"Ledger worker didn't finish {name} within "
+                                       f"{conf.LEDGER_WORKER_TIMEOUT_SECONDS:g}s; killed it")
+                status, value, stages, counts = self._conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError) as e:
+                self._process.join(1)
+                raise RuntimeError(f"Ledger worker died while running {name}") from e
+            self.calls += 1
+        for stage, seconds, labels in stages:
+            record_stage(stage, seconds, **labels)
+        for count, amount, labels in counts:
+            record_count(count, amount, **labels)
+        if status == "error":
+            raise value
+        return value
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._conn.close()
+            self._process = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": self._process.pid if self._process is not None else None,
+            "alive": self._process is not None and self._process.is_alive(),
+            "calls": self.calls,
+            "restarts": self.restarts,
+        }
+
+
+_worker: Optional[LedgerWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_ledger_worker() -> LedgerWorker:
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = LedgerWorker()
+        return _worker
+
+
+def stop_ledger_worker() -> None:
+    with _worker_lock:
+        worker = _worker
+    if worker is not None:
+        worker.stop()
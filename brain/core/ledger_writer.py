@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from beancount.core import data
+
+import conf
+from core.beancount_service import BatchValidationError, append_many
+
+from core.log.logging_service import current_log_context, get_logger, log_context
+logger = get_logger(__name__)
+
+
+@dataclass
+class AppendRequest:
+    transactions: List[data.Transaction]
+    auto_open_accounts: bool
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    # Request/automation ids of the submitter, for the commit's log records
+    log_context: Dict[str, Any] = field(default_factory=current_log_context)
+
+
+def _batch_context(batch: List[AppendRequest]) -> Dict[str, Any]:
+    """Log context of a group commit: each id shared by every request, or the list of them."""
+    values: Dict[str, list] = {}
+    for r in batch:
+        for key, value in r.log_context.items():
+            if value not in values.setdefault(key, []):
+                values[key].append(value)
+    return {key: v[0] if len(v) == 1 else v for key, v in values.items()}
+
+
+class LedgerWriter:
+    """
+    Single writer for one ledger file.
+
+    Callers submit transactions and get a Future back. A background thread
+    coalesces everything submitted within `window_ms` into one validated,
+    fsynced append, so a burst of writers costs one lock, one validation pass
+    and one file change for Fava to pick up. Each request stays all-or-nothing:
+    a request that fails validation is rejected on its own and the rest of the
+    batch is committed without it.
+    """
+
+    def __init__(self, ledger_path: str, window_ms: int = conf.LEDGER_WRITER_WINDOW_MS,
+                 max_batch: int = conf.LEDGER_WRITER_MAX_BATCH):
+        self.ledger_path = ledger_path
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[AppendRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.lock_wait_seconds = 0.0
+        self.last_lock_wait_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush whatever is queued and stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def submit(self, transactions: List[data.Transaction], auto_open_accounts: bool = True) -> Future:
+        """
+        Queue transactions for the next group commit.
+
+        Returns:
+            Future: Resolves to {"appended", "opened_accounts"} once written, or
+            raises BatchValidationError if this request failed validation.
+        """
+        self.start()
+        request = AppendRequest(list(transactions), auto_open_accounts)
+        self._queue.put(request)
+        return request.future
+
+    def _run(self) -> None:
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.window
+            stopping = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stopping = True
+                    break
+                batch.append(nxt)
+
+            for auto_open in (True, False):
+                group = [r for r in batch if r.auto_open_accounts is auto_open]
+                if group:
+                    with log_context(**_batch_context(group)):
+                        self._commit(group, auto_open)
+            if stopping:
+                return
+
+    def _commit(self, batch: List[AppendRequest], auto_open_accounts: bool) -> None:
+        started = time.perf_counter()
+        self.queue_wait_seconds += sum(started - r.enqueued_at for r in batch)
+        pending = batch
+        while pending:
+            txns = [t for r in pending for t in r.transactions]
+            try:
+                result = append_many(self.ledger_path, txns, auto_open_accounts=auto_open_accounts)
+            except BatchValidationError as e:
+                failed = self._reject_failed(pending, e)
+                if not failed:
+                    # Nothing to pin it on (e.g. an auto-opened account): fail everyone
+                    for r in pending:
+                        r.future.set_exception(e)
+                    return
+                pending = [r for i, r in enumerate(pending) if i not in failed]
+                continue
+            except Exception as e:
+                logger.exception("Ledger write failed")
+                for r in pending:
+                    r.future.set_exception(e)
+                return
+            break
+        else:
+            return
+
+        self.batches += 1
+        self.requests += len(pending)
+        self.last_batch_size = len(pending)
+        self.max_batch_size = max(self.max_batch_size, len(pending))
+        self.last_lock_wait_seconds = result.get("lock_wait_seconds", 0.0)
+        self.lock_wait_seconds += self.last_lock_wait_seconds
+        opened = set(result["opened_accounts"])
+        for r in pending:
+            accounts = {p.account for t in r.transactions for p in t.postings}
+            r.future.set_result({
+                "appended": len(r.transactions),
+                "opened_accounts": sorted(opened & accounts),
+            })
+        logger.info(f"Committed {len(txns)} transaction(s) from {len(pending)} request(s) in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    @staticmethod
+    def _reject_failed(pending: List[AppendRequest], error: BatchValidationError) -> set:
+        """Fail the requests owning the erroring transactions; return their indexes."""
+        failed = set()
+        offset = 0
+        for i, r in enumerate(pending):
+            own = {
+                idx - offset: msgs for idx, msgs in error.item_errors.items()
+                if offset <= idx < offset + len(r.transactions)
+            }
+            if own:
+                failed.add(i)
+                r.future.set_exception(BatchValidationError(own, []))
+            offset += len(r.transactions)
+        return failed
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "requests": self.requests,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "last_lock_wait_seconds": round(self.last_lock_wait_seconds, 6),
+            "lock_wait_seconds": round(self.lock_wait_seconds, 6),
+            "queue_wait_seconds": round(self.queue_wait_seconds, 6),
+        }
+
+
+_writers: Dict[str, LedgerWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_ledger_writer(ledger_path: str = conf.BEANCOUNT_FILE) -> LedgerWriter:
+    """Return the process-wide writer for a ledger, creating it on first use."""
+    path = os.path.abspath(ledger_path)
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = LedgerWriter(path)
+        return writer
+
+
+def stop_ledger_writers() -> None:
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.stop()
@@ -1,22 +1,43 @@
+import asyncio
+import contextlib
 import json
 import re
+import time
 from datetime import date as Date
 from typing import Dict, Any
 import conf
-from openai import OpenAI
+from openai import AsyncOpenAI
+from beancount.core import number
 from core.beancount_service import (
-    append_simple_tx,
+    build_transaction,
     get_all_accounts_grouped,
-    get_inline_account_comments_map,
     get_recent_narrations_and_payees
 )
 
+from core.account_retrieval import render_all_accounts, select_accounts
+from core.account_classifier import (
+    candidate_account_pairs,
+    classify_text,
+    extract_amount,
+    extract_currency,
+    known_currencies,
+)
+from core.idempotency import IdempotencyService
+from core.ledger_writer import get_ledger_writer
+from core.profiling import record_count, record_stage, timed
+
 from core.log.logging_service import get_logger
 logger = get_logger(__name__)
 
 class LLMTransactionService:
-    def __init__(self, openai_api_key: str):
-        self.client = OpenAI(api_key=openai_api_key)
+    def __init__(self, client: AsyncOpenAI, llm_semaphore: asyncio.Semaphore | None = None):
+        """
+        Args:
+            client (AsyncOpenAI): Shared, app-lifetime client (and connection pool).
+            llm_semaphore (asyncio.Semaphore | None): Caps concurrent LLM calls.
+        """
+        self.client = client
+        self.llm_semaphore = llm_semaphore
         self.ledger_path = conf.BEANCOUNT_FILE
 
     def _clean_json(self, content: str) -> str:
@@ -25,15 +46,26 @@ class LLMTransactionService:
             content = re.sub(r"\n?```$", "", content)
         return content.strip()
 
-    def _ask(self, system_msg: str, user_msg: str) -> Dict[str, Any]:
-        response = self.client.chat.completions.create(
-            model="gpt-4.1-nano",
+    async def _ask(self, system_msg: str, user_msg: str, response_format: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        extra = {"response_format": response_format} if response_format else {}
+        model = "gpt-4.1-nano"
+        request = self.client.chat.completions.create(
+            model=model,
             messages=[
                 {"role": "system", "content": system_msg},
                 {"role": "user", "content": user_msg},
             ],
             temperature=0.3,
+            **extra,
         )
+        queued = time.perf_counter()
+        async with self.llm_semaphore or contextlib.nullcontext():
+            record_stage("llm_queue", time.perf_counter() - queued, model=model)
+            with timed("llm_call", model=model):
+                response = await request
+        if response.usage is not None:
+            record_count("llm_tokens", response.usage.prompt_tokens, model=model, kind="prompt")
+            record_count("llm_tokens", response.usage.completion_tokens, model=model, kind="completion")
         content = self._clean_json(response.choices[0].message.content)
         try:
             return json.loads(content)
@@ -41,22 +73,39 @@ class LLMTransactionService:
             raise ValueError(f"Failed to parse LLM response as JSON:\n{content}\nError: {e}")
 
 
-    def infer_accounts(self, natural_text: str) -> Dict[str, str]:
-        accounts = get_all_accounts_grouped(self.ledger_path)
-        accounts_comments = get_inline_account_comments_map(self.ledger_path)
-        sections = []
+    def _render_accounts(self, natural_text: str | None = None) -> tuple[str, list[str]]:
+        """
+        The account list for a prompt, and the accounts it contains.
+
+        With LLM_RETRIEVAL_ENABLED, only the accounts most relevant to
+        `natural_text` are listed (within LLM_ACCOUNTS_TOKEN_BUDGET); the full
+        list is used when nothing in the ledger matches the input.
+        """
+        with timed("prompt_build"):
+            if natural_text and conf.LLM_RETRIEVAL_ENABLED:
+                section, shown, fallback = select_accounts(
+                    self.ledger_path,
+                    natural_text,
+                    top_k=conf.LLM_RETRIEVAL_TOP_K,
+                    token_budget=conf.LLM_ACCOUNTS_TOKEN_BUDGET,
+                    min_score=conf.LLM_RETRIEVAL_MIN_SCORE,
+                )
+                logger.info(f"Listing {len(shown)} account(s) in the prompt{' (no match, full list)' if fallback else ''}")
+                return section, shown
+            return render_all_accounts(self.ledger_path), self._valid_accounts()
 
-        for group_name, accts in accounts.items():
-            entries = []
-            for acct in sorted(accts):
-                comment = accounts_comments.get(acct)
-                if comment:
-                    entries.append(f"  - {acct}  # {comment}")
-                else:
-                    entries.append(f"  - {acct}")
-            sections.append(f"{group_name} Accounts:\n" + "\n".join(entries))
+    def _valid_accounts(self) -> list[str]:
+        return [a for accts in get_all_accounts_grouped(self.ledger_path).values() for a in accts]
 
-        sample_accounts = "\n\n".join(sections)
+    def _check_accounts(self, from_account: str, to_account: str) -> None:
+        """Reject accounts the model made up instead of picking from the list."""
+        valid = set(self._valid_accounts())
+        unknown = [a for a in (from_account, to_account) if a not in valid]
+        if unknown:
+            raise ValueError(f"LLM returned unknown account(s): {', '.join(unknown)}")
+
+    async def infer_accounts(self, natural_text: str) -> Dict[str, str]:
+        sample_accounts, _ = await asyncio.to_thread(self._render_accounts, natural_text)
         account_prompt = f"""
 You are a financial assistant that classifies user-described transactions.
 
@@ -84,12 +133,15 @@ Guidelines:
 
 Return ONLY the JSON. Do not include explanations.
 """
-        logger.info(f"\n================\nInfer account prompt: {account_prompt}\n================")
+        logger.debug(f"Infer account prompt: {account_prompt}")
 
-        return self._ask("You help classify Beancount accounts.", account_prompt)
+        return await self._ask("You help classify Beancount accounts.", account_prompt)
 
-    def complete_transaction(self, natural_text: str, from_account: str, to_account: str) -> Dict[str, Any]:
-        recent_narrations_and_payees = get_recent_narrations_and_payees(self.ledger_path, to_account)
+    async def complete_transaction(self, natural_text: str, from_account: str, to_account: str) -> Dict[str, Any]:
+        with timed("ledger_read"):
+            recent_narrations_and_payees = await asyncio.to_thread(
+                get_recent_narrations_and_payees, self.ledger_path, to_account
+            )
 
         prompt = f"""
 Input: \"\"\"{natural_text}\"\"\"
@@ -106,36 +158,197 @@ Return a JSON object with the following fields:
 - narration: 2–4 words in Title Case, closely matching the phrasing style in recent examples (e.g. "Lunch Out", not "Meal at Restaurant")
 - payee: specific business or place name mentioned; if none, return an empty string ""
 """
-        logger.info(f"\n================\nComplete transaction prompt: {prompt}\n================")
-        return self._ask("You complete Beancount transaction details.", prompt)
-
-    def append_from_natural_text(self, natural_text: str) -> dict:
-        logger.info("Inferring accounts...")
-        accounts = self.infer_accounts(natural_text)
-        from_account = accounts["from_account"]
-        to_account = accounts["to_account"]
-        logger.info(f"→ Accounts: {from_account} → {to_account}")
-
-        logger.info("Completing transaction fields...")
-        details = self.complete_transaction(natural_text, from_account, to_account)
-        logger.info(f"→ Details: {details}")
-
-        append_simple_tx(
-            ledger_path=self.ledger_path,
-            tx_date=Date.today(),
-            amount_value=details["amount_value"],
-            currency=details.get("currency", conf.DEFAULT_CURRENCY),
-            from_account=from_account,
-            to_account=to_account,
-            narration=details.get("narration", ""),
-            payee=details.get("payee", ""),
+        logger.debug(f"Complete transaction prompt: {prompt}")
+        return await self._ask("You complete Beancount transaction details.", prompt)
+
+    def _single_call_context(self, natural_text: str) -> tuple[str, list[str], str]:
+        """Ledger-derived parts of the single-call prompt (runs off the event loop)."""
+        sample_accounts, shown_accounts = self._render_accounts(natural_text)
+        with timed("ledger_read"):
+            valid_accounts = self._valid_accounts()
+            candidates = candidate_account_pairs(self.ledger_path, natural_text)
+            examples = []
+            for to_account in dict.fromkeys(to for _, to in candidates):
+                for narration, payee in get_recent_narrations_and_payees(self.ledger_path, to_account, limit=3):
+                    examples.append(f"  - {to_account}: narration={narration!r}, payee={payee!r}")
+        recent_examples = "\n".join(examples) if examples else "  (none)"
+        # Accounts of the likely pairs are always allowed, even if retrieval missed them
+        allowed = list(dict.fromkeys(shown_accounts + [a for pair in candidates for a in pair]))
+        return sample_accounts, allowed, recent_examples
+
+    async def infer_transaction(self, natural_text: str) -> Dict[str, Any]:
+        """
+        Single round-trip alternative to infer_accounts + complete_transaction.
+
+        Accounts, amount, currency, narration and payee are requested in one
+        structured (JSON schema) completion. Recent examples are included for the
+        accounts the local classifier considers the most likely destinations.
+        """
+        sample_accounts, allowed_accounts, recent_examples = await asyncio.to_thread(
+            self._single_call_context, natural_text
         )
+        if not allowed_accounts:
+            # An empty enum is an invalid schema; there is nothing to pick from anyway
+            raise ValueError("The ledger has no open accounts to choose from")
+
+        prompt = f"""
+You are a financial assistant that turns user-described transactions into Beancount entries.
+
+Given the user input: \"\"\"{natural_text}\"\"\"
+
+And the following list of valid accounts:
+{sample_accounts}
+
+Recent examples for likely accounts:
+{recent_examples}
 
-        logger.info(f"Transaction appended -> \n {from_account} -> {to_account}\n{details}")
+Return a JSON object with the following fields:
+- from_account: the account the money is coming from
+- to_account: the account the money is going to
+- amount_value: number only (e.g. 15.50)
+- currency: 3-letter code (e.g. "EUR", "USD"); default to "{conf.DEFAULT_CURRENCY}" if not mentioned
+- narration: 2–4 words in Title Case, closely matching the phrasing style in the recent examples
+- payee: specific business or place name mentioned; if none, return an empty string ""
+
+Guidelines:
+- For a **purchase or payment**, "from_account" is the source of funds (e.g. a bank or cash account) and "to_account" the expense or liability account
+- For **income or a deposit**, "from_account" is the origin (e.g. Income:Salary) and "to_account" the bank or asset account
+- For a **transfer between accounts**, use the appropriate asset or bank accounts for both
+- Only use account names that are listed above (ignore comments like # ...)
+"""
+        logger.debug(f"Infer transaction prompt: {prompt}")
+        schema = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "transaction",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "from_account": {"type": "string", "enum": allowed_accounts},
+                        "to_account": {"type": "string", "enum": allowed_accounts},
+                        "amount_value": {"type": "number"},
+                        "currency": {"type": "string"},
+                        "narration": {"type": "string"},
+                        "payee": {"type": "string"},
+                    },
+                    "required": ["from_account", "to_account", "amount_value", "currency", "narration", "payee"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+        return await self._ask("You complete Beancount transactions.", prompt, response_format=schema)
+
+    def classify_locally(self, natural_text: str) -> Dict[str, Any] | None:
+        """
+        Resolve the transaction from ledger history alone, without calling the LLM.
+
+        Returns None unless the history-based classifier is at least
+        LLM_LOCAL_CONFIDENCE sure and exactly one amount can be read from the
+        text. Only currencies the ledger declares are read from the text;
+        otherwise the nearest past transaction's currency is used.
+        """
+        amount_value = extract_amount(natural_text)
+        if amount_value is None:
+            return None
 
+        guess = classify_text(self.ledger_path, natural_text)
+        if guess is None:
+            return None
+        logger.info(f"Local classifier: {guess.from_account} → {guess.to_account} (confidence {guess.confidence:.2f})")
+        if guess.confidence < conf.LLM_LOCAL_CONFIDENCE:
+            return None
 
+        return {
+            "from_account": guess.from_account,
+            "to_account": guess.to_account,
+            "amount_value": amount_value,
+            "currency": extract_currency(natural_text, known_currencies(self.ledger_path)) or guess.currency or conf.DEFAULT_CURRENCY,
+            "narration": guess.narration,
+            "payee": guess.payee,
+            "confidence": round(guess.confidence, 3),
+        }
+
+    async def append_from_natural_text(self, natural_text: str, mode: str | None = None,
+                                       idempotency_key: str | None = None) -> dict:
+        """
+        Args:
+            natural_text (str): The user's description of the transaction.
+            mode (str | None): "two_step" (infer accounts, then complete fields) or
+                "single" (one structured call); defaults to LLM_PIPELINE_MODE.
+            idempotency_key (str | None): Retries with the same key return the
+                first response, without calling the LLM or appending again.
+        """
+        idempotency = IdempotencyService(self.ledger_path) if idempotency_key else None
+        if idempotency is not None:
+            replay = await asyncio.to_thread(
+                idempotency.claim, idempotency_key, "llm.append", {"text": natural_text, "mode": mode}
+            )
+            if replay is not None:
+                return replay
+        try:
+            txn, result = await self._transaction_from_text(natural_text, mode)
+            if idempotency is not None:
+                # Which accounts the write opens is only known once it is done
+                await asyncio.to_thread(idempotency.expect, idempotency_key, [txn], {**result, "opened_accounts": None})
+            # The writer thread does the ledger I/O; just await its future
+            with timed("append"):
+                written = await asyncio.wrap_future(get_ledger_writer(self.ledger_path).submit([txn]))
+        except Exception:
+            # Nothing was written; a retry with the same key runs again
+            if idempotency is not None:
+                await asyncio.to_thread(idempotency.release, idempotency_key)
+            raise
+        result["opened_accounts"] = written["opened_accounts"]
+        if idempotency is not None:
+            await asyncio.to_thread(idempotency.complete, idempotency_key, result)
+        logger.info(f"Transaction appended -> {result['transaction']}")
+        return result
+
+    async def _transaction_from_text(self, natural_text: str, mode: str | None) -> tuple:
+        """The transaction described by `natural_text`, and the response reporting it."""
+        mode = mode or conf.LLM_PIPELINE_MODE
+        local = None
+        if conf.LLM_LOCAL_CLASSIFIER:
+            with timed("local_classify"):
+                local = await asyncio.to_thread(self.classify_locally, natural_text)
+        if local:
+            path = "local"
+            from_account = local.pop("from_account")
+            to_account = local.pop("to_account")
+            details = local
+            logger.info(f"→ Resolved locally: {from_account} → {to_account} {details}")
+        elif mode == "single":
+            path = "llm"
+            logger.info("Inferring transaction in a single call...")
+            details = await self.infer_transaction(natural_text)
+            from_account = details.pop("from_account")
+            to_account = details.pop("to_account")
+            await asyncio.to_thread(self._check_accounts, from_account, to_account)
+            logger.info(f"→ Transaction: {from_account} → {to_account} {details}")
+        else:
+            path = "llm"
+            logger.info("Inferring accounts...")
+            accounts = await self.infer_accounts(natural_text)
+            from_account = accounts["from_account"]
+            to_account = accounts["to_account"]
+            await asyncio.to_thread(self._check_accounts, from_account, to_account)
+            logger.info(f"→ Accounts: {from_account} → {to_account}")
+
+            logger.info("Completing transaction fields...")
+            details = await self.complete_transaction(natural_text, from_account, to_account)
+            logger.info(f"→ Details: {details}")
+
+        amount_value = number.D(str(details["amount_value"]))
+        currency = details.get("currency", conf.DEFAULT_CURRENCY)
+        txn = build_transaction(
+            Date.today(),
+            [(from_account, -amount_value, currency), (to_account, amount_value, currency)],
+            narration=details.get("narration", ""),
+            payee=details.get("payee", ""),
+        )
         res = f'{from_account}->{to_account} {details["amount_value"]}{details.get("currency", conf.DEFAULT_CURRENCY)}. {details.get("narration", "")} {details.get("payee", "")}'
-        return res
+        return txn, {"transaction": res, "path": path, "mode": None if path == "local" else mode}
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
@@ -148,5 +361,5 @@ if __name__ == "__main__":
     parser.add_argument("text", type=str, help="Natural language transaction (in quotes)")
     args = parser.parse_args()
 
-    service = LLMTransactionService(openai_api_key=os.getenv("OPENAI_API_KEY"))
-    service.append_from_natural_text(args.text)
+    service = LLMTransactionService(client=AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+    print(asyncio.run(service.append_from_natural_text(args.text)))
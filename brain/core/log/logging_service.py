@@ -1,16 +1,172 @@
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def _overrides(value: str, cast: Callable) -> Dict[str, Any]:
+    """Parse "logger.prefix=value,other.prefix=value"."""
+    result = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        prefix, _, setting = item.partition("=")
+        result[prefix.strip()] = cast(setting)
+    return result
+
 
 # Define default log file path
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/beanbrain.log")
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Level written to the log file (the console gets INFO and above)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+# Messages longer than this are cut (0 keeps them whole)
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 2000))
+# Per-subsystem overrides by logger name prefix, e.g.
+# LOG_TRUNCATE="core.llm_service=500" cuts its messages at 500 chars and
+# LOG_SAMPLE="core.llm_service=0.1" keeps 10% of its debug/info records
+LOG_TRUNCATE = _overrides(os.getenv("LOG_TRUNCATE", ""), int)
+LOG_SAMPLE = _overrides(os.getenv("LOG_SAMPLE", ""), float)
 
 # Ensure the logs directory exists
 os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
 
+# Ids attached to every record logged within (request_id, automation_id, ...)
+_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields: Any):
+    """Attach `fields` to every record logged inside, on this thread or task and the ones it starts."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_log_context() -> Dict[str, Any]:
+    return dict(_context.get())
+
+
+_policies: Dict[str, Tuple[int, float]] = {}
+
+
+def _policy(name: str) -> Tuple[int, float]:
+    """(max chars, sample rate) of a logger, from its longest matching prefix."""
+    policy = _policies.get(name)
+    if policy is None:
+        def setting(overrides: Dict[str, Any], default: Any) -> Any:
+            matches = [p for p in overrides if name == p or name.startswith(p + ".")]
+            return overrides[max(matches, key=len)] if matches else default
+        policy = _policies[name] = (setting(LOG_TRUNCATE, LOG_MAX_CHARS), setting(LOG_SAMPLE, 1.0))
+    return policy
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Queues records for the listener thread, which does the formatting and
+    I/O. Sampling, truncation and the log context are applied here, on the
+    logging thread, so the queued record is self-contained.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = _policy(record.name)[1]
+        if record.levelno < logging.WARNING and sample < 1 and random.random() >= sample:
+            return False
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        message = record.getMessage()
+        limit = _policy(record.name)[0]
+        if limit and len(message) > limit:
+            message = f"{message[:limit]}… ({len(message) - limit} more chars)"
+        record.message = record.msg = message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        record.context = _context.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "source": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            text += " [" + " ".join(f"{k}={v}" for k, v in context.items()) + "]"
+        return text
+
+
+_handler: Optional[QueueHandler] = None
+_handler_lock = threading.Lock()
+
+
+def _queue_handler() -> QueueHandler:
+    """The process-wide queue handler, starting its listener on first use."""
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            if LOG_FORMAT == "json":
+                formatter = JsonFormatter()
+            else:
+                # Enhanced formatter with file and line number
+                formatter = TextFormatter(
+                    "%(asctime)s - %(levelname)s - %(name)s - %(filename)s:%(lineno)d - %(message)s"
+                )
+
+            # Rotating file handler
+            file_handler = RotatingFileHandler(
+                LOG_FILE_PATH, maxBytes=5 * 1024 * 1024, backupCount=3
+            )
+            file_handler.setLevel(LOG_LEVEL)
+
+            # Console handler
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.INFO)
+
+            file_handler.setFormatter(formatter)
+            console_handler.setFormatter(formatter)
+
+            records: queue.SimpleQueue = queue.SimpleQueue()
+            listener = QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+            listener.start()
+            # Flush what is still queued when the process exits
+            atexit.register(listener.stop)
+            _handler = _ContextQueueHandler(records)
+        return _handler
+
+
 def get_logger(name: str) -> logging.Logger:
     """
-    Creates and configures a logger with a rotating file handler.
+    Creates and configures a logger that hands its records to a background
+    listener thread, so logging never waits on file or console I/O.
 
     Args:
         name (str): Name of the logger (usually the module name).
@@ -20,26 +176,8 @@ def get_logger(name: str) -> logging.Logger:
     """
     logger = logging.getLogger(name)
     if not logger.hasHandlers():
-        logger.setLevel(logging.DEBUG)
-
-        # Rotating file handler
-        file_handler = RotatingFileHandler(
-            LOG_FILE_PATH, maxBytes=5 * 1024 * 1024, backupCount=3
-        )
-        file_handler.setLevel(logging.DEBUG)
-
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-
-        # Enhanced formatter with file and line number
-        formatter = logging.Formatter(
-            "%(asctime)s - %(levelname)s - %(name)s - %(filename)s:%(lineno)d - %(message)s"
-        )
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
-
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        # Records below every handler's level aren't even created
+        logger.setLevel(min(logging.getLevelName(LOG_LEVEL), logging.INFO))
+        logger.addHandler(_queue_handler())
 
     return logger
@@ -0,0 +1,96 @@
+import os
+from typing import Dict
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+from core.profiling import add_count_observer, add_stage_observer
+
+# From sub-millisecond cache reads to parses of very large ledgers
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Scheduler lag is seconds when healthy, hours after downtime
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600, 6 * 3600, 24 * 3600)
+
+LEDGER_PARSE = Histogram(
+    "beanbrain_ledger_parse_seconds", "Full parses of a ledger, by the call that needed one",
+    ["caller"], buckets=LATENCY_BUCKETS,
+)
+LOCK_WAIT = Histogram(
+    "beanbrain_ledger_lock_wait_seconds", "Time appends wait for the ledger lock", buckets=LATENCY_BUCKETS,
+)
+LOCK_HOLD = Histogram(
+    "beanbrain_ledger_lock_hold_seconds", "Time appends hold the ledger lock (read, validate, write)",
+    buckets=LATENCY_BUCKETS,
+)
+VALIDATION = Histogram(
+    "beanbrain_validation_seconds", "Validation of appended transactions", buckets=LATENCY_BUCKETS,
+)
+LLM_QUEUE = Histogram(
+    "beanbrain_llm_queue_seconds", "Time LLM calls wait for a free slot",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+LLM_CALL = Histogram(
+    "beanbrain_llm_call_seconds", "LLM calls, once they have a slot",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter("beanbrain_llm_tokens", "Tokens used by LLM calls", ["model", "kind"])
+SCHEDULER_LAG = Histogram(
+    "beanbrain_scheduler_lag_seconds", "How long after its scheduled time an automation ran",
+    buckets=LAG_BUCKETS,
+)
+DB_SESSION = Histogram(
+    "beanbrain_db_session_seconds", "Automation repository DB sessions, by operation",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+STAGE = Histogram(
+    "beanbrain_stage_seconds", "Other timed stages (ledger reads, prompt builds, writes, ...)",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+
+_STAGES = {
+    "ledger_parse": LEDGER_PARSE,
+    "lock_wait": LOCK_WAIT,
+    "lock_hold": LOCK_HOLD,
+    "validation": VALIDATION,
+    "llm_queue": LLM_QUEUE,
+    "llm_call": LLM_CALL,
+    "scheduler_lag": SCHEDULER_LAG,
+    "db_session": DB_SESSION,
+}
+_COUNTS = {
+    "llm_tokens": LLM_TOKENS,
+}
+
+
+def _observe_stage(stage: str, seconds: float, labels: Dict[str, str]) -> None:
+    metric = _STAGES.get(stage)
+    if metric is None:
+        STAGE.labels(stage=stage).observe(seconds)
+    else:
+        (metric.labels(**labels) if labels else metric).observe(seconds)
+
+
+def _observe_count(name: str, amount: float, labels: Dict[str, str]) -> None:
+    metric = _COUNTS.get(name)
+    if metric is not None:
+        (metric.labels(**labels) if labels else metric).inc(amount)
+
+
+_installed = False
+
+
+def install_metrics() -> None:
+    """Feed the profiling hooks into the Prometheus metrics (once per process)."""
+    global _installed
+    if not _installed:
+        add_stage_observer(_observe_stage)
+        add_count_observer(_observe_count)
+        _installed = True
+
+
+def render_metrics() -> bytes:
+    """The metrics in Prometheus' text format, summed over every uvicorn worker in multiprocess mode."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
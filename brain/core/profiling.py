@@ -0,0 +1,85 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+# Called with (stage, seconds, labels) every time a timed stage finishes
+StageObserver = Callable[[str, float, Dict[str, str]], None]
+# Called with (name, amount, labels) for counted quantities (e.g. LLM tokens)
+CountObserver = Callable[[str, float, Dict[str, str]], None]
+
+_observers: List[StageObserver] = []
+_count_observers: List[CountObserver] = []
+_observers_lock = threading.Lock()
+
+# The offloaded function the current work is done for, e.g. to tell which
+# endpoint caused a ledger parse
+_caller: contextvars.ContextVar[str] = contextvars.ContextVar("profiling_caller", default="")
+
+
+def add_stage_observer(observer: StageObserver) -> None:
+    with _observers_lock:
+        _observers.append(observer)
+
+
+def remove_stage_observer(observer: StageObserver) -> None:
+    with _observers_lock:
+        if observer in _observers:
+            _observers.remove(observer)
+
+
+def add_count_observer(observer: CountObserver) -> None:
+    with _observers_lock:
+        _count_observers.append(observer)
+
+
+def remove_count_observer(observer: CountObserver) -> None:
+    with _observers_lock:
+        if observer in _count_observers:
+            _count_observers.remove(observer)
+
+
+def record_stage(stage: str, seconds: float, **labels: str) -> None:
+    for observer in list(_observers):
+        observer(stage, seconds, labels)
+
+
+def record_count(name: str, amount: float, **labels: str) -> None:
+    for observer in list(_count_observers):
+        observer(name, amount, labels)
+
+
+@contextmanager
+def timed(stage: str, **labels: str):
+    """
+    Time a pipeline stage and report it to the registered observers.
+
+    Stages are named after what they do ("ledger_read", "llm_call", "write", ...)
+    and may run on any thread; `labels` tell apart instances of a stage (the
+    model of an LLM call, ...). With no observer registered this costs two
+    clock reads.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _observers:
+            record_stage(stage, time.perf_counter() - started, **labels)
+
+
+def current_caller() -> str:
+    return _caller.get() or "other"
+
+
+@contextmanager
+def caller(name: str):
+    """Attribute the stages recorded inside to `name`, unless an outer caller already is."""
+    if _caller.get():
+        yield
+        return
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
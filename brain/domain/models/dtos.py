@@ -1,5 +1,6 @@
-from datetime import datetime
-from typing import Optional, Dict, Any
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any, List
 from pydantic import BaseModel, Field, field_validator
 from conf import DEFAULT_TZ
 from croniter import croniter
@@ -43,8 +44,99 @@ class AutomationUpdate(BaseModel):
 class AutomationOut(AutomationBase):
     id: str
     last_ran_at: Optional[datetime] = None
+    next_run_at: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class CatchUpOut(BaseModel):
+    automations: int = Field(..., description="Automations that had missed runs")
+    occurrences: int = Field(..., description="Missed runs found")
+    appended: int = Field(..., description="Transactions written")
+    failed: Dict[str, List[str]] = Field(default_factory=dict, description="Errors per automation id")
+    retrying: List[str] = Field(default_factory=list, description="Ids of failed automations left due, to be retried")
+
+
+class PostingIn(BaseModel):
+    account: str = Field(..., example="Expenses:Food:Groceries")
+    amount: Optional[Decimal] = Field(None, example=23.5, description="Leave empty on one posting to auto-balance")
+    currency: Optional[str] = Field(None, example="EUR")
+
+    @field_validator("currency")
+    @classmethod
+    def validate_currency(cls, value, info):
+        if value is None and info.data.get("amount") is not None:
+            raise ValueError("currency is required when amount is set")
+        return value
+
+
+class TransactionIn(BaseModel):
+    date: date
+    narration: str = ""
+    payee: Optional[str] = None
+    flag: str = "*"
+    tags: List[str] = []
+    links: List[str] = []
+    postings: List[PostingIn] = Field(..., min_length=2)
+
+
+class BatchAppendIn(BaseModel):
+    transactions: List[TransactionIn] = Field(..., min_length=1)
+    auto_open_accounts: bool = True
+
+
+class BatchAppendOut(BaseModel):
+    appended: int
+    opened_accounts: Optional[List[str]] = Field(
+        ..., description="Accounts opened for the batch; null on the replay of a request that died right after its write",
+    )
+
+
+class BalancesOut(BaseModel):
+    version: int = Field(..., description="Ledger version the balances were read from")
+    balances: Dict[str, Dict[str, Decimal]] = Field(..., description="Account -> currency -> amount")
+
+
+class BalancePeriod(BaseModel):
+    period: str = Field(..., example="2025-01", description="Day (YYYY-MM-DD) or month (YYYY-MM)")
+    change: Dict[str, Decimal]
+    balance: Dict[str, Decimal] = Field(..., description="Balance at the end of the period")
+
+
+class AccountBalanceOut(BaseModel):
+    version: int
+    account: str
+    balance: Dict[str, Decimal]
+    series: List[BalancePeriod] = Field(default_factory=list, description="Periods with postings, oldest first")
+
+
+class MonthlySpendOut(BaseModel):
+    account: str
+    currency: str
+    months: List[str] = Field(..., description="Every month from the first to the last with postings (YYYY-MM)")
+    series: Dict[str, List[float]] = Field(..., description="Sub-account -> total per month")
+    total: List[float]
+
+
+class PayeeTotal(BaseModel):
+    payee: str
+    amount: float
+    count: int = Field(..., description="Number of postings")
+
+
+class TopPayeesOut(BaseModel):
+    account: str
+    currency: str
+    payees: List[PayeeTotal]
+
+
+class RollingAverageOut(BaseModel):
+    account: str
+    currency: str
+    window: int
+    periods: List[str]
+    totals: List[float]
+    average: List[float] = Field(..., description="Trailing average of the totals over `window` periods")
@@ -29,6 +29,8 @@ class AutomationDB(Base):
     
     # Tracking
     last_ran_at = Column(DateTime(timezone=True), nullable=True)
+    # Next occurrence of the cron expression (UTC); the dispatcher polls this
+    next_run_at = Column(DateTime(timezone=True), nullable=True, index=True)
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine, event
+from sqlalchemy import Table, create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from conf import DATABASE_URL, DB_LOG_ENABLED, POOL_SIZE, MAX_OVERFLOW, POOL_TIMEOUT
 
@@ -40,6 +40,22 @@ def set_pg_timezone(dbapi_connection, connection_record):
 # autocommit=False: Requires explicit session.commit() for changes to be persisted.
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
+
+def ensure_columns(table: Table) -> None:
+    """
+    Add columns (and their indexes) that a model gained after its table was
+    created; `create_all` only creates missing tables. Not safe to run from
+    several processes at once: hold a lock around it.
+    """
+    existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
 def get_db():
     db = SessionLocal()
     try:
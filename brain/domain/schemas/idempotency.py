@@ -0,0 +1,22 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, JSON, String
+from domain.schemas.database import Base
+
+
+class IdempotencyKeyDB(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Client-supplied (Idempotency-Key header) or derived, e.g. "automation:<id>:<run time>"
+    key = Column(String, primary_key=True)
+    scope = Column(String, nullable=False)  # e.g. "ledger.batch", "llm.append", "automation"
+    # SHA-256 of the request, to reject a key reused for a different one
+    request_hash = Column(String(64), nullable=False)
+
+    # Fingerprint -> number of transactions with it the ledger holds once this request is written
+    fingerprints = Column(JSON, nullable=True)
+    # What the request returned (or will return, while it is in flight)
+    response = Column(JSON, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
+    # Set once the write went through; until then the key is in flight (or abandoned)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,23 @@
+import httpx
+from openai import AsyncOpenAI
+import conf
+
+
+def build_openai_client(api_key: str, base_url: str | None = conf.OPENAI_BASE_URL) -> AsyncOpenAI:
+    """
+    Build the app-lifetime OpenAI client.
+
+    One client means one HTTP connection pool, so TLS sessions and keep-alive
+    connections are reused across requests instead of being set up each time.
+    `base_url` points it at any OpenAI-compatible server (e.g. the benchmark stub).
+    """
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=conf.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=conf.OPENAI_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(conf.OPENAI_TIMEOUT, connect=10.0),
+    )
+    return AsyncOpenAI(
+        api_key=api_key, base_url=base_url, http_client=http_client, max_retries=conf.OPENAI_MAX_RETRIES
+    )
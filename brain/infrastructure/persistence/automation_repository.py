@@ -1,32 +1,65 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 from domain.schemas.automation import AutomationDB
-from domain.schemas.database import SessionLocal
+from infrastructure.persistence.session import timed_session
+
 
 class AutomationRepository:
     def create(self, a: AutomationDB) -> AutomationDB:
-        with SessionLocal() as db:
+        with timed_session("create") as db:
             db.add(a)
             db.commit()
             db.refresh(a)
             return a
 
     def list(self) -> List[AutomationDB]:
-        with SessionLocal() as db:
+        with timed_session("list") as db:
             return db.query(AutomationDB).order_by(AutomationDB.id.desc()).all()
 
     def get(self, id_: int) -> Optional[AutomationDB]:
-        with SessionLocal() as db:
+        with timed_session("get") as db:
             return db.get(AutomationDB, id_)
-        
+
     def update(self, a: AutomationDB) -> AutomationDB:
-        with SessionLocal() as db:
+        with timed_session("update") as db:
             merged = db.merge(a)
             db.commit()
             db.refresh(merged)
             return merged
 
     def delete(self, a: AutomationDB) -> None:
-        with SessionLocal() as db:
+        with timed_session("delete") as db:
             db.delete(db.merge(a))
             db.commit()
+
+    def due(self, now: datetime) -> List[AutomationDB]:
+        """Enabled automations whose next run is at or before `now` (one indexed query)."""
+        with timed_session("due") as db:
+            return db.query(AutomationDB).filter(
+                AutomationDB.enabled.is_(True),
+                AutomationDB.next_run_at <= now,
+            ).order_by(AutomationDB.next_run_at).all()
+
+    def unscheduled(self) -> List[AutomationDB]:
+        """Enabled automations without a next run yet (created before it was tracked)."""
+        with timed_session("unscheduled") as db:
+            return db.query(AutomationDB).filter(
+                AutomationDB.enabled.is_(True),
+                AutomationDB.next_run_at.is_(None),
+            ).all()
+
+    def earliest_next_run(self) -> Optional[datetime]:
+        with timed_session("earliest_next_run") as db:
+            return db.execute(
+                select(func.min(AutomationDB.next_run_at)).where(AutomationDB.enabled.is_(True))
+            ).scalar()
+
+    def bulk_update(self, values: List[Dict[str, Any]]) -> None:
+        """Update many automations by primary key in one transaction (dicts with an "id" key)."""
+        if not values:
+            return
+        with timed_session("bulk_update") as db:
+            db.execute(update(AutomationDB), values)
+            db.commit()
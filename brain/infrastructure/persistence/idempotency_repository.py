@@ -0,0 +1,94 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from domain.schemas.idempotency import IdempotencyKeyDB
+from infrastructure.persistence.session import timed_session
+
+
+class IdempotencyRepository:
+    def claim(self, row: IdempotencyKeyDB) -> bool:
+        """Insert a new key; False if it already exists (the primary key decides between racing requests)."""
+        with timed_session("idempotency_claim") as db:
+            db.add(row)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return False
+            return True
+
+    def get(self, key: str) -> Optional[IdempotencyKeyDB]:
+        with timed_session("idempotency_get") as db:
+            return db.get(IdempotencyKeyDB, key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, IdempotencyKeyDB]:
+        if not keys:
+            return {}
+        with timed_session("idempotency_get_many") as db:
+            rows = db.query(IdempotencyKeyDB).filter(IdempotencyKeyDB.key.in_(keys)).all()
+            return {r.key: r for r in rows}
+
+    def save_many(self, rows: List[IdempotencyKeyDB]) -> None:
+        """Insert or overwrite keys in one transaction."""
+        if not rows:
+            return
+        with timed_session("idempotency_save_many") as db:
+            for row in rows:
+                db.merge(row)
+            db.commit()
+
+    def take_over(self, key: str, created_at: datetime, now: datetime) -> bool:
+        """
+        Restart an abandoned key as in flight again; False if another request
+        finished or took it over first.
+        """
+        with timed_session("idempotency_take_over") as db:
+            result = db.execute(
+                update(IdempotencyKeyDB)
+                .where(
+                    IdempotencyKeyDB.key == key,
+                    IdempotencyKeyDB.created_at == created_at,
+                    IdempotencyKeyDB.completed_at.is_(None),
+                )
+                .values(created_at=now, fingerprints=None, response=None)
+            )
+            db.commit()
+            return result.rowcount == 1
+
+    def update(self, key: str, values: Dict[str, Any]) -> None:
+        with timed_session("idempotency_update") as db:
+            db.execute(update(IdempotencyKeyDB).where(IdempotencyKeyDB.key == key).values(**values))
+            db.commit()
+
+    def complete_many(self, keys: List[str], now: datetime, response: Optional[Dict[str, Any]] = None) -> None:
+        if not keys:
+            return
+        values = {"completed_at": now}
+        if response is not None:
+            values["response"] = response
+        with timed_session("idempotency_complete") as db:
+            db.execute(update(IdempotencyKeyDB).where(IdempotencyKeyDB.key.in_(keys)).values(**values))
+            db.commit()
+
+    def delete_many(self, keys: List[str]) -> None:
+        if not keys:
+            return
+        with timed_session("idempotency_delete") as db:
+            db.execute(delete(IdempotencyKeyDB).where(IdempotencyKeyDB.key.in_(keys)))
+            db.commit()
+
+    def purge(self, before: datetime, keep_pending_scopes: List[str]) -> int:
+        """Delete keys created before `before`, except pending ones of `keep_pending_scopes`."""
+        with timed_session("idempotency_purge") as db:
+            result = db.execute(
+                delete(IdempotencyKeyDB).where(
+                    IdempotencyKeyDB.created_at < before,
+                    or_(
+                        IdempotencyKeyDB.completed_at.is_not(None),
+                        IdempotencyKeyDB.scope.not_in(keep_pending_scopes),
+                    ),
+                )
+            )
+            db.commit()
+            return result.rowcount
@@ -0,0 +1,10 @@
+from contextlib import contextmanager
+from core.profiling import timed
+from domain.schemas.database import SessionLocal
+
+
+@contextmanager
+def timed_session(operation: str):
+    """A DB session, timed as a `db_session` stage labelled with the repository operation."""
+    with timed("db_session", operation=operation), SessionLocal() as db:
+        yield db
@@ -1,32 +1,207 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.executors.pool import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, List, Optional
+import fcntl  # Unix only
+import os
+import socket
+import threading
+from croniter import croniter
 from dateutil.tz import gettz
-import logging, os
-import conf
+import logging
 
 logger = logging.getLogger(__name__)
 
-def build_scheduler() -> AsyncIOScheduler:
-    jobstores = {
-        # optional persistence for scheduled jobs
-        # "default": SQLAlchemyJobStore(url=conf.DATABASE_URL)
-    }
-    executors = {
-        "default": ThreadPoolExecutor(max_workers=10),
-    }
-    job_defaults = {"coalesce": True, "max_instances": 1}
-
-    tz = gettz(conf.DEFAULT_TZ)
-    sched = AsyncIOScheduler(
-        jobstores=jobstores,
-        executors=executors,
-        job_defaults=job_defaults,
-        timezone=tz,
-    )
-    return sched
-
-def remove_job_if_exists(scheduler, job_id: str):
-    try:
-        scheduler.remove_job(job_id)
-    except Exception:
-        pass
\ No newline at end of file
+# Runs this late are still executed when catch-up is disabled (APScheduler's old misfire grace)
+MISFIRE_GRACE = timedelta(hours=1)
+
+
+def as_utc(value: datetime) -> datetime:
+    """Naive datetimes (e.g. read back from SQLite) are UTC."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def next_run_time(cron_expression: str, tz_name: Optional[str], after: datetime) -> datetime:
+    """First occurrence of a cron schedule strictly after `after`, in UTC."""
+    tz = gettz(tz_name) or timezone.utc
+    return as_utc(croniter(cron_expression, as_utc(after).astimezone(tz)).get_next(datetime))
+
+
+def missed_run_times(cron_expression: str, tz_name: Optional[str], since: datetime, until: datetime, limit: int) -> List[datetime]:
+    """
+    Occurrences of a cron schedule in (since, until], oldest first.
+
+    Args:
+        cron_expression (str): 5-field cron expression.
+        tz_name (Optional[str]): Timezone the expression is evaluated in.
+        since (datetime): Last run; naive values (e.g. from SQLite) are UTC.
+        until (datetime): Usually now.
+        limit (int): Maximum number of occurrences to return.
+
+    Returns:
+        List[datetime]: Timezone-aware occurrences in the schedule's timezone.
+    """
+    tz = gettz(tz_name) or timezone.utc
+    until = as_utc(until)
+
+    times = []
+    it = croniter(cron_expression, as_utc(since).astimezone(tz))
+    while len(times) < limit:
+        nxt = it.get_next(datetime)
+        if nxt > until:
+            break
+        times.append(nxt)
+    return times
+
+
+class LeaderLock:
+    """
+    Leader election between the worker processes of one deployment.
+
+    The leader holds a non-blocking exclusive flock on a file next to the
+    ledger for as long as it lives. The kernel drops the lock when the process
+    exits or crashes, so there is no lease to expire: the next worker to retry
+    simply gets it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # Who holds it, for whoever looks at the file
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{socket.gethostname()} {os.getpid()} {datetime.now(timezone.utc).isoformat()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+@contextmanager
+def exclusive_lock(path: str):
+    """Blocking exclusive flock on `path`, across threads and processes."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AutomationDispatcher:
+    """
+    One loop for every automation.
+
+    Each automation stores its precomputed `next_run_at`; the loop sleeps until
+    the earliest one, runs everything due at that point as one batch, and goes
+    back to sleep. Nothing is loaded per automation at startup, and changes to
+    automations just wake the loop so it can re-read the earliest due time.
+    With a `leader` lock, only the process holding it dispatches; the others
+    retry every `leader_retry` seconds and take over if the leader goes away.
+    Automations a pass left due after a transient failure would make the loop
+    spin, so after such a pass it waits `retry_min` seconds, doubling on every
+    further one up to `retry_max`.
+
+    Args:
+        run_due (Callable[[datetime, Optional[datetime]], Any]): Runs every
+            automation due at `now`, skipping occurrences before the second
+            argument when given. Its result lists the automations to retry
+            in `retrying`.
+        next_due (Callable[[], Optional[datetime]]): Earliest `next_run_at`.
+        max_idle (float): Upper bound on a sleep, in seconds.
+        leader (Optional[LeaderLock]): Lock deciding which process dispatches.
+        leader_retry (float): Seconds between attempts to become the leader.
+        retry_min (float): Wait after a first pass that left automations to retry.
+        retry_max (float): Upper bound on that wait.
+    """
+
+    def __init__(self, run_due: Callable[[datetime, Optional[datetime]], Any],
+                 next_due: Callable[[], Optional[datetime]], max_idle: float = 60.0,
+                 leader: Optional[LeaderLock] = None, leader_retry: float = 10.0,
+                 retry_min: float = 5.0, retry_max: float = 300.0):
+        self.run_due = run_due
+        self.next_due = next_due
+        self.max_idle = max_idle
+        self.leader = leader
+        self.leader_retry = leader_retry
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, catch_up: bool = True) -> None:
+        """
+        Start the loop. Without `catch_up`, runs missed while the service was
+        down are skipped unless they are less than MISFIRE_GRACE late.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(catch_up,), name="automation-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.leader is not None:
+            self.leader.release()
+
+    def wake(self) -> None:
+        """
+        Re-read the earliest due time (call after automations change). A leader
+        in another process picks the change up within `max_idle` seconds.
+        """
+        self._wake.set()
+
+    def _run(self, catch_up: bool) -> None:
+        dispatched = False
+        failing_passes = 0
+        while not self._stop.is_set():
+            self._wake.clear()
+            if self.leader is not None and not self.leader.is_leader:
+                if not self.leader.try_acquire():
+                    self._stop.wait(self.leader_retry)
+                    continue
+                logger.info(f"Process {os.getpid()} is now the automation leader")
+            # On the first pass only, counted from when this process took over
+            skip_before = None if catch_up or dispatched else datetime.now(timezone.utc) - MISFIRE_GRACE
+
+            next_due = None
+            retrying = False
+            try:
+                result = self.run_due(datetime.now(timezone.utc), skip_before)
+                retrying = bool(getattr(result, "retrying", None))
+                next_due = self.next_due()
+            except Exception:
+                logger.exception("Automation dispatch failed")
+            dispatched = True
+
+            timeout = self.max_idle
+            if next_due is not None:
+                timeout = min(max((as_utc(next_due) - datetime.now(timezone.utc)).total_seconds(), 0.0), self.max_idle)
+            if retrying:
+                # Still due: without a delay the next pass would start right away
+                timeout = max(timeout, min(self.retry_min * 2 ** failing_passes, self.retry_max))
+                failing_passes += 1
+            else:
+                failing_passes = 0
+            self._wake.wait(timeout)
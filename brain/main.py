@@ -1,10 +1,22 @@
 # main.py
-from fastapi import FastAPI
+import asyncio
+import os
+import uuid
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from domain.schemas.database import Base, engine, SessionLocal
+from domain.schemas.database import Base, engine, SessionLocal, ensure_columns
+from domain.schemas.automation import AutomationDB
 from core.automation_service import AutomationService
-from infrastructure.scheduler.scheduler_service import build_scheduler
-from api import automation, llm
+from infrastructure.scheduler.scheduler_service import AutomationDispatcher, LeaderLock, exclusive_lock
+from infrastructure.llm.openai_client import build_openai_client
+from core.ledger_writer import stop_ledger_writers
+from core.ledger_worker import stop_ledger_worker
+from core.beancount_service import persist_ledger_snapshots, warm_ledger
+from core.metrics import install_metrics
+from core.log.logging_service import get_logger, log_context
+import conf
+from api import automation, ledger, llm, metrics
+logger = get_logger(__name__)
 
 app = FastAPI(title="Beancount Automations API", version="0.1.0")
 app.add_middleware(
@@ -12,32 +24,87 @@ app.add_middleware(
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    # Every record logged while serving the request carries its id
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    with log_context(request_id=request_id):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # Keep a reference on the app state
-app.state.scheduler = None
+app.state.dispatcher = None
+app.state.openai_client = None
+app.state.llm_semaphore = None
 
 @app.on_event("startup")
 async def on_startup():
-    # DB init
-    Base.metadata.create_all(bind=engine)
+    if conf.METRICS_ENABLED:
+        install_metrics()
+
+    # DB init, one worker at a time: racing workers would both add a missing column
+    with exclusive_lock(conf.SCHEDULER_LOCK_FILE + ".schema"):
+        Base.metadata.create_all(bind=engine)
+        ensure_columns(AutomationDB.__table__)
+
+    # Shared OpenAI client (one connection pool for the app's lifetime)
+    openai_key = os.getenv("OPENAI_API_KEY")
+    if openai_key:
+        app.state.openai_client = build_openai_client(openai_key)
+    app.state.llm_semaphore = asyncio.Semaphore(conf.LLM_MAX_CONCURRENCY)
 
-    # Scheduler init
-    sched = build_scheduler()
-    sched.start()
-    app.state.scheduler = sched
+    # Automation dispatcher: one loop driven by the stored next_run_at,
+    # so startup doesn't depend on the number of automations. Every worker
+    # starts one, but only the elected leader dispatches.
+    service = AutomationService()
+    dispatcher = AutomationDispatcher(
+        run_due=service.run_due,
+        next_due=service.next_due_at,
+        leader=LeaderLock(conf.SCHEDULER_LOCK_FILE),
+        leader_retry=conf.SCHEDULER_LEADER_RETRY_SECONDS,
+        retry_min=conf.AUTOMATION_RETRY_MIN_SECONDS,
+        retry_max=conf.AUTOMATION_RETRY_MAX_SECONDS,
+    )
+    service.dispatcher = dispatcher
+    # Automations created before next_run_at existed (a no-op once migrated)
+    await asyncio.to_thread(service.schedule_unscheduled)
+    # Runs missed while we were down are caught up on the first pass
+    dispatcher.start(catch_up=conf.AUTOMATION_CATCHUP_ON_STARTUP)
+    app.state.dispatcher = dispatcher
 
-    # Re-sync automations (loads jobs into the scheduler)
-    service = AutomationService(scheduler=sched)
-    service.resync_all()
+    # Load the ledger (from its saved snapshot when there is one) before the first request needs it
+    app.state.ledger_warmup = asyncio.create_task(_warm_ledger())
 
 
+async def _warm_ledger():
+    try:
+        await asyncio.to_thread(warm_ledger, conf.BEANCOUNT_FILE)
+    except Exception:
+        logger.exception("Failed to warm up the ledger cache")
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    sched = getattr(app.state, "scheduler", None)
-    if sched:
-        sched.shutdown(wait=False)
+    dispatcher = getattr(app.state, "dispatcher", None)
+    if dispatcher:
+        dispatcher.stop()
+
+    # Flush queued ledger appends, then stop the process that writes them
+    stop_ledger_writers()
+    try:
+        persist_ledger_snapshots()
+    except Exception:
+        logger.exception("Failed to save ledger snapshots")
+    stop_ledger_worker()
+
+    client = getattr(app.state, "openai_client", None)
+    if client:
+        await client.close()
 
 
 app.include_router(automation.router)
-app.include_router(llm.router)
\ No newline at end of file
+app.include_router(llm.router)
+app.include_router(ledger.router)
+if conf.METRICS_ENABLED:
+    app.include_router(metrics.router)
\ No newline at end of file
@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# Keep the tests off the real ledger directory, database and log file
+_tmp = tempfile.mkdtemp(prefix="beanbrain-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_tmp}/automations.db",
+    LEDGER_SNAPSHOT_DIR="",
+    ANALYTICS_TABLE_DIR="",
+    LEDGER_JOURNAL_DIR="",
+    SCHEDULER_LOCK_FILE=os.path.join(_tmp, "scheduler.lock"),
+    LEDGER_WORKER_PROCESS="0",
+    LOG_FILE_PATH=os.path.join(_tmp, "logs", "beanbrain.log"),
+)
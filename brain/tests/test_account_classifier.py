@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import pytest
+
+from core.account_classifier import extract_amount, extract_currency, known_currencies
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("rent 1,200.00", Decimal("1200.00")),
+    ("groceries 1,250.00", Decimal("1250.00")),
+    ("salary 12,345,678.90", Decimal("12345678.90")),
+    ("spotify 9.99", Decimal("9.99")),
+    ("lunch 23,50", Decimal("23.50")),
+    ("taxi 12", Decimal("12")),
+])
+def test_extract_amount(text, expected):
+    assert extract_amount(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "2 coffees at starbucks 9.50",
+    "split 30 of 60",
+    "coffee at starbucks",
+])
+def test_extract_amount_needs_exactly_one_number(text):
+    assert extract_amount(text) is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("KFC 12.50", None),
+    ("ATM withdrawal 200", None),
+    ("KFC 12.50 EUR", "EUR"),
+    ("lunch 5 euros", "EUR"),
+    ("coffee 3 GBP", None),
+    ("books $20", "USD"),
+])
+def test_extract_currency_only_accepts_known_codes(text, expected):
+    assert extract_currency(text, known={"USD", "EUR"}) == expected
+
+
+def test_known_currencies(tmp_path):
+    ledger = tmp_path / "ledger.beancount"
+    ledger.write_text(
+        'option "operating_currency" "USD"\n'
+        "2020-01-01 commodity EUR\n"
+        "2020-01-01 open Assets:Cash LBP\n"
+        "2020-01-01 open Expenses:Food\n"
+    )
+    assert known_currencies(str(ledger)) == {"USD", "EUR", "LBP"}
@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+import pytest
+
+import core.automation_service as automation_service
+from core.automation_service import AutomationService
+from core.beancount_service import BatchValidationError
+from core.ledger_writer import stop_ledger_writers
+from domain.schemas.automation import AutomationDB
+from domain.schemas.database import Base, engine
+from infrastructure.scheduler.scheduler_service import MISFIRE_GRACE, AutomationDispatcher, LeaderLock, as_utc
+
+SCHEDULED = datetime(2025, 1, 1, 9, tzinfo=timezone.utc)
+NOW = datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+
+class FailingWriter:
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def submit(self, transactions, auto_open_accounts=True) -> Future:
+        future = Future()
+        future.set_exception(self.error)
+        return future
+
+
+class BrokenWriter:
+    def submit(self, transactions, auto_open_accounts=True) -> Future:
+        raise OSError(28, "No space left on device")
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    path = tmp_path / "ledger.beancount"
+    path.write_text("2020-01-01 open Assets:Checking\n2020-01-01 open Expenses:Rent\n")
+    monkeypatch.setattr(automation_service, "BEANCOUNT_FILE", str(path))
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield path
+    stop_ledger_writers()
+
+
+@pytest.fixture
+def rent(ledger) -> AutomationDB:
+    return AutomationService().repo.create(AutomationDB(
+        name="rent",
+        cron_expression="0 9 1 * *",
+        timezone="UTC",
+        payload={"amount": 1200, "currency": "USD", "from": "Assets:Checking", "to": "Expenses:Rent"},
+        next_run_at=SCHEDULED,
+    ))
+
+
+def test_transient_failure_leaves_automation_due(ledger, rent, monkeypatch):
+    service = AutomationService()
+    with monkeypatch.context() as m:
+        m.setattr(automation_service, "get_ledger_writer", lambda path: FailingWriter(RuntimeError("Ledger worker died")))
+        result = service.run_due(NOW)
+
+    assert result.failed == {rent.id: ["Ledger worker died"]}
+    assert as_utc(service.repo.get(rent.id).next_run_at) == SCHEDULED
+
+    # The next pass catches the run up
+    result = service.run_due(NOW)
+    assert result.appended == 1 and not result.failed
+    assert ledger.read_text().count("Expenses:Rent  ") == 1
+    assert as_utc(service.repo.get(rent.id).next_run_at) == datetime(2025, 2, 1, 9, tzinfo=timezone.utc)
+
+
+def test_invalid_run_is_skipped(ledger, rent, monkeypatch):
+    service = AutomationService()
+    error = BatchValidationError({0: ["Invalid currency"]}, [])
+    monkeypatch.setattr(automation_service, "get_ledger_writer", lambda path: FailingWriter(error))
+    result = service.run_due(NOW)
+
+    assert result.failed == {rent.id: ["Invalid currency"]}
+    assert as_utc(service.repo.get(rent.id).next_run_at) == datetime(2025, 2, 1, 9, tzinfo=timezone.utc)
+
+
+def test_dispatcher_backs_off_while_writes_fail(ledger, rent, monkeypatch):
+    monkeypatch.setattr(automation_service, "get_ledger_writer", lambda path: BrokenWriter())
+    service = AutomationService()
+    passes = []
+
+    def run_due(now, skip_before):
+        passes.append(time.monotonic())
+        return service.run_due(now, skip_before)
+
+    dispatcher = AutomationDispatcher(run_due, service.next_due_at, retry_min=0.05, retry_max=0.2)
+    dispatcher.start()
+    time.sleep(0.6)
+    dispatcher.stop()
+
+    # Waits of 0.05, 0.1, 0.2, 0.2, ... instead of back-to-back passes
+    assert 3 <= len(passes) <= 6
+    gaps = [b - a for a, b in zip(passes, passes[1:])]
+    assert gaps[0] >= 0.05 and gaps[1] >= 0.1
+    assert as_utc(service.repo.get(rent.id).next_run_at) == SCHEDULED
+
+
+def test_follower_skips_runs_missed_before_it_took_over(tmp_path):
+    lock = tmp_path / "scheduler.lock"
+    leader = LeaderLock(str(lock))
+    assert leader.try_acquire()
+    cutoffs = []
+    dispatcher = AutomationDispatcher(lambda now, skip_before: cutoffs.append(skip_before), lambda: None,
+                                      leader=LeaderLock(str(lock)), leader_retry=0.05)
+    dispatcher.start(catch_up=False)
+    time.sleep(0.3)
+    took_over = datetime.now(timezone.utc)
+    leader.release()
+    time.sleep(0.3)
+    dispatcher.stop()
+
+    assert cutoffs[0] >= took_over - MISFIRE_GRACE
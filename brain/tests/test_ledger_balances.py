@@ -0,0 +1,82 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from core.beancount_service import append_many, build_transaction
+from core.ledger_balances import BalanceView, get_account_balance, get_balances
+from core.ledger_cache import LedgerCache, ledger_cache
+
+LEDGER = """2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:Food:Groceries
+2020-01-01 open Expenses:Food:Bakery
+2020-01-01 open Expenses:Rent
+
+2025-01-05 * "Groceries"
+  Expenses:Food:Groceries  20.00 EUR
+  Assets:Checking
+
+2025-01-20 * "Bakery"
+  Expenses:Food:Bakery  4.50 EUR
+  Assets:Checking
+
+2025-02-01 * "Rent"
+  Expenses:Rent  800.00 EUR
+  Assets:Checking
+
+2025-02-03 * "Groceries"
+  Expenses:Food:Groceries  30.00 EUR
+  Assets:Checking
+"""
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    return str(path)
+
+
+def test_balances_of_accounts_and_their_parents(ledger):
+    exact = get_balances(ledger)["balances"]
+    assert exact["Expenses:Food:Groceries"] == {"EUR": Decimal("50.00")}
+    assert exact["Assets:Checking"] == {"EUR": Decimal("-854.50")}
+    assert "Expenses:Food" not in exact
+
+    rolled_up = get_balances(ledger, include_subaccounts=True)["balances"]
+    assert rolled_up["Expenses:Food"] == {"EUR": Decimal("54.50")}
+    assert rolled_up["Expenses"] == {"EUR": Decimal("854.50")}
+
+    january = get_balances(ledger, as_of=date(2025, 1, 31), include_subaccounts=True)["balances"]
+    assert january["Expenses"] == {"EUR": Decimal("24.50")}
+
+
+def test_account_history_per_month(ledger):
+    result = get_account_balance(ledger, "Expenses:Food", include_subaccounts=True, interval="month",
+                                 start=date(2025, 1, 15))
+    assert result["balance"] == {"EUR": Decimal("54.50")}
+    assert result["series"] == [
+        {"period": "2025-01", "change": {"EUR": Decimal("24.50")}, "balance": {"EUR": Decimal("24.50")}},
+        {"period": "2025-02", "change": {"EUR": Decimal("30.00")}, "balance": {"EUR": Decimal("54.50")}},
+    ]
+    assert get_account_balance(ledger, "Expenses:Travel") is None
+
+
+def test_appends_extend_the_view_like_a_rebuild(ledger):
+    view = ledger_cache.view(ledger, "balances")
+    append_many(ledger, [
+        build_transaction(date(2025, 2, 10), [("Expenses:Food:Bakery", 3, "EUR"), ("Assets:Checking", None, None)]),
+        # Back-dated, and to an account (and currency) the view hasn't seen
+        build_transaction(date(2025, 1, 10), [("Expenses:Travel:Train", 40, "USD"), ("Assets:Checking", None, None)]),
+    ])
+    assert ledger_cache.view(ledger, "balances") is view
+
+    rebuilt = BalanceView(LedgerCache().get(ledger))
+    for sub in (False, True):
+        assert view.accounts(sub) == rebuilt.accounts(sub)
+        for acct in view.accounts(sub):
+            assert view.balance(acct, include_subaccounts=sub) == rebuilt.balance(acct, include_subaccounts=sub)
+            assert view.balance(acct, date(2025, 1, 31), sub) == rebuilt.balance(acct, date(2025, 1, 31), sub)
+            for interval in ("day", "month"):
+                assert view.series(acct, interval, sub) == rebuilt.series(acct, interval, sub)
+    assert view.balance("Expenses", date(2025, 1, 31), True) == {"EUR": Decimal("24.50"), "USD": Decimal("40")}
@@ -0,0 +1,63 @@
+import pytest
+
+from core.ledger_cache import LedgerCache
+
+LEDGER = """2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:Food
+
+2025-01-05 * "Groceries"
+  Expenses:Food  20.00 EUR
+  Assets:Checking
+"""
+
+TXN = """
+2025-01-06 * "Bakery"
+  Expenses:Food  4.50 EUR
+  Assets:Checking
+"""
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    return path
+
+
+def test_snapshot_is_reused_until_the_file_changes(ledger):
+    cache = LedgerCache()
+    first = cache.get(str(ledger))
+    assert cache.get(str(ledger)) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    with ledger.open("a") as f:
+        f.write(TXN)
+    second = cache.get(str(ledger))
+    assert second.version > first.version
+    assert len(second.entries) == len(first.entries) + 1
+    assert cache.misses == 2
+
+
+def test_edit_to_an_included_file_invalidates(ledger, tmp_path):
+    included = tmp_path / "more.beancount"
+    included.write_text("2020-01-01 open Assets:Cash\n")
+    with ledger.open("a") as f:
+        f.write('include "more.beancount"\n')
+    cache = LedgerCache()
+    first = cache.get(str(ledger))
+
+    included.write_text("2020-01-01 open Assets:Cash\n2020-01-01 open Assets:Wallet\n")
+    assert cache.get(str(ledger)).version > first.version
+
+
+def test_views_are_built_once_per_version(ledger):
+    cache = LedgerCache()
+    builds = []
+    cache.register_view("count", lambda snapshot: builds.append(snapshot.version) or len(snapshot.entries))
+
+    assert cache.view(str(ledger), "count") == 3
+    assert cache.view(str(ledger), "count") == 3
+    with ledger.open("a") as f:
+        f.write(TXN)
+    assert cache.view(str(ledger), "count") == 4
+    assert len(builds) == 2
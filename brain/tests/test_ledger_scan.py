@@ -0,0 +1,68 @@
+from beancount import loader
+from beancount.core import data
+
+from core.ledger_scan import DirectiveScanner
+
+LEDGER = """option "operating_currency" "EUR"
+include "accounts/*.beancount"
+
+2020-01-01 open Assets:Checking EUR ; Main account
+2020-01-01 open Assets:Broker EUR,USD "FIFO"
+2020-01-01 open Expenses:Old
+2024-12-31 close Expenses:Old
+
+2025-01-05 * "Groceries"
+  Expenses:Food  20.00 EUR
+  Assets:Checking
+"""
+
+ACCOUNTS = """2020-01-01 commodity EUR
+2021-03-01 open Expenses:Food   ; Groceries and restaurants
+"""
+
+
+def write_ledger(tmp_path, text=LEDGER):
+    (tmp_path / "accounts").mkdir(exist_ok=True)
+    (tmp_path / "accounts" / "expenses.beancount").write_text(ACCOUNTS)
+    path = tmp_path / "ledger.beancount"
+    path.write_text(text)
+    return path
+
+
+def test_scan_finds_what_the_parser_does(tmp_path):
+    path = write_ledger(tmp_path)
+    scan = DirectiveScanner().scan(str(path))
+
+    entries, errors, _ = loader.load_file(str(path))
+    assert errors == []
+    parsed = {e.account: e for e in entries if isinstance(e, data.Open)}
+    assert sorted(scan.opens) == sorted(parsed)
+    for account, open_line in scan.opens.items():
+        assert open_line.date == parsed[account].date
+        assert list(open_line.currencies) == (parsed[account].currencies or [])
+        assert open_line.booking == (parsed[account].booking.name if parsed[account].booking else None)
+        assert (open_line.filename, open_line.lineno) == (parsed[account].meta["filename"], parsed[account].meta["lineno"])
+    assert scan.closes == {e.account: e.date for e in entries if isinstance(e, data.Close)}
+    assert list(scan.commodities) == ["EUR"]
+    assert scan.comments() == {"Assets:Checking": "Main account", "Expenses:Food": "Groceries and restaurants"}
+    assert not scan.synthesizes_opens
+
+
+def test_only_changed_files_are_scanned_again(tmp_path):
+    path = write_ledger(tmp_path)
+    scanner = DirectiveScanner()
+    first = scanner.scan(str(path))
+    assert scanner.files_scanned == 2
+    assert scanner.scan(str(path)) is first
+
+    with path.open("a") as f:
+        f.write("\n2025-02-01 open Expenses:Travel ; Trips\n")
+    second = scanner.scan(str(path))
+    assert scanner.files_scanned == 3
+    assert second.comments()["Expenses:Travel"] == "Trips"
+    assert (scanner.hits, scanner.misses) == (1, 2)
+
+
+def test_plugins_that_open_accounts_are_flagged(tmp_path):
+    path = write_ledger(tmp_path, 'plugin "beancount.plugins.auto_accounts"\n' + LEDGER)
+    assert DirectiveScanner().scan(str(path)).synthesizes_opens
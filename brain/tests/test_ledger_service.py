@@ -0,0 +1,57 @@
+from datetime import date
+
+import pytest
+
+import conf
+from core.idempotency import IdempotencyService
+from core.ledger_service import LedgerService
+from core.ledger_writer import stop_ledger_writers
+from domain.models.dtos import BatchAppendIn
+from domain.schemas.database import Base, engine
+
+BODY = BatchAppendIn(transactions=[{
+    "date": date(2025, 3, 1),
+    "narration": "Groceries",
+    "postings": [
+        {"account": "Expenses:Food", "amount": "12.50", "currency": "EUR"},
+        {"account": "Assets:Checking"},
+    ],
+}])
+
+
+def die(*args, **kwargs):
+    raise SystemExit
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text("2020-01-01 open Assets:Checking\n")
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield str(path)
+    stop_ledger_writers()
+
+
+def test_replay_reports_opened_accounts(ledger):
+    service = LedgerService(ledger)
+    first = service.append_batch(BODY, "key-1")
+    assert first.opened_accounts == ["Expenses:Food"]
+
+    assert service.append_batch(BODY, "key-1") == first
+    assert open(ledger).read().count("Groceries") == 1
+
+
+def test_replay_after_abandoned_write(ledger, monkeypatch):
+    service = LedgerService(ledger)
+    # The first request wrote, then died before completing its key
+    with monkeypatch.context() as m:
+        m.setattr(IdempotencyService, "complete", die)
+        with pytest.raises(SystemExit):
+            service.append_batch(BODY, "key-1")
+    monkeypatch.setattr(conf, "IDEMPOTENCY_PENDING_SECONDS", 0)
+
+    replay = service.append_batch(BODY, "key-1")
+    # Recovered from the ledger: which accounts the write opened isn't known
+    assert replay.appended == 1 and replay.opened_accounts is None
+    assert open(ledger).read().count("Groceries") == 1
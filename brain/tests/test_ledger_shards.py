@@ -0,0 +1,119 @@
+import os
+from collections import Counter
+from datetime import date
+
+import pytest
+from beancount import loader
+from beancount.core import compare
+from beancount.parser import parser
+
+from core.beancount_service import append_many, build_transaction
+from core.ledger_cache import LedgerCache, ledger_cache
+from core.ledger_shards import ShardedLoader, migrate
+
+LEDGER = """option "operating_currency" "EUR"
+2023-01-01 open Assets:Bank EUR
+2023-01-01 open Expenses:Food EUR
+
+2023-05-01 * "Shop" "Food"
+  Expenses:Food  10.00 EUR
+  Assets:Bank
+
+2024-05-01 * "Shop" "Food"
+  Expenses:Food  12.00 EUR
+  Assets:Bank
+"""
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    return path
+
+
+def load_hashes(path) -> Counter:
+    entries, errors, _ = loader.load_file(str(path))
+    assert errors == []
+    return Counter(compare.hash_entry(e, exclude_meta=True) for e in entries)
+
+
+def count_parses(monkeypatch):
+    parsed = []
+    parse_file = parser.parse_file
+
+    def counting(filename, *args, **kwargs):
+        parsed.append(filename)
+        return parse_file(filename, *args, **kwargs)
+
+    monkeypatch.setattr(parser, "parse_file", counting)
+    return parsed
+
+
+def test_unsharded_ledger_is_parsed_once(tmp_path, monkeypatch):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    (tmp_path / "accounts.beancount").write_text("2023-01-01 open Assets:Cash EUR\n")
+    with path.open("a") as f:
+        f.write('include "accounts.beancount"\n')
+    parsed = count_parses(monkeypatch)
+
+    snapshot = LedgerCache().get(str(path))
+
+    assert len(snapshot.entries) == 5
+    assert parsed.count(str(path)) == 1
+
+
+def test_migration_loads_like_the_original(ledger, tmp_path):
+    before = load_hashes(ledger)
+    inode = os.stat(ledger).st_ino
+
+    result = migrate(str(ledger))
+
+    shard_dir = tmp_path / "ledger"
+    assert sorted(result["shards"]) == sorted({2023, 2024, date.today().year})
+    assert result["shards"][2023] == str(shard_dir / "2023.beancount")
+    assert open(result["backup"]).read() == LEDGER
+    # Rewritten in place, so a bind mount still points at it
+    assert os.stat(ledger).st_ino == inode
+    assert "Shop" not in ledger.read_text()
+    assert load_hashes(ledger) == before
+
+    with pytest.raises(ValueError):
+        migrate(str(ledger), str(tmp_path / "again"))
+
+
+def test_appends_go_to_the_active_shard(ledger, tmp_path):
+    migrate(str(ledger))
+    root = ledger.read_text()
+    active = tmp_path / "ledger" / f"{date.today().year}.beancount"
+
+    append_many(str(ledger), [build_transaction(
+        date.today(), [("Expenses:Food", 3, "EUR"), ("Assets:Bank", None, None)], narration="Coffee",
+    )])
+
+    assert ledger.read_text() == root
+    assert "Coffee" in active.read_text()
+    assert ledger_cache.get(str(ledger)).target == str(active)
+    assert len(ledger_cache.get(str(ledger)).entries) == len(LedgerCache().get(str(ledger)).entries) == 5
+
+
+def test_closed_shards_are_reused_until_they_change(ledger, tmp_path):
+    migrate(str(ledger))
+    shards = tmp_path / "ledger"
+    active = shards / f"{date.today().year}.beancount"
+    loader_ = ShardedLoader()
+
+    first = loader_.load(str(ledger))
+    with active.open("a") as f:
+        f.write(f'\n{date.today().isoformat()} * "Coffee"\n  Expenses:Food  3.00 EUR\n  Assets:Bank\n')
+    second = loader_.load(str(ledger))
+    assert len(second.entries) == len(first.entries) + 1
+    assert second.errors == []
+    assert loader_.stats() == {"closed_hits": 1, "closed_misses": 1}
+
+    with (shards / "2023.beancount").open("a") as f:
+        f.write('\n2023-06-01 * "Shop" "Food"\n  Expenses:Food  1.00 EUR\n  Assets:Bank\n')
+    third = loader_.load(str(ledger))
+    assert len(third.entries) == len(second.entries) + 1
+    assert loader_.stats()["closed_misses"] == 2
@@ -0,0 +1,85 @@
+import pytest
+from beancount.core import compare
+from beancount.parser import parser
+
+from core.ledger_cache import LedgerCache
+from core.ledger_store import SnapshotStore
+
+LEDGER = """2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:Food
+
+2025-01-05 * "Groceries"
+  Expenses:Food  20.00 EUR
+  Assets:Checking
+"""
+
+TXN = """
+2025-01-06 * "Bakery"
+  Expenses:Food  4.50 EUR
+  Assets:Checking
+"""
+
+
+def count_entries(snapshot):
+    return len(snapshot.entries)
+
+
+def new_cache(store: SnapshotStore) -> LedgerCache:
+    """A cache as a freshly started process would have it."""
+    cache = LedgerCache()
+    cache.register_view("count", count_entries, lambda count, snapshot, new: count + len(new))
+    cache.store = store
+    return cache
+
+
+def hashes(snapshot):
+    return [compare.hash_entry(e) for e in snapshot.entries]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    return path
+
+
+@pytest.fixture
+def store(tmp_path, ledger):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    cache = new_cache(store)
+    assert cache.view(str(ledger), "count") == 3
+    cache.persist()
+    return store
+
+
+def test_unchanged_ledger_is_restored_without_parsing(ledger, store, monkeypatch):
+    monkeypatch.setattr(parser, "parse_file", lambda *args, **kwargs: pytest.fail("parsed the ledger"))
+    cache = new_cache(store)
+
+    snapshot = cache.get(str(ledger))
+    assert len(snapshot.entries) == 3
+    assert cache.view(str(ledger), "count") == 3
+    assert store.restores == 1
+
+
+def test_appended_tail_is_replayed_onto_the_snapshot(ledger, store):
+    # Appended by something else while the service was down
+    with ledger.open("a") as f:
+        f.write(TXN)
+    cache = new_cache(store)
+
+    restored = cache.get(str(ledger))
+    parsed = LedgerCache().get(str(ledger))
+    assert store.restores == 1
+    assert hashes(restored) == hashes(parsed)
+    assert (restored.digest, restored.line_count) == (parsed.digest, parsed.line_count)
+    assert cache.view(str(ledger), "count") == 4
+
+
+def test_rewritten_ledger_is_parsed_again(ledger, store):
+    ledger.write_text(LEDGER.replace("20.00", "25.00"))
+    cache = new_cache(store)
+
+    snapshot = cache.get(str(ledger))
+    assert (store.restores, store.rejected) == (0, 1)
+    assert hashes(snapshot) == hashes(LedgerCache().get(str(ledger)))
@@ -0,0 +1,78 @@
+from datetime import date
+
+import pytest
+from beancount.core import compare
+
+from core.beancount_service import BatchValidationError, append_many, build_transaction
+from core.ledger_cache import LedgerCache, ledger_cache
+from core.ledger_validation import validate_block
+
+LEDGER = """option "operating_currency" "EUR"
+2020-01-01 open Assets:Checking EUR
+2020-01-01 open Expenses:Food
+2020-01-01 open Expenses:Old
+2024-12-31 close Expenses:Old
+
+2025-01-05 * "Groceries"
+  Expenses:Food  20.00 EUR
+  Assets:Checking
+"""
+
+BAD_BLOCKS = {
+    "unbalanced": '\n2025-02-01 * "Lunch"\n  Expenses:Food  10.00 EUR\n  Assets:Checking  -9.00 EUR\n',
+    "unknown account": '\n2025-02-01 * "Lunch"\n  Expenses:Restaurants  10.00 EUR\n  Assets:Checking\n',
+    "closed account": '\n2025-02-01 * "Lunch"\n  Expenses:Old  10.00 EUR\n  Assets:Checking\n',
+    "disallowed currency": '\n2025-02-01 * "Lunch"\n  Expenses:Food  10.00 USD\n  Assets:Checking\n',
+    "duplicate open": "\n2021-01-01 open Expenses:Food\n",
+}
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    return str(path)
+
+
+@pytest.mark.parametrize("mode", ["incremental", "full"])
+@pytest.mark.parametrize("block", sorted(BAD_BLOCKS))
+def test_bad_block_is_rejected(ledger, mode, block):
+    _, errors = validate_block(ledger_cache.get(ledger), BAD_BLOCKS[block], mode)
+    assert errors
+
+
+@pytest.mark.parametrize("mode", ["incremental", "full"])
+def test_good_block_passes(ledger, mode):
+    text = '\n2025-02-01 * "Lunch"\n  Expenses:Food  10.00 EUR\n  Assets:Checking\n'
+    booked, errors = validate_block(ledger_cache.get(ledger), text, mode)
+    assert errors == []
+    if mode == "incremental":
+        # Booked, with the elided amount filled in
+        assert booked[0].postings[1].units.number == -10
+
+
+def test_batch_error_names_the_failing_transaction(ledger):
+    ok = build_transaction(date(2025, 2, 1), [("Expenses:Food", 5, "EUR"), ("Assets:Checking", None, None)])
+    bad = build_transaction(date(2025, 2, 2), [("Expenses:Old", 5, "EUR"), ("Assets:Checking", None, None)])
+    with pytest.raises(BatchValidationError) as e:
+        append_many(ledger, [ok, bad], auto_open_accounts=False)
+    assert list(e.value.item_errors) == [1]
+    assert open(ledger).read() == LEDGER
+
+
+def test_extended_snapshot_matches_a_full_parse(ledger):
+    before = ledger_cache.get(ledger)
+    extensions = ledger_cache.extensions
+    for day in (1, 2):
+        append_many(ledger, [build_transaction(
+            date(2025, 3, day), [("Expenses:Coffee", 3, "EUR"), ("Assets:Checking", None, None)], narration="Coffee",
+        )])
+    extended = ledger_cache.get(ledger)
+    assert ledger_cache.extensions == extensions + 2
+    assert extended.line_count > before.line_count
+
+    parsed = LedgerCache().get(ledger)
+    assert [compare.hash_entry(e) for e in extended.entries] == [compare.hash_entry(e) for e in parsed.entries]
+    assert (extended.digest, extended.line_count) == (parsed.digest, parsed.line_count)
+    opens = ledger_cache.view(ledger, "validation").opens
+    assert "Expenses:Coffee" in opens
@@ -0,0 +1,88 @@
+import os
+from datetime import date
+
+import pytest
+
+import conf
+from core.beancount_service import BatchValidationError, build_transaction
+from core.ledger_cache import ledger_cache
+from core.ledger_fingerprints import count_transactions, transaction_fingerprint
+from core.ledger_worker import LedgerWorker
+from core.profiling import add_stage_observer, remove_stage_observer
+
+COUNT = "core.ledger_fingerprints.count_transactions"
+
+
+LEDGER = """2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:Food
+
+2025-01-05 * "Bakery"
+  Expenses:Food  4.50 EUR
+  Assets:Checking
+"""
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    return str(path)
+
+
+@pytest.fixture
+def worker():
+    worker = LedgerWorker()
+    yield worker
+    worker.stop()
+
+
+def test_hung_call_times_out_and_restarts_the_worker(worker, tmp_path, monkeypatch):
+    ledger = tmp_path / "ledger.beancount"
+    ledger.write_text("2020-01-01 open Assets:Checking\n")
+    # Started (and its modules imported) before the deadline gets short
+    assert worker.call(COUNT, (str(ledger), ["x"])) == [0]
+
+    # Opening a FIFO nobody writes to blocks forever
+    fifo = tmp_path / "hung.beancount"
+    os.mkfifo(fifo)
+    monkeypatch.setattr(conf, "LEDGER_WORKER_TIMEOUT_SECONDS", 0.5)
+    with pytest.raises(TimeoutError):
+        worker.call(COUNT, (str(fifo), ["x"]))
+    assert not worker.stats()["alive"]
+
+    monkeypatch.setattr(conf, "LEDGER_WORKER_TIMEOUT_SECONDS", 60)
+    assert worker.call(COUNT, (str(ledger), ["x"])) == [0]
+    assert worker.stats()["restarts"] == 1
+
+
+def test_results_match_the_in_process_call(worker, ledger):
+    bakery = transaction_fingerprint(ledger_cache.get(ledger).entries[-1])
+    assert worker.call(COUNT, (ledger, [bakery, "x"])) == count_transactions(ledger, [bakery, "x"]) == [1, 0]
+    assert worker.stats()["calls"] == 1
+
+
+def test_errors_and_stage_timings_come_back_from_the_worker(worker, ledger):
+    stages = []
+    observer = lambda stage, seconds, labels: stages.append(stage)
+    add_stage_observer(observer)
+    try:
+        bad = build_transaction(date(2025, 2, 1), [("Expenses:Travel", 5, "EUR"), ("Assets:Checking", None, None)])
+        with pytest.raises(BatchValidationError) as e:
+            worker.call("core.beancount_service.append_many", (ledger, [bad]), {"auto_open_accounts": False})
+    finally:
+        remove_stage_observer(observer)
+
+    assert list(e.value.item_errors) == [0]
+    assert "ledger_parse" in stages
+    assert open(ledger).read() == LEDGER
+
+
+def test_dead_worker_is_restarted(worker, ledger):
+    assert worker.call(COUNT, (ledger, ["x"])) == [0]
+    pid = worker.stats()["pid"]
+    worker._process.kill()
+    worker._process.join(5)
+
+    assert worker.call(COUNT, (ledger, ["x"])) == [0]
+    assert worker.stats()["restarts"] == 1
+    assert worker.stats()["pid"] != pid
@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+
+from core.beancount_service import BatchValidationError, build_transaction
+from core.ledger_writer import LedgerWriter
+
+LEDGER = """2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:Food
+"""
+
+
+def txn(account: str, amount, narration: str):
+    return build_transaction(date(2025, 1, 5), [(account, amount, "EUR"), ("Assets:Checking", None, None)],
+                             narration=narration)
+
+
+@pytest.fixture
+def writer(tmp_path):
+    path = tmp_path / "ledger.beancount"
+    path.write_text(LEDGER)
+    writer = LedgerWriter(str(path), window_ms=200)
+    yield writer
+    writer.stop()
+
+
+def test_concurrent_requests_share_one_commit(writer):
+    futures = [writer.submit([txn("Expenses:Food", 5 + i, f"Lunch {i}")], auto_open_accounts=False) for i in range(3)]
+
+    assert [f.result(5) for f in futures] == [{"appended": 1, "opened_accounts": []}] * 3
+    assert (writer.batches, writer.requests) == (1, 3)
+    text = open(writer.ledger_path).read()
+    assert all(f"Lunch {i}" in text for i in range(3))
+
+
+def test_failing_request_is_rejected_alone(writer):
+    good = writer.submit([txn("Expenses:Food", 5, "Lunch")], auto_open_accounts=False)
+    # Unknown account, and this request doesn't open accounts
+    bad = writer.submit([txn("Expenses:Food", 1, "Snack"), txn("Expenses:Travel", 50, "Train")],
+                        auto_open_accounts=False)
+    other = writer.submit([txn("Expenses:Food", 7, "Dinner")], auto_open_accounts=False)
+
+    with pytest.raises(BatchValidationError) as e:
+        bad.result(5)
+    # Indexes are the request's own
+    assert list(e.value.item_errors) == [1]
+    assert good.result(5)["appended"] == 1 and other.result(5)["appended"] == 1
+    text = open(writer.ledger_path).read()
+    assert "Lunch" in text and "Dinner" in text
+    assert "Snack" not in text and "Train" not in text
+
+
+def test_opened_accounts_are_reported_to_the_request_that_used_them(writer):
+    plain = writer.submit([txn("Expenses:Food", 5, "Lunch")])
+    travel = writer.submit([txn("Expenses:Travel", 50, "Train")])
+
+    assert plain.result(5)["opened_accounts"] == []
+    assert travel.result(5)["opened_accounts"] == ["Expenses:Travel"]
+    assert writer.batches == 1
@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from core.llm_service import LLMTransactionService
+
+
+class UnusedClient:
+    class chat:
+        class completions:
+            @staticmethod
+            async def create(**kwargs):
+                raise AssertionError("the model shouldn't be called")
+
+
+def test_single_call_without_accounts_fails_before_calling_the_model(tmp_path):
+    ledger = tmp_path / "ledger.beancount"
+    ledger.write_text('option "operating_currency" "EUR"\n')
+    service = LLMTransactionService(UnusedClient)
+    service.ledger_path = str(ledger)
+
+    with pytest.raises(ValueError, match="no open accounts"):
+        asyncio.run(service.infer_transaction("coffee 3.50"))
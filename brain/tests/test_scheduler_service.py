@@ -0,0 +1,87 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from infrastructure.scheduler.scheduler_service import (
+    AutomationDispatcher,
+    LeaderLock,
+    exclusive_lock,
+    missed_run_times,
+    next_run_time,
+)
+
+
+def test_only_one_process_leads_until_it_releases(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    assert (first.is_leader, second.is_leader) == (True, False)
+
+    first.release()
+    assert second.try_acquire()
+    second.release()
+
+
+def test_follower_does_not_dispatch(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    leader = LeaderLock(path)
+    assert leader.try_acquire()
+    passes = []
+    dispatcher = AutomationDispatcher(lambda now, skip_before: passes.append(now), lambda: None,
+                                      leader=LeaderLock(path), leader_retry=0.05)
+    dispatcher.start()
+    time.sleep(0.3)
+    assert passes == []
+
+    leader.release()
+    time.sleep(0.3)
+    dispatcher.stop()
+    assert len(passes) == 1
+
+
+def test_wake_rereads_the_earliest_due_time(tmp_path):
+    passes = []
+    dispatcher = AutomationDispatcher(lambda now, skip_before: passes.append(now), lambda: None, max_idle=60)
+    dispatcher.start()
+    time.sleep(0.1)
+    dispatcher.wake()
+    time.sleep(0.1)
+    dispatcher.stop()
+    assert len(passes) == 2
+
+
+def test_exclusive_lock_serializes_holders(tmp_path):
+    path = str(tmp_path / "schema.lock")
+    events = []
+
+    def hold(name):
+        with exclusive_lock(path):
+            events.append(f"{name} in")
+            time.sleep(0.1)
+            events.append(f"{name} out")
+
+    threads = [threading.Thread(target=hold, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert events[1] == events[0].replace("in", "out")
+
+
+def test_schedules_follow_their_timezone():
+    # 09:00 in Berlin is 08:00 UTC in winter and 07:00 UTC in summer
+    winter = datetime(2025, 1, 10, 12, tzinfo=timezone.utc)
+    summer = datetime(2025, 7, 10, 12, tzinfo=timezone.utc)
+    assert next_run_time("0 9 * * *", "Europe/Berlin", winter) == datetime(2025, 1, 11, 8, tzinfo=timezone.utc)
+    assert next_run_time("0 9 * * *", "Europe/Berlin", summer) == datetime(2025, 7, 11, 7, tzinfo=timezone.utc)
+    assert next_run_time("0 9 * * *", None, winter) == datetime(2025, 1, 11, 9, tzinfo=timezone.utc)
+
+
+def test_missed_runs_are_bounded_and_oldest_first():
+    # Naive values are UTC, as read back from SQLite
+    missed = missed_run_times("0 9 * * *", None, datetime(2025, 1, 1, 9), datetime(2025, 1, 4, 9, tzinfo=timezone.utc),
+                              limit=10)
+    assert [t.day for t in missed] == [2, 3, 4]
+    assert len(missed_run_times("0 9 * * *", None, datetime(2025, 1, 1), datetime(2025, 2, 1), limit=5)) == 5